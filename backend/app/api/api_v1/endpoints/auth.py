@@ -1,6 +1,6 @@
 from datetime import timedelta
 from typing import Any
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
@@ -9,17 +9,25 @@ from db.session import get_db
 from db.models import User
 from core import security
 from core.config import settings
+from core.rate_limit import client_ip, login_ip_limiter, login_limiter
 from schemas.token import Token
 
 router = APIRouter()
 
 @router.post("/login/access-token", response_model=Token)
 async def login_access_token(
+    request: Request,
     db: AsyncSession = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()
 ) -> Any:
     """
     OAuth2 compatible token login, get an access token for future requests
     """
+    # Checked before the DB lookup and Argon2 verify. Keyed on the client behind
+    # the proxy and the account, so one client guessing passwords can't lock others out
+    ip = client_ip(request)
+    await login_ip_limiter.enforce(f"ip:{ip}")
+    await login_limiter.enforce(f"ip:{ip}:user:{form_data.username.strip().lower()}")
+
     # Authenticate user
     result = await db.execute(select(User).filter(User.email == form_data.username))
     user = result.scalars().first()
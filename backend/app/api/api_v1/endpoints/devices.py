@@ -1,30 +1,93 @@
-from typing import Any, List, Dict
-from fastapi import APIRouter, Depends, HTTPException, Body
+from typing import Any, List, Dict, Optional
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import String, false, func, literal, or_, select, true, update
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from datetime import datetime
 
 from db.session import get_db
-from db.models import Device, User
-from schemas.device import Device as DeviceSchema, DeviceCreate, DeviceStateUpdate
+from db.models import Device, DeviceRelay, User
+from schemas.device import (
+    Device as DeviceSchema, DeviceCreate, DeviceStateUpdate,
+    BulkRelayCommand, BulkRelayResult, RelayOperationResult,
+)
 from api import deps
+from core.presence import presence
+from core.state_store import state_store
+from core.state_log import state_log
+from core.device_cache import device_cache
+from core.rate_limit import bulk_relay_limiter, relay_limiter
+from core.response_cache import response_cache
+from core.pagination import export_response, finish_page, keyset_page
+from core.relays import relay_rows, sync_relays, upsert_relays
+from core.relay_events import relay_events
 
 router = APIRouter()
 
+def _admin_filters(query, online: Optional[bool], owner_id: Optional[int], type: Optional[str],
+                   relay_on: Optional[str] = None):
+    # Each filter has a matching (column, id) index so keyset pages stay index scans;
+    # relay_on is served by the partial index on device_relays (rows that are on)
+    if relay_on is not None:
+        query = query.filter(Device.id.in_(
+            select(DeviceRelay.device_id).where(DeviceRelay.relay_key == relay_on, DeviceRelay.state)
+        ))
+    if online is not None:
+        query = query.filter(Device.online == online)
+    if owner_id is not None:
+        query = query.filter(Device.owner_id == owner_id)
+    if type is not None:
+        query = query.filter(Device.type == type)
+    return query
+
 @router.get("/admin/all", response_model=List[DeviceSchema])
 async def read_all_devices_admin(
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(deps.get_current_active_superuser),
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    online: Optional[bool] = None,
+    owner_id: Optional[int] = None,
+    type: Optional[str] = None,
+    relay_on: Optional[str] = None,
     skip: int = 0,
-    limit: int = 500,
 ) -> Any:
     """
-    [ADMIN] Retrieve ALL devices from all users.
+    [ADMIN] Retrieve ALL devices from all users, ordered by id.
+    Pass the `X-Next-Cursor` header (or follow `Link: rel="next"`) as `cursor`
+    for the next page. `skip` is kept for older clients; prefer `cursor`.
+    `relay_on=relay1` lists devices whose relay1 is currently on.
     """
-    result = await db.execute(
-        select(Device).offset(skip).limit(limit)
+    query = _admin_filters(select(Device), online, owner_id, type, relay_on)
+    if skip and not cursor:
+        query = query.offset(skip)
+    result = await db.execute(keyset_page(query, Device.id, cursor, limit))
+    devices = finish_page(result.scalars().all(), limit, lambda d: d.id, request, response)
+    return [state_store.apply(presence.apply(device)) for device in devices]
+
+@router.get("/admin/export")
+async def export_devices_admin(
+    current_user: User = Depends(deps.get_current_active_superuser),
+    format: str = "ndjson",
+    online: Optional[bool] = None,
+    owner_id: Optional[int] = None,
+    type: Optional[str] = None,
+    relay_on: Optional[str] = None,
+) -> Any:
+    """
+    [ADMIN] Stream every device as NDJSON or CSV (`format=ndjson|csv`), same filters as /admin/all.
+    """
+    return export_response(
+        _admin_filters(select(Device), online, owner_id, type, relay_on),
+        Device.id,
+        key=lambda d: d.id,
+        serialize=_serialize,
+        columns=list(DeviceSchema.model_fields),
+        fmt=format,
+        filename="devices",
     )
-    return result.scalars().all()
 
 @router.delete("/admin/{device_id}")
 async def admin_delete_device(
@@ -41,6 +104,11 @@ async def admin_delete_device(
         raise HTTPException(status_code=404, detail="Device not found")
     await db.delete(device)
     await db.commit()
+    presence.forget(device_id)
+    state_log.forget(device_id)
+    device_cache.invalidate(device_id=device_id)
+    response_cache.invalidate_device(device_id)
+    response_cache.invalidate_owner(device.owner_id)
     return {"status": "deleted", "device_id": device_id}
 
 @router.put("/admin/{device_id}/rename")
@@ -61,10 +129,17 @@ async def admin_rename_device(
     db.add(device)
     await db.commit()
     await db.refresh(device)
+    device_cache.invalidate(device_id=device_id)
+    response_cache.invalidate_device(device_id)
     return device
 
+def _serialize(device: Device) -> Dict[str, Any]:
+    device = state_store.apply(presence.apply(device))
+    return DeviceSchema.model_validate(device).model_dump(mode="json")
+
 @router.get("/", response_model=List[DeviceSchema])
 async def read_devices(
+    request: Request,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(deps.get_current_active_user),
     skip: int = 0,
@@ -72,11 +147,18 @@ async def read_devices(
 ) -> Any:
     """
     Retrieve devices owned by current user.
+    Served from the per-owner response cache; send If-None-Match to get 304.
     """
-    result = await db.execute(
-        select(Device).filter(Device.owner_id == current_user.id).offset(skip).limit(limit)
-    )
-    return result.scalars().all()
+    key = ("list", current_user.id, skip, limit)
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation()
+        result = await db.execute(
+            select(Device).filter(Device.owner_id == current_user.id).offset(skip).limit(limit)
+        )
+        payload = [_serialize(device) for device in result.scalars().all()]
+        entry = response_cache.put(key, payload, current_user.id, [d["id"] for d in payload], generation)
+    return response_cache.respond(request, entry)
 
 @router.post("/", response_model=DeviceSchema)
 async def create_device(
@@ -112,26 +194,35 @@ async def create_device(
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+    device_cache.invalidate(device_id=device.id)
+    device_cache.put(device)
+    response_cache.invalidate_owner(current_user.id)
         
     return device
 
 @router.get("/{device_id}", response_model=DeviceSchema)
 async def read_device(
     *,
+    request: Request,
     db: AsyncSession = Depends(get_db),
     device_id: str,
     current_user: User = Depends(deps.get_current_active_user),
 ) -> Any:
     """
-    Get device by ID.
+    Get device by ID. Send If-None-Match to get 304 when nothing changed.
     """
-    result = await db.execute(select(Device).filter(Device.id == device_id))
-    device = result.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    if device.owner_id != current_user.id and not current_user.is_superuser:
+    key = ("device", device_id)
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation()
+        result = await db.execute(select(Device).filter(Device.id == device_id))
+        device = result.scalars().first()
+        if not device:
+            raise HTTPException(status_code=404, detail="Device not found")
+        entry = response_cache.put(key, _serialize(device), device.owner_id, [device_id], generation)
+    if entry.owner_id != current_user.id and not current_user.is_superuser:
         raise HTTPException(status_code=400, detail="Not enough permissions")
-    return device
+    return response_cache.respond(request, entry)
 
 from core.websocket import manager
 
@@ -145,25 +236,14 @@ async def update_device_state(
     """
     Update device state (relays).
     """
-    result = await db.execute(select(Device).filter(Device.id == device_id))
-    device = result.scalars().first()
-    if not device:
+    state = await _write_state(db, device_id, merge=state_update)
+    if state is None:
         raise HTTPException(status_code=404, detail="Device not found")
-        
-    # Update state
-    current_state = device.start_state or {}
-    current_state.update(state_update)
-    
-    device.start_state = current_state
-    device.last_seen = datetime.utcnow()
-    
-    db.add(device)
-    await db.commit()
-    
+
     # Notify WebSocket clients
-    await manager.broadcast(device_id, {"type": "update", "data": device.start_state})
-    
-    return {"status": "success", "state": device.start_state}
+    await manager.publish_update(device_id, state)
+
+    return {"status": "success", "state": state}
 
 @router.post("/{device_id}/heartbeat")
 async def heartbeat(
@@ -172,17 +252,11 @@ async def heartbeat(
     device_id: str,
     ip: str = Body(..., embed=True),
 ) -> Any:
-    result = await db.execute(select(Device).filter(Device.id == device_id))
-    device = result.scalars().first()
-    if not device:
+    # The existence check is cached; the write is coalesced by the presence table
+    if presence.get(device_id) is None and await device_cache.by_id(device_id, db) is None:
         raise HTTPException(status_code=404, detail="Device not found")
-        
-    device.last_seen = datetime.utcnow()
-    device.online = True
-    device.ip_address = ip
-    
-    db.add(device)
-    await db.commit()
+
+    presence.touch(device_id, ip_address=ip)
     return {"status": "online"}
 
 @router.post("/{device_id}/relays/{relay_key}/on")
@@ -212,41 +286,172 @@ async def turn_relay_off(
     return await _update_relay_state(db, device_id, relay_key, False, current_user, api_key)
 
 async def _update_relay_state(db: AsyncSession, device_id: str, relay_key: str, state: bool, current_user: User = None, api_key: str = None):
-    result = await db.execute(select(Device).filter(Device.id == device_id))
-    device = result.scalars().first()
-    if not device:
+    # Fast reject against the cached (owner_id, api_key) before spending any budget or query
+    identity = await device_cache.by_id(device_id, db)
+    if not identity:
         raise HTTPException(status_code=404, detail="Device not found")
         
     # Auth Logic: API Key OR User
     authorized = False
     
     # 1. Check API Key (Device Level)
-    if api_key and device.api_key == api_key:
+    if api_key and identity.api_key == api_key:
         authorized = True
         
     # 2. Check User (Owner)
     if not authorized and current_user:
-        if device.owner_id == current_user.id or current_user.is_superuser:
+        if identity.owner_id == current_user.id or current_user.is_superuser:
             authorized = True
             
     if not authorized:
         raise HTTPException(status_code=401, detail="Not authorized (Invalid API Key or Token)")
 
-    current_state = device.start_state or {}
-    
-    # Update specific relay
-    if relay_key not in current_state:
-        current_state[relay_key] = {}
-    
-    current_state[relay_key]["state"] = state
-    
+    # Budget per caller: the user, or the device itself when it authenticated by api_key
+    await relay_limiter.enforce(f"user:{current_user.id}" if current_user and not api_key else f"device:{device_id}")
+
+    # One UPDATE ... RETURNING; the WHERE clause re-checks auth against the row itself
+    # in case the cached identity is stale (key rotated, device re-assigned)
+    new_state = await _write_state(
+        db, device_id, _relay_auth(current_user, api_key), relays={relay_key: state},
+    )
+    if new_state is None:
+        device_cache.invalidate(device_id=device_id)
+        if await device_cache.by_id(device_id, db) is None:
+            raise HTTPException(status_code=404, detail="Device not found")
+        raise HTTPException(status_code=401, detail="Not authorized (Invalid API Key or Token)")
+
+    # Notify WebSocket clients
+    await manager.publish_update(device_id, {relay_key: {"state": state}})
+
+    return {"status": "success", "state": new_state}
+
+def _relay_auth(current_user: Optional[User], api_key: Optional[str]):
+    """WHERE clause: the device's api_key, or its owner, or any superuser."""
+    clauses = []
+    if api_key:
+        clauses.append(Device.api_key == api_key)
+    if current_user:
+        clauses.append(true() if current_user.is_superuser else Device.owner_id == current_user.id)
+    return or_(*clauses) if clauses else false()
+
+def _state_expr(merge: Optional[Dict[str, Any]], relays: Optional[Dict[str, bool]]):
+    """start_state || merge, then jsonb_set each relay's "state" keeping its other fields."""
+    state = func.coalesce(Device.start_state, literal({}, JSONB))
+    if merge:
+        state = state.op("||", return_type=JSONB)(literal(merge, JSONB))
+    for relay_key, value in (relays or {}).items():
+        relay = func.coalesce(state.op("->", return_type=JSONB)(relay_key), literal({}, JSONB))
+        state = func.jsonb_set(
+            state,
+            literal([relay_key], ARRAY(String)),
+            relay.op("||", return_type=JSONB)(literal({"state": value}, JSONB)),
+            True,
+            type_=JSONB,
+        )
+    return state
+
+async def _write_state(
+    db: AsyncSession,
+    device_id: str,
+    *conditions,
+    merge: Optional[Dict[str, Any]] = None,
+    relays: Optional[Dict[str, bool]] = None,
+    source: str = "api",
+) -> Optional[Dict[str, Any]]:
+    """
+    Change a device's state in a single `UPDATE ... RETURNING` and commit.
+    Concurrent writers (a schedule and a user toggle) can't lose each other's
+    relays: each statement patches the row as it is at write time. Device
+    reports still buffered in the state store are folded into the same patch,
+    and device_relays is upserted by the same statement (a CTE fed by the UPDATE).
+    The relays that actually switched are recorded in the event history as `source`.
+    Returns the new state, or None if no row matched `device_id` and `conditions`.
+    """
+    pending = state_store.pop(device_id)
+    try:
+        changed = (
+            update(Device)
+            .where(Device.id == device_id, *conditions)
+            .values(start_state=_state_expr({**(pending or {}), **(merge or {})}, relays), last_seen=func.now())
+            .returning(Device.id, Device.start_state)
+            .cte("changed")
+        )
+        switched = upsert_relays(relay_rows(changed)).cte("relays")
+        result = await db.execute(
+            select(
+                changed.c.start_state,
+                select(func.jsonb_object_agg(switched.c.relay_key, switched.c.state)).scalar_subquery(),
+            ).add_cte(switched)
+        )
+        row = result.first()
+        if row is None:
+            state_store.requeue(device_id, pending)
+            return None
+        await db.commit()
+    except Exception:
+        state_store.requeue(device_id, pending)
+        raise
+    state, transitions = row
+    relay_events.record(device_id, transitions, source)
+    return state
+
+def _apply_relays(device: Device, changes: Dict[str, bool], pending: Optional[Dict[str, Any]]) -> None:
+    """Set relay states on a locked row, on top of device reports popped from the state store."""
+    current_state = {**(device.start_state or {}), **(pending or {})}
+    for relay_key, state in changes.items():
+        current_state[relay_key] = {**current_state.get(relay_key, {}), "state": state}
     device.start_state = current_state
     device.last_seen = datetime.utcnow()
-    
-    db.add(device)
-    await db.commit()
-    
-    # Notify WebSocket clients
-    await manager.broadcast(device_id, {"type": "update", "data": {relay_key: {"state": state}}})
-    
-    return {"status": "success", "state": device.start_state}
+
+@router.post("/relays/bulk", response_model=BulkRelayResult)
+async def bulk_relay_command(
+    command: BulkRelayCommand,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Switch many relays, across any of your devices, in one call
+    (e.g. "everything off"). All changes are committed in one transaction and
+    each device gets a single coalesced update; results are per operation.
+    """
+    await bulk_relay_limiter.enforce(f"user:{current_user.id}", cost=len(command.operations))
+
+    # One query loads (and locks) every device involved; ownership is checked per row.
+    # Locks are taken in id order so overlapping bulk calls and state flushes can't deadlock.
+    device_ids = {op.device_id for op in command.operations}
+    result = await db.execute(
+        select(Device).filter(Device.id.in_(device_ids)).order_by(Device.id).with_for_update()
+    )
+    devices = {device.id: device for device in result.scalars().all()}
+
+    changes: Dict[str, Dict[str, bool]] = {}
+    results = []
+    for op in command.operations:
+        device = devices.get(op.device_id)
+        if device is None:
+            outcome = "not_found"
+        elif device.owner_id != current_user.id and not current_user.is_superuser:
+            outcome = "forbidden"
+        else:
+            outcome = "ok"
+            changes.setdefault(op.device_id, {})[op.relay_key] = op.state
+        results.append(RelayOperationResult(**op.model_dump(), status=outcome))
+
+    # Buffered device reports go into this transaction; if it fails they are put back
+    pending = {device_id: state_store.pop(device_id) for device_id in changes}
+    try:
+        for device_id, relays in changes.items():
+            _apply_relays(devices[device_id], relays, pending[device_id])
+        transitions = await sync_relays(db, changes)
+        await db.commit()
+    except Exception:
+        for device_id, delta in pending.items():
+            state_store.requeue(device_id, delta)
+        raise
+    for device_id, switched in transitions.items():
+        relay_events.record(device_id, switched, "api")
+
+    for device_id, relays in changes.items():
+        await manager.publish_update(device_id, {key: {"state": state} for key, state in relays.items()})
+
+    return {"results": results, "applied": sum(r.status == "ok" for r in results)}
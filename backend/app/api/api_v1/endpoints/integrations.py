@@ -3,9 +3,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from db.session import get_db
 from core.config import settings
 from api.api_v1.endpoints.websockets import manager
-from db.models import Device
+from api.api_v1.endpoints.devices import _write_state
 from pydantic import BaseModel
-from sqlalchemy.future import select
 
 router = APIRouter()
 
@@ -27,36 +26,13 @@ async def voice_control(
     if x_webhook_secret != settings.WEBHOOK_SECRET:
         raise HTTPException(status_code=401, detail="Invalid Webhook Secret")
 
-    # 1. Get Device
-    result = await db.execute(select(Device).where(Device.id == command.device_id))
-    device = result.scalars().first()
-    
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-
-    # 2. Update State
-    if device.start_state is None:
-        device.start_state = {}
-    
+    # 1. Update State — one atomic UPDATE ... RETURNING, no read-modify-write
     relay_key = f"relay{command.relay}"
-    
-    # Update DB state
-    if relay_key not in device.start_state:
-        device.start_state[relay_key] = {}
-        
-    device.start_state[relay_key]["state"] = command.state
-    
-    # Mark as modified for SQLAlchemy to detect JSON change
-    from sqlalchemy.orm.attributes import flag_modified
-    flag_modified(device, "start_state")
-    
-    await db.commit()
-    await db.refresh(device)
+    state = await _write_state(db, command.device_id, relays={relay_key: command.state}, source="voice")
+    if state is None:
+        raise HTTPException(status_code=404, detail="Device not found")
 
-    # 3. Broadcast to WebSocket
-    await manager.broadcast_to_device(
-        command.device_id,
-        {relay_key: {"state": command.state}}
-    )
+    # 2. Broadcast to WebSocket
+    await manager.publish_update(command.device_id, {relay_key: {"state": command.state}})
 
     return {"status": "success", "device": command.device_id, "relay": command.relay, "new_state": command.state}
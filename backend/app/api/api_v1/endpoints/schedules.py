@@ -6,6 +6,7 @@ from sqlalchemy import select
 from db.session import get_db
 from db.models import Schedule, Device, User
 from schemas.schedule import Schedule as ScheduleSchema, ScheduleCreate
+from core.schedule_wheel import ScheduledAction, minute_of_day, schedule_wheel
 from api import deps
 
 router = APIRouter()
@@ -36,6 +37,11 @@ async def create_schedule(
     """
     Create a new schedule.
     """
+    try:
+        minute_of_day(schedule_in.time)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     # Verify device ownership
     result = await db.execute(select(Device).filter(Device.id == schedule_in.device_id))
     device = result.scalars().first()
@@ -53,6 +59,10 @@ async def create_schedule(
     db.add(schedule)
     await db.commit()
     await db.refresh(schedule)
+    if schedule.is_active:
+        schedule_wheel.add(ScheduledAction(
+            schedule.id, schedule.device_id, schedule.relay_key, schedule.action, schedule.time,
+        ))
     return schedule
 
 @router.delete("/{id}", response_model=ScheduleSchema)
@@ -78,4 +88,5 @@ async def delete_schedule(
         
     await db.delete(schedule)
     await db.commit()
+    schedule_wheel.remove(id)
     return schedule
@@ -3,13 +3,18 @@ One-time admin setup endpoint.
 Call GET /api/v1/setup/create-admin once to create or reset the admin account.
 This endpoint is protected by a secret token.
 """
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, delete
 
 from db.session import get_db
 from db.models import User
 from core.security import get_password_hash
+from core.device_cache import device_cache
+from core.response_cache import response_cache
+from core.pagination import finish_page, keyset_page
 
 router = APIRouter()
 
@@ -89,6 +94,9 @@ async def delete_users(secret: str, ids: str, db: AsyncSession = Depends(get_db)
             await db.delete(user)
 
     await db.commit()
+    # Their devices may be gone too; cheaper to drop the whole lookup cache
+    device_cache.clear()
+    response_cache.clear()
     return {
         "status": "done",
         "deleted": deleted,
@@ -163,6 +171,8 @@ async def create_device(
     db.add(device)
     await db.commit()
     await db.refresh(device)
+    device_cache.invalidate(device_id=device.id)
+    response_cache.invalidate_owner(owner_id)
 
     return {
         "status": "created",
@@ -203,6 +213,8 @@ async def force_register_device(
         existing.name = name
         db.add(existing)
         await db.commit()
+        device_cache.invalidate(device_id=device_id, api_key=old_key)
+        response_cache.invalidate_device(device_id)
         return {
             "status": "updated",
             "device_id": existing.id,
@@ -222,6 +234,8 @@ async def force_register_device(
     db.add(device)
     await db.commit()
     await db.refresh(device)
+    device_cache.invalidate(device_id=device.id)
+    response_cache.invalidate_owner(owner_id)
 
     return {
         "status": "created",
@@ -234,19 +248,28 @@ async def force_register_device(
 
 
 @router.get("/list-devices")
-async def list_devices(secret: str, db: AsyncSession = Depends(get_db)):
+async def list_devices(
+    secret: str,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+):
     """
-    List all registered devices and their api_keys.
+    List registered devices and their api_keys, one keyset page at a time.
     Call: GET /api/v1/setup/list-devices?secret=homecontrol_setup_2024
+    Repeat with &cursor=<next_cursor> until next_cursor is null.
     """
     if secret != SETUP_SECRET:
         raise HTTPException(status_code=403, detail="Invalid secret")
 
     from db.models import Device
-    result = await db.execute(select(Device))
-    devices = result.scalars().all()
+    result = await db.execute(keyset_page(select(Device), Device.id, cursor, limit))
+    devices = finish_page(result.scalars().all(), limit, lambda d: d.id, request, response)
     return {
         "count": len(devices),
+        "next_cursor": response.headers.get("X-Next-Cursor"),
         "devices": [
             {
                 "id": d.id,
@@ -1,10 +1,245 @@
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select
 
 from api import deps
 from db import models
+from db.session import get_db, engine, query_counter
+from core.latency import command_tracker
+from core.websocket import manager
+from core.device_cache import device_cache
+from core.rate_limit import limiters
+from core.response_cache import response_cache
+from core.relay_events import PRESENCE_KEY, relay_events
+from core.schedule_wheel import schedule_wheel
+from services.usage_rollups import daily_series, usage_cache
 
 router = APIRouter()
 
 # Sensor stats endpoint removed — temperature/humidity feature has been removed.
-# This file is kept as a placeholder for future statistics endpoints.
+
+
+@router.get("/latency")
+async def read_fleet_latency(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+) -> Any:
+    """
+    [ADMIN] Fleet-wide command round-trip latency (p50/p95/p99, histogram),
+    timed-out command count and the slowest devices by p95.
+    """
+    return {
+        "fleet": command_tracker.summary(),
+        "slowest_devices": command_tracker.slowest(),
+    }
+
+
+@router.get("/latency/{device_id}")
+async def read_device_latency(
+    device_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Command round-trip latency for one device: time from a command being sent
+    until the device's confirming state_update.
+    """
+    device = await device_cache.by_id(device_id, db)
+    if device is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    if device.owner_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    return {"device_id": device_id, **command_tracker.summary(device_id)}
+
+
+def _rss_bytes() -> int:
+    """Resident memory of this process (Linux /proc, else peak RSS from getrusage)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@router.get("/runtime")
+async def read_runtime_stats(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+) -> Any:
+    """
+    [ADMIN] Process-level numbers for load testing: memory, open WebSockets,
+    DB statements executed and pool usage. Per-process when running several workers.
+    """
+    device_sockets = sum(len(c) for c in manager.active_connections.values())
+    return {
+        "rss_bytes": _rss_bytes(),
+        "websockets": {
+            "devices": len(manager.active_connections),
+            "sockets": device_sockets + len(manager.user_connections),
+            "user_sockets": len(manager.user_connections),
+            "evicted_slow": manager.evicted_slow,
+            "evicted_dead": manager.evicted_dead,
+            "reaped_devices": manager.reaped_devices,
+            "reaped_viewers": manager.reaped_viewers,
+            "reclaimed_bytes": manager.reclaimed_bytes,
+        },
+        "db": {
+            "queries": query_counter.count,
+            "pool": engine.pool.status(),
+        },
+        "response_cache": response_cache.summary(),
+        "relay_events": relay_events.summary(),
+        "schedules": schedule_wheel.summary(),
+        "rate_limits": {limiter.name: limiter.summary() for limiter in limiters},
+        "device_cache": {
+            "size": len(device_cache),
+            "hits": device_cache.hits,
+            "misses": device_cache.misses,
+        },
+    }
+
+
+@router.get("/relays")
+async def read_relay_stats(
+    db: AsyncSession = Depends(get_db),
+    owner_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+) -> Any:
+    """
+    [ADMIN] Relays currently on: per relay key, and per owner (top `limit`
+    owners, or just `owner_id`). Counted from device_relays' partial index
+    on switched-on rows; device state is never loaded.
+    """
+    relay = models.DeviceRelay
+    by_key = await db.execute(
+        select(relay.relay_key, func.count()).where(relay.state).group_by(relay.relay_key)
+    )
+    per_owner = (
+        select(
+            models.Device.owner_id,
+            func.count().label("relays_on"),
+            func.count(func.distinct(relay.device_id)).label("devices"),
+        )
+        .join(models.Device, models.Device.id == relay.device_id)
+        .where(relay.state)
+        .group_by(models.Device.owner_id)
+        .order_by(func.count().desc())
+        .limit(limit)
+    )
+    if owner_id is not None:
+        per_owner = per_owner.where(models.Device.owner_id == owner_id)
+    by_owner = await db.execute(per_owner)
+    return {
+        "on_by_relay": dict(by_key.all()),
+        "on_by_owner": [row._asdict() for row in by_owner],
+    }
+
+
+async def _usage_rows(db: AsyncSession, current_user: models.User, first_day,
+                      device_id: Optional[str], owner_id: Optional[int], presence: bool):
+    """
+    relay_usage_daily from `first_day` on, for one device or one owner's devices
+    (the caller's, unless a superuser asks for `owner_id`). Aggregated per relay
+    into arrays in SQL, so a 90-day window is one row per relay, not per day.
+    """
+    daily = models.RelayUsageDaily
+    query = select(
+        daily.device_id,
+        daily.relay_key,
+        func.array_agg(daily.day - first_day),
+        func.array_agg(daily.toggles),
+        func.array_agg(daily.on_seconds),
+    ).where(
+        daily.day >= first_day,
+        (daily.relay_key == PRESENCE_KEY) if presence else (daily.relay_key != PRESENCE_KEY),
+    ).group_by(daily.device_id, daily.relay_key).order_by(daily.device_id, daily.relay_key)
+    if device_id is not None:
+        device = await device_cache.by_id(device_id, db)
+        if device is None:
+            raise HTTPException(status_code=404, detail="Device not found")
+        if device.owner_id != current_user.id and not current_user.is_superuser:
+            raise HTTPException(status_code=400, detail="Not enough permissions")
+        query = query.where(daily.device_id == device_id)
+    else:
+        if owner_id is not None and owner_id != current_user.id and not current_user.is_superuser:
+            raise HTTPException(status_code=400, detail="Not enough permissions")
+        owned = select(models.Device.id).where(models.Device.owner_id == (owner_id or current_user.id))
+        query = query.where(daily.device_id.in_(owned))
+    return (await db.execute(query)).all()
+
+
+async def _usage_response(request: Request, db: AsyncSession, current_user: models.User, kind: str,
+                          days: int, device_id: Optional[str], owner_id: Optional[int], build):
+    today = datetime.now(timezone.utc).date()
+    first_day = today - timedelta(days=days - 1)
+    key = (kind, current_user.id, device_id, owner_id, days, today)
+    entry = usage_cache.get(key)
+    if entry is None:
+        rows = await _usage_rows(db, current_user, first_day, device_id, owner_id, kind == "uptime")
+        series = daily_series(days, rows)
+        payload = {
+            "days": [(first_day + timedelta(days=i)).isoformat() for i in range(days)],
+            **build(series),
+        }
+        entry = usage_cache.put(key, payload, current_user.id, [])
+    return usage_cache.respond(request, entry)
+
+
+@router.get("/usage/relays")
+async def read_relay_usage(
+    request: Request,
+    days: int = Query(30, ge=1, le=366),
+    device_id: Optional[str] = None,
+    owner_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    On-time (seconds) and toggle count per relay per UTC day, for the last
+    `days` days including today. One entry per relay, with arrays aligned to
+    "days". Read from the daily rollups only; today's values trail live state
+    by at most one rollup interval. Cached until the next rollup pass (ETag/304).
+    """
+    def build(series):
+        return {"relays": [
+            {"device_id": device, "relay_key": relay_key, **values}
+            for (device, relay_key), values in series.items()
+        ]}
+
+    return await _usage_response(request, db, current_user, "relays", days, device_id, owner_id, build)
+
+
+@router.get("/usage/uptime")
+async def read_uptime(
+    request: Request,
+    days: int = Query(30, ge=1, le=366),
+    device_id: Optional[str] = None,
+    owner_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Online seconds and online/offline transitions per device per UTC day, plus
+    the uptime ratio over the window (today counts only the time elapsed so far).
+    Devices with no presence history in the window are left out.
+    """
+    now = datetime.now(timezone.utc)
+    window = (days - 1) * 86400 + (now - now.replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
+
+    def build(series):
+        return {"devices": [
+            {
+                "device_id": device,
+                "online_seconds": values["on_seconds"],
+                "transitions": values["toggles"],
+                "uptime": round(min(sum(values["on_seconds"]) / window, 1.0), 4) if window else 0.0,
+            }
+            for (device, _), values in series.items()
+        ]}
+
+    return await _usage_response(request, db, current_user, "uptime", days, device_id, owner_id, build)
@@ -1,14 +1,17 @@
-from typing import Any, List
-from fastapi import APIRouter, Body, Depends, HTTPException, BackgroundTasks
+from typing import Any, List, Optional
+from fastapi import APIRouter, Body, Depends, HTTPException, BackgroundTasks, Query, Request, Response
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 
 from db.session import get_db
-from db.models import User
+from db.models import Device, User
 from schemas.user import User as UserSchema, UserCreate
 from api import deps
 from core.security import get_password_hash
+from core.device_cache import device_cache
+from core.response_cache import response_cache
+from core.pagination import export_response, finish_page, keyset_page
 from services.email import send_welcome_email, send_admin_promotion_email
 
 router = APIRouter()
@@ -59,17 +62,42 @@ def read_user_me(
 
 @router.get("/", response_model=List[UserSchema])
 async def read_users(
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
     skip: int = 0,
-    limit: int = 100,
     current_user: User = Depends(deps.get_current_active_superuser),
 ) -> Any:
     """
-    Retrieve users.
+    Retrieve users, ordered by id.
+    The next page's `cursor` comes back in `X-Next-Cursor` / `Link: rel="next"`;
+    `skip` is kept for older clients.
     """
-    result = await db.execute(select(User).offset(skip).limit(limit))
-    users = result.scalars().all()
-    return users
+    query = select(User)
+    if skip and not cursor:
+        query = query.offset(skip)
+    result = await db.execute(keyset_page(query, User.id, cursor, limit))
+    return finish_page(result.scalars().all(), limit, lambda u: u.id, request, response)
+
+@router.get("/export")
+async def export_users(
+    format: str = "ndjson",
+    current_user: User = Depends(deps.get_current_active_superuser),
+) -> Any:
+    """
+    [ADMIN] Stream every user as NDJSON or CSV (`format=ndjson|csv`).
+    """
+    return export_response(
+        select(User),
+        User.id,
+        key=lambda u: u.id,
+        serialize=lambda u: UserSchema.model_validate(u).model_dump(mode="json"),
+        columns=list(UserSchema.model_fields),
+        fmt=format,
+        filename="users",
+    )
 
 @router.delete("/{user_id}", response_model=UserSchema)
 async def delete_user(
@@ -86,9 +114,15 @@ async def delete_user(
         raise HTTPException(status_code=404, detail="User not found")
     if user.id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot delete own user")
-        
+
+    device_ids = (await db.execute(select(Device.id).where(Device.owner_id == user_id))).scalars().all()
     await db.delete(user)
     await db.commit()
+    # Cached devices and responses still carry the deleted owner
+    for device_id in device_ids:
+        device_cache.invalidate(device_id=device_id)
+        response_cache.invalidate_device(device_id)
+    response_cache.invalidate_owner(user_id)
     return user
 
 
@@ -1,29 +1,181 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query, status
-from typing import Any, Optional
-from sqlalchemy.ext.asyncio import AsyncSession
+import itertools
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status
+from typing import Any, List, Optional, Set
+from jose import jwt, JWTError
 from sqlalchemy import select
-from datetime import datetime
-import json
 
-from db.session import get_db
-from db.models import Device
+from core.config import settings
+from db.session import SessionLocal
+from db.models import Device, User
 from core.websocket import manager
+from core import codec
+from core.presence import presence
+from core.state_store import state_store
+from core.state_log import state_log
+from core.latency import command_tracker
+from core.device_cache import device_cache
+from core.rate_limit import ws_frame_limiter
 from api import deps
 
 router = APIRouter()
 
+# Frame budgets are per socket; ids aren't reused, so a new socket never inherits a drained bucket
+_socket_ids = itertools.count()
+
+
+@router.websocket("/ws/user")
+async def user_websocket_endpoint(
+    websocket: WebSocket,
+    token: Optional[str] = Query(None),
+):
+    """
+    One multiplexed socket per dashboard, authenticated once with the JWT.
+
+    Client → server:
+        {"type": "subscribe", "device_ids": ["SH-001", ...], "since": {"SH-001": <seq>}}
+        {"type": "unsubscribe", "device_ids": ["SH-001"]}
+        {"type": "command", "device_id": "SH-001", "data": {"relay1": {"state": true}}}
+
+    Server → client: the same "update"/"snapshot" messages as /ws/{device_id},
+    tagged with "device_id", plus "subscribed"/"unsubscribed" replies. Only
+    devices the user owns (any device for superusers) can be subscribed.
+    """
+    user = await _authenticate_user(token)
+    if user is None:
+        print("❌ WS REJECTED: Invalid or missing token for /ws/user")
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    subprotocol = codec.negotiate(websocket.scope.get("subprotocols", []))
+
+    connection = await manager.connect_user(websocket, subprotocol=subprotocol)
+    limit_key = f"user:{user.id}:{next(_socket_ids)}"
+    print(f"✅ WS AUTH OK: User {user.id} opened a multiplexed socket")
+    try:
+        while True:
+            data = await _receive_frame(websocket)
+            connection.touch()
+            if await ws_frame_limiter.check(limit_key):
+                await _close_rate_limited(websocket, f"user {user.id}")
+                break
+            try:
+                message = codec.decode(data)
+                msg_type = message.get("type")
+
+                if msg_type == "subscribe":
+                    requested = _device_ids(message)
+                    allowed = await _owned_devices(user, requested)
+                    manager.subscribe(websocket, allowed)
+                    manager.send_to(websocket, None, {
+                        "type": "subscribed",
+                        "device_ids": sorted(allowed),
+                        "denied": sorted(set(requested) - allowed),
+                    })
+                    since = message.get("since") or {}
+                    for device_id in allowed:
+                        if isinstance(since.get(device_id), int):
+                            await _resume(websocket, device_id, since[device_id])
+
+                elif msg_type == "unsubscribe":
+                    device_ids = _device_ids(message)
+                    manager.unsubscribe(websocket, device_ids)
+                    manager.send_to(websocket, None, {"type": "unsubscribed", "device_ids": device_ids})
+
+                elif msg_type == "command":
+                    device_id = message.get("device_id")
+                    if device_id not in connection.subscriptions:
+                        continue  # Subscribing is what checks ownership
+                    command = {"type": "command", "data": message.get("data", {})}
+                    if manager.has_device(device_id):
+                        command["id"] = command_tracker.start(device_id, command["data"], message.get("id"))
+                    await manager.send_to_device(device_id, command)
+                    await manager.publish_update(device_id, command["data"], devices=False, exclude=websocket)
+
+            except (ValueError, AttributeError, TypeError):
+                pass  # Malformed JSON / MessagePack frame
+
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        manager.disconnect_user(websocket)
+
+
+async def _receive_frame(websocket: WebSocket):
+    """
+    The next frame as str (text) or bytes (binary). The negotiated subprotocol
+    only decides what we send: a JSON socket may still get a binary frame and
+    a MessagePack socket a text one, and receive_text()/receive_bytes() would
+    raise KeyError on those.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", status.WS_1000_NORMAL_CLOSURE))
+    if message.get("bytes") is not None:
+        return message["bytes"]
+    return message.get("text") or ""
+
+
+async def _close_rate_limited(websocket: WebSocket, who: str):
+    print(f"🚦 WS closed: {who} exceeded the frame rate limit")
+    try:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Rate limit exceeded")
+    except RuntimeError:
+        pass  # already closed (e.g. evicted)
+
+
+async def _authenticate_user(token: Optional[str]) -> Optional[User]:
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        user_id = int(payload.get("sub"))
+    except (JWTError, TypeError, ValueError):
+        return None
+    async with SessionLocal() as db:
+        result = await db.execute(select(User).filter(User.id == user_id))
+        user = result.scalars().first()
+    if user is None or not user.is_active:
+        return None
+    return user
+
+
+def _device_ids(message: dict) -> List[str]:
+    device_ids = message.get("device_ids") or []
+    return [device_id for device_id in device_ids if isinstance(device_id, str)]
+
+
+async def _owned_devices(user: User, device_ids: List[str]) -> Set[str]:
+    """The subset of `device_ids` that exist and belong to `user`."""
+    if not device_ids:
+        return set()
+    query = select(Device.id).filter(Device.id.in_(device_ids))
+    if not user.is_superuser:
+        query = query.filter(Device.owner_id == user.id)
+    async with SessionLocal() as db:
+        result = await db.execute(query)
+        return set(result.scalars().all())
+
+
 @router.websocket("/ws/{device_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     device_id: str,
-    db: AsyncSession = Depends(get_db),
     token: Optional[str] = Query(None),
-    api_key: Optional[str] = Query(None)
+    api_key: Optional[str] = Query(None),
+    since: Optional[int] = Query(None),
 ):
     """
     WebSocket endpoint for Devices and Frontend clients.
     Secure: Requires either 'token' (User) or 'api_key' (Device).
     Device can also use 'Authorization' header.
+
+    Clients may pass `since=<seq>` (the last `seq` they saw on an "update") to
+    receive only the deltas missed while disconnected, or a "snapshot" of the
+    full state if they fell too far behind.
+
+    No DB session is held for the life of the socket: auth uses a short-lived
+    session, and the message loop only touches the presence/state stores.
     """
     print(f"🔌 WS connect attempt → device_id={device_id} | api_key={'SET' if api_key else 'NONE'} | token={'SET' if token else 'NONE'}")
 
@@ -41,9 +193,8 @@ async def websocket_endpoint(
             pass
             
     if api_key:
-        # Validate Device Key
-        result = await db.execute(select(Device).filter(Device.api_key == api_key))
-        device = result.scalars().first()
+        # Validate Device Key (cached; a miss uses a short-lived session)
+        device = await device_cache.by_api_key(api_key)
         if not device:
             print(f"❌ WS REJECTED: No device found with api_key={api_key[:10]}... (device not registered in DB?)")
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
@@ -53,6 +204,7 @@ async def websocket_endpoint(
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
         is_device = True
+        limit_key = f"device:{device_id}"
         print(f"✅ WS AUTH OK: Device '{device_id}' authenticated via api_key")
         
     elif token:
@@ -65,6 +217,7 @@ async def websocket_endpoint(
                 token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
             )
             print(f"✅ WS AUTH OK: User authenticated via token for device_id={device_id}")
+            limit_key = f"user:{payload.get('sub')}:{next(_socket_ids)}"
         except Exception as e:
             print(f"❌ WS REJECTED: Invalid token for device_id={device_id} → {e}")
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
@@ -74,56 +227,76 @@ async def websocket_endpoint(
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    await manager.connect(websocket, device_id)
+    # Optional compact binary protocol, negotiated via Sec-WebSocket-Protocol
+    subprotocol = codec.negotiate(websocket.scope.get("subprotocols", []))
+
+    connection = await manager.connect(websocket, device_id, is_device=is_device, subprotocol=subprotocol)
     try:
+        if since is not None:
+            await _resume(websocket, device_id, since)
+
         while True:
-            data = await websocket.receive_text()
+            data = await _receive_frame(websocket)
+            connection.touch()  # any frame (heartbeat, pong, ...) keeps the reaper away
+            if await ws_frame_limiter.check(limit_key):
+                await _close_rate_limited(websocket, limit_key)
+                break
             # Parse message
             try:
-                message = json.loads(data)
+                message = codec.decode(data)
                 msg_type = message.get("type")
                 
-                # 1. Heartbeat from Device — update DB to keep device marked as online
+                # 1. Heartbeat from Device — recorded in the presence table, flushed to DB in batches
                 if msg_type == "heartbeat":
-                    try:
-                        result = await db.execute(select(Device).filter(Device.id == device_id))
-                        dev = result.scalars().first()
-                        if dev:
-                            dev.last_seen = datetime.utcnow()
-                            dev.online = True
-                            db.add(dev)
-                            await db.commit()
-                    except Exception:
-                        pass  # Non-fatal — don't kill the WS connection over a heartbeat update failure
+                    presence.touch(device_id)
                 
                 # 2. State Update from Device (Physical switch toggle)
                 elif msg_type == "state_update":
                     new_state = message.get("data", {})
-                    # Broadcast to all OTHER clients (Frontend)
-                    await manager.broadcast(device_id, {"type": "update", "data": new_state})
+                    # Forward to dashboards only — the device already knows its own state
+                    await manager.publish_update(device_id, new_state, devices=False)
                     
-                    # Update DB (TODO: Optimize to not block)
-                    # For Phase 2 Prototype, we can try to update DB here or just trust the device's next sync.
-                    # Best practice: Update DB so REST API GET returns correct state.
-                    result = await db.execute(select(Device).filter(Device.id == device_id))
-                    device = result.scalars().first()
-                    if device:
-                        current_state = device.start_state or {}
-                        current_state.update(new_state)
-                        device.start_state = current_state
-                        device.last_seen = datetime.utcnow()
-                        device.online = True
-                        db.add(device)
-                        await db.commit()
+                    # Persisted by the write-behind state store; REST GETs read through it
+                    state_store.merge(device_id, new_state)
+                    presence.touch(device_id)
+
+                    # Confirms pending commands (explicit "ack" id, or matching relay states)
+                    command_tracker.ack(device_id, new_state, message.get("ack"))
 
                 # 3. Command from Frontend (User toggled switch on UI)
                 elif msg_type == "command":
-                    # Broadcast to Device (and other frontends)
-                    # {"type": "command", "data": {"relay1": {"state": true}}}
-                    await manager.broadcast(device_id, message)
+                    # Route to the Device only; other dashboards get it as an update
+                    # {"type": "command", "id": "<optional>", "data": {"relay1": {"state": true}}}
+                    if manager.has_device(device_id):
+                        message["id"] = command_tracker.start(
+                            device_id, message.get("data", {}), message.get("id")
+                        )
+                    await manager.send_to_device(device_id, message)
+                    await manager.publish_update(
+                        device_id, message.get("data", {}), devices=False, exclude=websocket
+                    )
                     
-            except json.JSONDecodeError:
-                pass
+            except (ValueError, AttributeError, TypeError):
+                pass  # Malformed JSON / MessagePack frame
                 
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: the socket was already closed by the manager (evicted)
+        pass
+    finally:
         manager.disconnect(websocket, device_id)
+
+
+async def _resume(websocket: WebSocket, device_id: str, since: int):
+    """Replay missed deltas after `since`, or send a full snapshot."""
+    missed = state_log.since(device_id, since)
+    if missed is not None:
+        for seq, delta in missed:
+            manager.send_to(websocket, device_id, {"type": "update", "seq": seq, "data": delta})
+        return
+
+    seq = state_log.head(device_id)
+    async with SessionLocal() as db:
+        result = await db.execute(select(Device).filter(Device.id == device_id))
+        device = result.scalars().first()
+    state = state_store.apply(device).start_state if device else {}
+    manager.send_to(websocket, device_id, {"type": "snapshot", "seq": seq, "data": state or {}})
@@ -6,8 +6,9 @@ from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 from core.config import settings
 from db.session import get_db
-from db.models import User, Device
+from db.models import User
 from schemas.token import TokenPayload
+from core.device_cache import device_cache, DeviceIdentity
 from sqlalchemy import select
 
 reusable_oauth2 = OAuth2PasswordBearer(
@@ -78,8 +79,8 @@ def get_current_active_superuser(
 from fastapi import Header
 async def get_current_device(
     authorization: str = Header(None),
-    db: AsyncSession = Depends(get_db)
-) -> Device:
+) -> DeviceIdentity:
+    """Authenticate a device by its API key (cached; no DB hit on the hot path)."""
     if not authorization:
         raise HTTPException(status_code=403, detail="Missing API Key")
     
@@ -90,8 +91,7 @@ async def get_current_device(
     except ValueError:
         raise HTTPException(status_code=403, detail="Invalid authorization format")
 
-    result = await db.execute(select(Device).filter(Device.api_key == api_key))
-    device = result.scalars().first()
+    device = await device_cache.by_api_key(api_key)
     
     if not device:
         raise HTTPException(status_code=403, detail="Invalid API Key")
@@ -0,0 +1,132 @@
+import asyncio
+import uuid
+from typing import Callable, List, Optional
+
+from core.config import settings
+from core import codec
+
+# deliver(device_id, message, devices, viewers) — fans a message out to local sockets
+Deliver = Callable[[str, dict, bool, bool], None]
+
+
+class Backplane:
+    """
+    Pub/sub link between API processes for WebSocket fan-out.
+
+    ConnectionManager always delivers to its own sockets first and then calls
+    `publish`; a backplane only has to carry the message to *other* processes.
+    """
+
+    async def start(self, deliver: Deliver) -> None:
+        pass
+
+    def publish(self, device_id: str, message: dict, devices: bool, viewers: bool) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class InProcessBackplane(Backplane):
+    """Single-node deployments: every socket lives in this process, nothing to relay."""
+
+
+class PostgresBackplane(Backplane):
+    """
+    Relays broadcasts between workers/instances with Postgres LISTEN/NOTIFY.
+
+    Every envelope carries this process's origin id, and a process ignores its
+    own notifications, so a message is delivered exactly once per process and
+    never re-published. Publishing is queued and sent in batches from a
+    background task, so callers never wait on the database.
+    """
+
+    CHANNEL = "homecontrol_ws"
+    MAX_PAYLOAD = 7900  # NOTIFY payloads must stay under 8000 bytes
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.origin = uuid.uuid4().hex
+        self._deliver: Optional[Deliver] = None
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=10000)
+        self._listen_conn = None
+        self._publish_conn = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+        await self._listen()
+        self._tasks = [
+            asyncio.create_task(self._publisher()),
+            asyncio.create_task(self._watchdog()),
+        ]
+        print(f"📡 Postgres WS backplane listening on '{self.CHANNEL}' (origin {self.origin[:8]})")
+
+    async def _listen(self) -> None:
+        import asyncpg
+        self._listen_conn = await asyncpg.connect(self.dsn)
+        await self._listen_conn.add_listener(self.CHANNEL, self._on_notify)
+
+    def _on_notify(self, connection, pid, channel, payload: str) -> None:
+        try:
+            envelope = codec.loads(payload)
+            if envelope["o"] == self.origin:
+                return  # our own publish — already delivered locally
+            self._deliver(envelope["d"], envelope["m"], envelope["dv"], envelope["vw"])
+        except Exception as e:
+            print(f"⚠️  Backplane: bad notification dropped: {e}")
+
+    def publish(self, device_id: str, message: dict, devices: bool, viewers: bool) -> None:
+        payload = codec.dumps({"o": self.origin, "d": device_id, "m": message, "dv": devices, "vw": viewers})
+        if len(payload.encode()) > self.MAX_PAYLOAD:
+            print(f"⚠️  Backplane: message for {device_id} too large for NOTIFY, delivered locally only")
+            return
+        try:
+            self._outbox.put_nowait(payload)
+        except asyncio.QueueFull:
+            print(f"⚠️  Backplane: outbox full, message for {device_id} delivered locally only")
+
+    async def _publisher(self) -> None:
+        import asyncpg
+        while True:
+            payloads = [await self._outbox.get()]
+            while not self._outbox.empty():
+                payloads.append(self._outbox.get_nowait())
+            try:
+                if self._publish_conn is None or self._publish_conn.is_closed():
+                    self._publish_conn = await asyncpg.connect(self.dsn)
+                # One round trip for everything queued since the last send
+                await self._publish_conn.execute(
+                    "SELECT pg_notify($1, p) FROM unnest($2::text[]) AS p",
+                    self.CHANNEL, payloads,
+                )
+            except Exception as e:
+                print(f"❌ Backplane publish error ({len(payloads)} dropped): {e}")
+                self._publish_conn = None
+                await asyncio.sleep(1)
+
+    async def _watchdog(self) -> None:
+        """Re-establish the LISTEN connection if Postgres drops it."""
+        while True:
+            await asyncio.sleep(5)
+            if self._listen_conn is not None and not self._listen_conn.is_closed():
+                continue
+            try:
+                await self._listen()
+                print("📡 Backplane: LISTEN connection re-established")
+            except Exception as e:
+                print(f"❌ Backplane reconnect failed: {e}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for conn in (self._listen_conn, self._publish_conn):
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+
+
+def get_backplane() -> Backplane:
+    if settings.WS_BACKPLANE == "postgres":
+        # asyncpg wants a plain postgresql:// DSN, not the SQLAlchemy dialect URL
+        return PostgresBackplane(settings.ASYNC_DATABASE_URL.replace("+asyncpg", "", 1))
+    return InProcessBackplane()
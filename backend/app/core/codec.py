@@ -0,0 +1,120 @@
+import json
+from typing import Any, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:
+    # orjson not installed — fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    # msgpack not installed — the binary subprotocol is simply not offered
+    msgpack = None
+
+
+def dumps(message: Any) -> str:
+    """Encode a message to a JSON text frame (compact, same output as send_json)."""
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads(data: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# ─── Compact binary protocol (MessagePack) ────────────────────────────────────
+#
+# Negotiated with `Sec-WebSocket-Protocol: homecontrol.msgpack.v1`; JSON stays
+# the default. A frame is a MessagePack array:
+#
+#     [type, [relay_index, state, relay_index, state, ...], extras?]
+#
+#     {"type": "command", "data": {"relay1": {"state": true}}}  ->  [2, [1, true]]
+#
+# `type` is a small int for the known message types. Relay entries of the form
+# "relayN": {"state": bool} become flat (N, bool) pairs; anything else (other
+# data keys, extra top-level fields) is carried verbatim in the optional
+# `extras` map, so the mapping is lossless. Arrays rather than int-keyed maps
+# keep it decodable by ArduinoJson's deserializeMsgPack on the ESP32.
+
+MSGPACK_SUBPROTOCOL = "homecontrol.msgpack.v1"
+
+_TYPE_CODES = {"heartbeat": 0, "state_update": 1, "command": 2, "update": 3}
+_TYPE_NAMES = {code: name for name, code in _TYPE_CODES.items()}
+
+
+def negotiate(offered: Iterable[str]) -> Optional[str]:
+    """Pick the subprotocol to accept from the client's offer (None = JSON)."""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def _relay_index(key: str) -> Optional[int]:
+    suffix = key[5:]
+    if key.startswith("relay") and suffix.isdigit() and str(int(suffix)) == suffix:
+        return int(suffix)
+    return None
+
+
+def pack(message: dict) -> bytes:
+    relays = []
+    other_data = {}
+    for key, value in (message.get("data") or {}).items():
+        index = _relay_index(key)
+        if index is not None and isinstance(value, dict) and value.keys() == {"state"} \
+                and isinstance(value["state"], bool):
+            relays += (index, value["state"])
+        else:
+            other_data[key] = value
+
+    extras = {key: value for key, value in message.items() if key not in ("type", "data")}
+    if other_data:
+        extras["data"] = other_data
+
+    msg_type = message.get("type")
+    frame = [_TYPE_CODES.get(msg_type, msg_type), relays]
+    if extras:
+        frame.append(extras)
+    return msgpack.packb(frame)
+
+
+def decode(frame) -> Any:
+    """
+    Decode a frame by its own type: text as JSON, bytes as MessagePack,
+    whatever subprotocol was negotiated. Raises ValueError if malformed.
+    """
+    if isinstance(frame, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError("Binary frame received but msgpack is not installed")
+        return unpack(frame)
+    return loads(frame)
+
+
+def unpack(frame: bytes) -> dict:
+    """Decode a binary frame back to the canonical dict; raises ValueError if malformed."""
+    try:
+        decoded = msgpack.unpackb(frame)
+        code, relays = decoded[0], decoded[1]
+        extras = dict(decoded[2]) if len(decoded) > 2 else {}
+
+        data = {
+            f"relay{relays[i]}": {"state": bool(relays[i + 1])}
+            for i in range(0, len(relays), 2)
+        }
+        data.update(extras.pop("data", {}))
+
+        message = {"type": _TYPE_NAMES.get(code, code)}
+        if data:
+            message["data"] = data
+        message.update(extras)
+        return message
+    except ValueError:
+        raise
+    except (TypeError, IndexError, KeyError, AttributeError) as e:
+        raise ValueError(f"Malformed binary frame: {e}") from e
@@ -7,6 +7,8 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str = "postgresql+asyncpg://postgres:postgres@db/homecontrol"
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
     
     # Redis (optional — not needed for free deployment)
     REDIS_URL: str = ""
@@ -22,10 +24,47 @@ class Settings(BaseSettings):
     # Integrations
     WEBHOOK_SECRET: str = "voice_secret_123"
     NTFY_TOPIC: str = "homecontrol_ghosty_alerts"
+    NTFY_URL: str = "https://ntfy.sh"
+    NTFY_COALESCE_WINDOW: float = 15.0   # seconds; online/offline flaps inside it become one alert
 
     # Email (Resend.com — sign up free at resend.com, set this in Render env vars)
     RESEND_API_KEY: str = ""    # e.g. re_xxxxxxxxxxxxxxxx
 
+    # Realtime
+    PRESENCE_FLUSH_INTERVAL: float = 5.0   # seconds between heartbeat write-backs
+    STATE_FLUSH_INTERVAL: float = 0.5      # seconds between relay state write-backs
+    STATE_FLUSH_MAX_PENDING: int = 100     # flush early once this many devices are dirty
+    WS_SEND_QUEUE_SIZE: int = 64           # outbound frames buffered per socket before eviction
+    WS_SEND_TIMEOUT: float = 5.0           # seconds a single send may stall before eviction
+    WS_BACKPLANE: str = "inprocess"        # "postgres" to fan out across workers via LISTEN/NOTIFY
+    STATE_LOG_SIZE: int = 64               # recent deltas kept per device for resume-from-seq
+    COMMAND_ACK_TIMEOUT: float = 10.0      # seconds before an unacknowledged command counts as timed out
+    REALTIME_PORT: int = 8001              # standalone WebSocket gateway (realtime.py)
+    WS_PING_AFTER: float = 30.0            # seconds of silence before a dashboard socket gets {"type": "ping"}
+    WS_IDLE_TIMEOUT: float = 90.0          # seconds without any inbound frame before a socket is reaped
+    WS_REAP_INTERVAL: float = 10.0         # how often the reaper scans for silent sockets
+    # Rate limits ("<count>/<second|minute|hour>", token buckets with burst = count)
+    RATE_LIMIT_BACKEND: str = "memory"     # "redis" to share login/relay buckets across workers (REDIS_URL)
+    RATE_LIMIT_LOGIN: str = "10/minute"    # per client IP and account
+    RATE_LIMIT_LOGIN_IP: str = "100/minute"  # per client IP, across accounts
+    # Peers whose X-Forwarded-For is believed (nginx, Render, k8s ingress); "*" trusts any
+    TRUSTED_PROXIES: str = "127.0.0.0/8,::1,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,fc00::/7"
+    RATE_LIMIT_RELAY: str = "60/minute"    # per user, or per device for api_key calls
+    RATE_LIMIT_RELAY_BULK: str = "1000/minute"  # relay operations in bulk calls, per user
+    RATE_LIMIT_WS_FRAMES: str = "20/second"  # inbound frames per socket; excess closes it
+    RESPONSE_CACHE_TTL: float = 10.0       # seconds a cached GET /devices response may be served
+    DEVICE_CACHE_TTL: float = 60.0         # seconds a cached api_key/device_id lookup stays valid
+    DEVICE_CACHE_SIZE: int = 10000         # devices kept in the lookup cache (LRU beyond that)
+    # Relay history (relay_events) and usage rollups
+    RELAY_EVENT_FLUSH_INTERVAL: float = 1.0   # seconds between batched COPYs into relay_events
+    RELAY_EVENT_BATCH: int = 1000             # flush early once this many events wait
+    RELAY_EVENT_BUFFER: int = 100000          # events held while the DB is unreachable; oldest dropped beyond
+    RELAY_EVENT_RETENTION_DAYS: int = 90      # raw events; whole monthly partitions are dropped past this
+    RELAY_HOURLY_RETENTION_DAYS: int = 31     # hourly rollups (daily rollups are kept)
+    ROLLUP_INTERVAL: float = 60.0             # seconds between rollup passes
+    ROLLUP_GRACE: float = 30.0                # seconds after an hour ends before it is rolled up
+    SCHEDULE_RECONCILE_INTERVAL: float = 300.0  # seconds between reloads of the in-memory schedules from the DB
+
     
     class Config:
         case_sensitive = True
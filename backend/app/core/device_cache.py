@@ -0,0 +1,111 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from db.models import Device
+from db.session import SessionLocal
+
+
+@dataclass(frozen=True)
+class DeviceIdentity:
+    """The columns auth checks need: who owns a device and its API key."""
+    id: str
+    owner_id: Optional[int]
+    api_key: Optional[str]
+
+
+Entry = Tuple[float, DeviceIdentity]
+
+
+class DeviceCache:
+    """
+    In-memory TTL + LRU cache for the api_key -> device and
+    device_id -> (owner_id, api_key) lookups done on every WebSocket
+    handshake, relay call and device-authenticated request.
+
+    Endpoints that create, delete, rename or re-key a device call
+    invalidate(); other workers see the change once their entry expires,
+    so `ttl` bounds how long a revoked key keeps working elsewhere.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._by_id: "OrderedDict[str, Entry]" = OrderedDict()
+        self._by_key: "OrderedDict[str, Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, table: "OrderedDict[str, Entry]", key: str) -> Optional[DeviceIdentity]:
+        entry = table.get(key)
+        if entry is None:
+            return None
+        expires, identity = entry
+        if expires < time.monotonic():
+            del table[key]
+            return None
+        table.move_to_end(key)
+        return identity
+
+    def put(self, device) -> DeviceIdentity:
+        """Cache a Device row (or any object with id/owner_id/api_key)."""
+        identity = DeviceIdentity(device.id, device.owner_id, device.api_key)
+        expires = time.monotonic() + self.ttl
+        for table, key in ((self._by_id, identity.id), (self._by_key, identity.api_key)):
+            if key is None:
+                continue
+            table[key] = (expires, identity)
+            table.move_to_end(key)
+            if len(table) > self.max_size:
+                table.popitem(last=False)
+        return identity
+
+    async def _load(self, condition, db: Optional[AsyncSession]):
+        query = select(Device.id, Device.owner_id, Device.api_key).filter(condition)
+        if db is not None:
+            return (await db.execute(query)).first()
+        async with SessionLocal() as session:
+            return (await session.execute(query)).first()
+
+    async def by_api_key(self, api_key: str, db: Optional[AsyncSession] = None) -> Optional[DeviceIdentity]:
+        """Device owning `api_key`, or None. Uses `db` on a miss if given, else a short-lived session."""
+        identity = self._get(self._by_key, api_key)
+        if identity is not None:
+            self.hits += 1
+            return identity
+        self.misses += 1
+        row = await self._load(Device.api_key == api_key, db)
+        return self.put(row) if row is not None else None
+
+    async def by_id(self, device_id: str, db: Optional[AsyncSession] = None) -> Optional[DeviceIdentity]:
+        identity = self._get(self._by_id, device_id)
+        if identity is not None:
+            self.hits += 1
+            return identity
+        self.misses += 1
+        row = await self._load(Device.id == device_id, db)
+        return self.put(row) if row is not None else None
+
+    def invalidate(self, device_id: Optional[str] = None, api_key: Optional[str] = None) -> None:
+        entry = self._by_id.pop(device_id, None) if device_id is not None else None
+        if entry is not None and entry[1].api_key is not None:
+            self._by_key.pop(entry[1].api_key, None)
+        if api_key is not None:
+            entry = self._by_key.pop(api_key, None)
+            if entry is not None:
+                self._by_id.pop(entry[1].id, None)
+
+    def clear(self) -> None:
+        self._by_id.clear()
+        self._by_key.clear()
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+
+device_cache = DeviceCache(ttl=settings.DEVICE_CACHE_TTL, max_size=settings.DEVICE_CACHE_SIZE)
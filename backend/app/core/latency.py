@@ -0,0 +1,161 @@
+import asyncio
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional
+
+from core.config import settings
+
+# Upper bounds (ms) of the cumulative histogram buckets; the last bucket is +Inf
+BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+@dataclass
+class PendingCommand:
+    relays: Dict[str, bool]
+    started: float = field(default_factory=time.monotonic)
+
+
+class LatencySeries:
+    """Bucketed histogram plus a window of recent samples for percentiles."""
+
+    def __init__(self, window: int):
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.timeouts = 0
+
+    def add(self, ms: float) -> None:
+        self.samples.append(ms)
+        self.buckets[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+
+    def summary(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+
+        def pct(p: float) -> Optional[float]:
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 1)
+
+        return {
+            "count": self.count,
+            "timeouts": self.timeouts,
+            "p50_ms": pct(50),
+            "p95_ms": pct(95),
+            "p99_ms": pct(99),
+            "histogram": {
+                **{f"le_{bound}ms": n for bound, n in zip(BUCKETS_MS, self.buckets)},
+                "gt_10000ms": self.buckets[-1],
+            },
+        }
+
+
+class CommandTracker:
+    """
+    Pending-ack table for relay commands and their round-trip latency.
+
+    A command is registered with a correlation id when it is sent to a device
+    (WebSocket `command` or REST relay call). It is acknowledged by the
+    device's next `state_update`, either explicitly (`"ack": <id>`, sent by
+    current firmware) or implicitly once the reported relay states match. If
+    no ack arrives within `timeout` seconds, the command counts as timed out.
+    """
+
+    MAX_PENDING_PER_DEVICE = 100
+
+    def __init__(self, timeout: float = 10.0, window: int = 1000):
+        self.timeout = timeout
+        self.window = window
+        self._pending: Dict[str, Dict[str, PendingCommand]] = {}
+        self._series: Dict[str, LatencySeries] = {}
+        self.fleet = LatencySeries(window * 10)
+
+    def _series_for(self, device_id: str) -> LatencySeries:
+        series = self._series.get(device_id)
+        if series is None:
+            series = self._series[device_id] = LatencySeries(self.window)
+        return series
+
+    def start(self, device_id: str, data: Dict[str, Any], command_id: Optional[str] = None) -> str:
+        """Register an outgoing command; returns its correlation id."""
+        command_id = command_id or uuid.uuid4().hex[:12]
+        relays = {
+            key: value["state"] for key, value in data.items()
+            if isinstance(value, dict) and "state" in value
+        }
+        pending = self._pending.setdefault(device_id, {})
+        if len(pending) >= self.MAX_PENDING_PER_DEVICE:
+            oldest = next(iter(pending))
+            del pending[oldest]
+            self._timed_out(device_id)
+        pending[command_id] = PendingCommand(relays)
+        return command_id
+
+    def ack(self, device_id: str, data: Dict[str, Any], command_id: Optional[str] = None) -> int:
+        """Resolve commands confirmed by a device state_update; returns how many."""
+        pending = self._pending.get(device_id)
+        if not pending:
+            return 0
+        now = time.monotonic()
+        if command_id is not None and command_id in pending:
+            done = [command_id]
+        else:
+            reported = {
+                key: value.get("state") for key, value in data.items() if isinstance(value, dict)
+            }
+            done = [
+                cid for cid, command in pending.items()
+                if command.relays and all(reported.get(k) == v for k, v in command.relays.items())
+            ]
+        for cid in done:
+            ms = (now - pending.pop(cid).started) * 1000
+            self._series_for(device_id).add(ms)
+            self.fleet.add(ms)
+        return len(done)
+
+    def _timed_out(self, device_id: str) -> None:
+        self._series_for(device_id).timeouts += 1
+        self.fleet.timeouts += 1
+
+    def expire(self) -> int:
+        cutoff = time.monotonic() - self.timeout
+        expired = 0
+        for device_id, pending in list(self._pending.items()):
+            for cid in [cid for cid, command in pending.items() if command.started < cutoff]:
+                del pending[cid]
+                self._timed_out(device_id)
+                expired += 1
+            if not pending:
+                del self._pending[device_id]
+        return expired
+
+    def summary(self, device_id: Optional[str] = None) -> Dict[str, Any]:
+        if device_id is None:
+            return {
+                **self.fleet.summary(),
+                "pending": sum(len(p) for p in self._pending.values()),
+            }
+        series = self._series.get(device_id) or LatencySeries(self.window)
+        return {**series.summary(), "pending": len(self._pending.get(device_id, {}))}
+
+    def slowest(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """Devices ranked by p95, to spot slow devices quickly."""
+        ranked = sorted(
+            ((device_id, series.summary()) for device_id, series in self._series.items() if series.samples),
+            key=lambda item: item[1]["p95_ms"],
+            reverse=True,
+        )
+        return [{"device_id": device_id, **summary} for device_id, summary in ranked[:limit]]
+
+    async def run(self) -> None:
+        """Background loop: time out unacknowledged commands."""
+        print(f"⏱️  Command ack tracker started (timeout {self.timeout}s)...")
+        while True:
+            await asyncio.sleep(1)
+            self.expire()
+
+
+command_tracker = CommandTracker(timeout=settings.COMMAND_ACK_TIMEOUT)
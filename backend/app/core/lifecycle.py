@@ -0,0 +1,44 @@
+import asyncio
+
+from core.config import settings
+from core.presence import presence
+from core.state_store import state_store
+from core.relay_events import relay_events
+from core.latency import command_tracker
+from core.websocket import manager
+from services.notifications import notifier
+
+
+async def start_realtime_services():
+    """
+    Start the background loops behind the WebSocket path: presence expiry,
+    presence and relay state write-behind, relay event history writer, ntfy dispatcher, command
+    ack tracker, idle socket reaper and the backplane.
+    Shared by the REST app (main.py) and the standalone gateway (realtime.py).
+    """
+    asyncio.create_task(presence.run())
+    asyncio.create_task(presence.run_expiry())
+    asyncio.create_task(state_store.run())
+    asyncio.create_task(relay_events.run())
+    asyncio.create_task(notifier.run())
+    asyncio.create_task(command_tracker.run())
+    asyncio.create_task(manager.run_reaper(settings.WS_REAP_INTERVAL))
+
+    try:
+        await manager.start()
+    except Exception as e:
+        print(f"⚠️  WS backplane failed to start, broadcasts stay local: {e}")
+
+
+async def stop_realtime_services():
+    # Persist any buffered realtime state before the process exits
+    # Relay state first: its flush records the transitions the event writer then persists
+    for name, store in (("Relay state", state_store), ("Presence", presence), ("Relay events", relay_events)):
+        try:
+            await store.flush()
+            print(f"✅ {name} flushed.")
+        except Exception as e:
+            print(f"⚠️  {name} flush on shutdown failed: {e}")
+
+    await manager.stop()
+    await notifier.close()
@@ -0,0 +1,103 @@
+import base64
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from db.session import SessionLocal
+
+EXPORT_PAGE_SIZE = 500
+
+
+def encode_cursor(key: Any) -> str:
+    """Opaque cursor for the last row of a page (its sort key)."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Any:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(query, key_column, cursor: Optional[str], limit: int):
+    """
+    Rows after `cursor` in `key_column` order. Fetches one extra row so the
+    caller can tell whether there is a next page (see `finish_page`).
+    """
+    if cursor:
+        after = decode_cursor(cursor)
+        if not isinstance(after, key_column.type.python_type):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(key_column > after)
+    return query.order_by(key_column).limit(limit + 1)
+
+
+def finish_page(rows: Sequence, limit: int, key: Callable[[Any], Any],
+                request: Request, response: Response) -> List:
+    """
+    Trim the look-ahead row and advertise the next page in the `Link` (rel="next")
+    and `X-Next-Cursor` headers, keeping the body a plain list.
+    """
+    rows = list(rows)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        cursor = encode_cursor(key(rows[-1]))
+        next_url = request.url.remove_query_params(["cursor", "skip"]).include_query_params(cursor=cursor)
+        response.headers["X-Next-Cursor"] = cursor
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return rows
+
+
+async def _pages(query, key_column, key: Callable[[Any], Any]) -> AsyncIterator[Sequence]:
+    # A short-lived session per page: a slow download never pins a pooled connection
+    cursor = None
+    while True:
+        async with SessionLocal() as db:
+            result = await db.execute(keyset_page(query, key_column, cursor, EXPORT_PAGE_SIZE))
+            rows = result.scalars().all()
+        page = rows[:EXPORT_PAGE_SIZE]
+        if page:
+            yield page
+        if len(rows) <= EXPORT_PAGE_SIZE:
+            return
+        cursor = encode_cursor(key(page[-1]))
+
+
+def export_response(query, key_column, key: Callable[[Any], Any],
+                    serialize: Callable[[Any], Dict[str, Any]], columns: Sequence[str],
+                    fmt: str, filename: str) -> StreamingResponse:
+    """Stream every row of `query` as NDJSON or CSV with constant memory, paging by keyset."""
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+
+    async def ndjson():
+        async for rows in _pages(query, key_column, key):
+            yield "".join(json.dumps(serialize(row), default=str) + "\n" for row in rows)
+
+    async def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        async for rows in _pages(query, key_column, key):
+            for row in rows:
+                record = serialize(row)
+                writer.writerow({
+                    k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in record.items()
+                })
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    media_type = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    return StreamingResponse(
+        ndjson() if fmt == "ndjson" else csv_rows(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
@@ -0,0 +1,191 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import Boolean, DateTime, String, column, func, or_, update, values
+
+from core.config import settings
+from core.response_cache import response_cache
+from core.relay_events import PRESENCE_KEY, relay_events
+from db.session import SessionLocal
+from db.models import Device
+
+# A device not heard from for this long is offline
+OFFLINE_AFTER = timedelta(minutes=5)
+
+
+@dataclass
+class PresenceEntry:
+    last_seen: datetime
+    online: bool = True
+    ip_address: Optional[str] = None
+
+
+class PresenceTable:
+    """
+    In-memory record of device liveness (last_seen / online / ip_address).
+
+    Heartbeats only touch this table. Dirty rows are written back to the
+    `devices` table periodically with a single set-based UPDATE, so the cost
+    of a heartbeat no longer includes a DB round trip.
+
+    Every process (REST workers, the realtime gateway) keeps its own table, so
+    the write-back only lands where the row isn't newer than what this process
+    saw. Where another process has heard from the device since, the local entry
+    is dropped and reads fall back to the DB. Going offline is recorded in the
+    event history only once that write lands, i.e. by the process that saw the
+    device last.
+    """
+
+    def __init__(self, flush_interval: float = 5.0):
+        self.flush_interval = flush_interval
+        self._entries: Dict[str, PresenceEntry] = {}
+        self._dirty: Set[str] = set()
+        self._lock = asyncio.Lock()
+
+    def touch(self, device_id: str, ip_address: Optional[str] = None) -> None:
+        """Record a heartbeat (or any other sign of life) for a device."""
+        entry = self._entries.get(device_id)
+        now = datetime.utcnow()
+        if entry is None:
+            entry = PresenceEntry(last_seen=now, ip_address=ip_address)
+            self._entries[device_id] = entry
+            response_cache.invalidate_device(device_id)
+            relay_events.record(device_id, {PRESENCE_KEY: True}, "presence")
+        else:
+            if not entry.online or (ip_address and ip_address != entry.ip_address):
+                response_cache.invalidate_device(device_id)
+            if not entry.online:
+                relay_events.record(device_id, {PRESENCE_KEY: True}, "presence")
+            entry.last_seen = now
+            entry.online = True
+            if ip_address:
+                entry.ip_address = ip_address
+        self._dirty.add(device_id)
+
+    def mark_offline(self, device_id: str) -> None:
+        entry = self._entries.get(device_id)
+        if entry is None or not entry.online:
+            return
+        entry.online = False
+        self._dirty.add(device_id)
+        response_cache.invalidate_device(device_id)
+
+    def forget(self, device_id: str) -> None:
+        """Drop a device entirely (e.g. after it was deleted)."""
+        self._entries.pop(device_id, None)
+        self._dirty.discard(device_id)
+
+    def get(self, device_id: str) -> Optional[PresenceEntry]:
+        return self._entries.get(device_id)
+
+    def is_fresh(self, device_id: str, cutoff: datetime) -> bool:
+        entry = self._entries.get(device_id)
+        return entry is not None and entry.online and entry.last_seen >= cutoff
+
+    def expire(self, cutoff: datetime) -> List[str]:
+        """Mark every in-memory device not seen since `cutoff` as offline."""
+        expired = [
+            device_id for device_id, entry in self._entries.items()
+            if entry.online and entry.last_seen < cutoff
+        ]
+        for device_id in expired:
+            self.mark_offline(device_id)
+        return expired
+
+    def apply(self, device: Device) -> Device:
+        """Overlay the in-memory presence onto a Device row loaded from the DB."""
+        entry = self._entries.get(device.id)
+        if entry is not None:
+            device.last_seen = entry.last_seen
+            device.online = entry.online
+            if entry.ip_address:
+                device.ip_address = entry.ip_address
+        return device
+
+    async def flush(self) -> int:
+        """
+        Write all dirty entries back in one UPDATE ... FROM (VALUES ...), skipping
+        rows another process has seen more recently. Returns the rows written.
+        """
+        async with self._lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, set()
+            rows = [
+                (device_id, entry.last_seen, entry.online, entry.ip_address)
+                for device_id in dirty
+                if (entry := self._entries.get(device_id)) is not None
+            ]
+            if not rows:
+                return 0
+
+            batch = values(
+                column("id", String),
+                column("last_seen", DateTime(timezone=True)),
+                column("online", Boolean),
+                column("ip_address", String),
+                name="presence",
+            ).data(rows)
+            stmt = (
+                update(Device)
+                .where(
+                    Device.id == batch.c.id,
+                    or_(Device.last_seen.is_(None), Device.last_seen <= batch.c.last_seen),
+                )
+                .values(
+                    last_seen=batch.c.last_seen,
+                    online=batch.c.online,
+                    ip_address=func.coalesce(batch.c.ip_address, Device.ip_address),
+                )
+                .returning(Device.id)
+                .execution_options(synchronize_session=False)
+            )
+            try:
+                async with SessionLocal() as db:
+                    written = set((await db.execute(stmt)).scalars().all())
+                    await db.commit()
+            except Exception:
+                # Put the rows back so the next flush retries them
+                self._dirty |= dirty
+                raise
+
+            for device_id, _, online, _ in rows:
+                if device_id in written:
+                    if not online:
+                        relay_events.record(device_id, {PRESENCE_KEY: False}, "presence")
+                elif device_id not in self._dirty:
+                    # Newer in the DB (another process); unless touched meanwhile, stop overlaying it
+                    self._entries.pop(device_id, None)
+                    response_cache.invalidate_device(device_id)
+            return len(written)
+
+    async def run(self) -> None:
+        """Background loop: flush dirty presence rows every `flush_interval` seconds."""
+        print(f"💓 Presence flusher started (every {self.flush_interval}s)...")
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Presence flush error: {e}")
+
+    async def run_expiry(self, interval: float = 60.0) -> None:
+        """
+        Background loop: every `interval` seconds, mark devices silent for
+        OFFLINE_AFTER as offline. Runs in every process that holds presence
+        (the REST app and the realtime gateway each see their own devices);
+        the flush only applies an expiry where this process saw the device last.
+        """
+        print("📡 Presence expiry started...")
+        while True:
+            try:
+                for device_id in self.expire(datetime.utcnow() - OFFLINE_AFTER):
+                    print(f"📴 Device {device_id} marked offline (presence expired)")
+            except Exception as e:
+                print(f"❌ Presence expiry error: {e}")
+            await asyncio.sleep(interval)
+
+
+presence = PresenceTable(flush_interval=settings.PRESENCE_FLUSH_INTERVAL)
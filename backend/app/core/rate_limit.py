@@ -0,0 +1,170 @@
+import ipaddress
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from core.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    # redis not installed — only the in-process store is available
+    aioredis = None
+
+
+def parse_rate(spec: str) -> Tuple[float, int]:
+    """'10/minute' -> (tokens per second, burst). The burst is the count itself."""
+    count, _, period = spec.partition("/")
+    seconds = {"second": 1, "minute": 60, "hour": 3600}[period.strip() or "second"]
+    return int(count) / seconds, int(count)
+
+
+def parse_networks(spec: str) -> Optional[List]:
+    """'10.0.0.0/8,::1' -> networks; None for "*" (trust every peer)."""
+    if spec.strip() == "*":
+        return None
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in spec.split(",") if part.strip()]
+
+
+def _trusted(address: str, networks: Optional[List]) -> bool:
+    if networks is None:
+        return True
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_ip(request: Request, trusted_proxies: Optional[str] = None) -> str:
+    """
+    The address of the client behind our proxies. X-Forwarded-For is only
+    believed when the direct peer is a trusted proxy; it is then read right
+    to left, skipping further trusted hops, so a client can't spoof the key
+    by sending its own header. `trusted_proxies` overrides TRUSTED_PROXIES.
+    """
+    networks = _trusted_proxies if trusted_proxies is None else parse_networks(trusted_proxies)
+    peer = request.client.host if request.client else "unknown"
+    if not _trusted(peer, networks):
+        return peer
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop, networks):
+            return hop
+    return hops[0] if hops else peer
+
+
+_trusted_proxies = parse_networks(settings.TRUSTED_PROXIES)
+
+
+class MemoryBuckets:
+    """Token buckets in this process; the least recently used keys are dropped past `max_keys`."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        """Take `cost` tokens; returns 0 if allowed, else seconds until enough are available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class RedisBuckets:
+    """
+    Token buckets shared by every worker/instance through Redis (REDIS_URL).
+    Fails open: if Redis is unreachable, requests are allowed.
+    """
+
+    SCRIPT = """
+    local rate, burst, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 't', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    local wait = 0
+    if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+    redis.call('HSET', KEYS[1], 't', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str):
+        self._redis = aioredis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: int, cost: int = 1) -> float:
+        try:
+            wait = await self._script(keys=[f"ratelimit:{key}"], args=[rate, burst, time.time(), cost])
+            return float(wait)
+        except Exception as e:
+            print(f"⚠️  Rate limit store unavailable, allowing request: {e}")
+            return 0.0
+
+
+def get_bucket_store():
+    if settings.RATE_LIMIT_BACKEND == "redis" and aioredis is not None and settings.REDIS_URL:
+        return RedisBuckets(settings.REDIS_URL)
+    return MemoryBuckets()
+
+
+class RateLimiter:
+    """One budget (e.g. logins per IP) applied independently to each key."""
+
+    def __init__(self, name: str, spec: str, store=None):
+        self.name = name
+        self.rate, self.burst = parse_rate(spec)
+        self.store = store or MemoryBuckets()
+        self.allowed = 0
+        self.limited = 0
+
+    async def check(self, key: str, cost: int = 1) -> float:
+        """0 if `key` may spend `cost` tokens, else the seconds to wait (for Retry-After)."""
+        wait = await self.store.take(f"{self.name}:{key}", self.rate, self.burst, cost)
+        if wait:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return wait
+
+    async def enforce(self, key: str, cost: int = 1) -> None:
+        """Raise 429 Too Many Requests when `key` is over budget."""
+        wait = await self.check(key, cost)
+        if wait:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, round(wait)))},
+            )
+
+    def summary(self) -> Dict[str, int]:
+        return {"allowed": self.allowed, "limited": self.limited}
+
+
+_store = get_bucket_store()
+
+# Argon2 logins, per client IP and account, plus a looser per-IP budget against password spraying
+login_limiter = RateLimiter("login", settings.RATE_LIMIT_LOGIN, _store)
+login_ip_limiter = RateLimiter("login_ip", settings.RATE_LIMIT_LOGIN_IP, _store)
+# Relay commands over REST, per user (or per device when using its api_key)
+relay_limiter = RateLimiter("relay", settings.RATE_LIMIT_RELAY, _store)
+# POST /devices/relays/bulk, per user, charged one token per operation
+bulk_relay_limiter = RateLimiter("relay_bulk", settings.RATE_LIMIT_RELAY_BULK, _store)
+# Inbound WebSocket frames, per socket. Sockets are pinned to one
+# worker, so this budget always stays in-process (no round trip per frame).
+ws_frame_limiter = RateLimiter("ws", settings.RATE_LIMIT_WS_FRAMES)
+
+limiters = (login_limiter, login_ip_limiter, relay_limiter, bulk_relay_limiter, ws_frame_limiter)
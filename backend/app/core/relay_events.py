@@ -0,0 +1,169 @@
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from core.config import settings
+from db.session import engine
+
+COLUMNS = ("ts", "device_id", "relay_key", "state", "source")
+# Online/offline flips go through the same history under this reserved key,
+# so device uptime is rolled up like the on-time of a relay
+PRESENCE_KEY = "_online"
+Event = Tuple[datetime, str, str, bool, str]
+
+
+def _month(day: date, offset: int = 0) -> date:
+    index = day.year * 12 + day.month - 1 + offset
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"relay_events_{month:%Y_%m}"
+
+
+async def ensure_partitions(months_ahead: int = 2) -> None:
+    """Create the monthly relay_events partitions from last month to `months_ahead`."""
+    this_month = _month(datetime.now(timezone.utc).date())
+    async with engine.begin() as conn:
+        for offset in range(-1, months_ahead + 1):
+            start, end = _month(this_month, offset), _month(this_month, offset + 1)
+            await conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF relay_events "
+                f"FOR VALUES FROM ('{start} 00:00+00') TO ('{end} 00:00+00')"
+            ))
+
+
+async def drop_expired_partitions(before: datetime) -> List[str]:
+    """Drop monthly partitions that end on or before `before`; returns their names."""
+    async with engine.begin() as conn:
+        result = await conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'relay_events'::regclass"
+        ))
+        dropped = []
+        for (name,) in result.all():
+            try:
+                year, month = int(name[-7:-3]), int(name[-2:])
+            except ValueError:
+                continue  # not one of ours
+            end = _month(date(year, month, 1), 1)
+            if datetime(end.year, end.month, 1, tzinfo=timezone.utc) <= before:
+                await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+                dropped.append(name)
+        return dropped
+
+
+def late_hours(timestamps: Iterable[datetime], now: datetime, grace: float) -> Set[datetime]:
+    """Hours among `timestamps` that the rollup may already have closed (ended over `grace` seconds ago)."""
+    hours = set()
+    for ts in timestamps:
+        hour = ts.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        if hour + timedelta(hours=1, seconds=grace) <= now:
+            hours.add(hour)
+    return hours
+
+
+class RelayEventWriter:
+    """
+    Batching writer for the append-only relay_events history.
+
+    record() only appends to an in-memory buffer, so callers on the relay and
+    WebSocket paths never wait on it. A background task COPYs the buffer into
+    relay_events every `flush_interval` seconds, or as soon as `max_batch`
+    events are waiting. While the database is unreachable events are kept, up
+    to `max_buffer`; past that the oldest are dropped and counted. A batch
+    that lands after its hour may have been rolled up (e.g. after an outage)
+    marks that hour in rollup_late_hours, in the same transaction, so the
+    rollup re-rolls it.
+    """
+
+    def __init__(self, flush_interval: float = 1.0, max_batch: int = 1000, max_buffer: int = 100000):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_buffer = max_buffer
+        self._buffer: List[Event] = []
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.written = 0
+        self.dropped = 0
+
+    def record(self, device_id: str, transitions: Dict[str, bool], source: str,
+               ts: Optional[datetime] = None) -> None:
+        """Queue relay transitions, e.g. {"relay1": True}, as seen by `source`."""
+        if not transitions:
+            return
+        ts = ts or datetime.now(timezone.utc)
+        for relay_key, state in transitions.items():
+            self._buffer.append((ts, device_id, relay_key, bool(state), source))
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    async def _copy(self, batch: List[Event]) -> None:
+        late = late_hours((event[0] for event in batch), datetime.now(timezone.utc), settings.ROLLUP_GRACE)
+        async with engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            driver = raw.driver_connection
+            async with driver.transaction():
+                await driver.copy_records_to_table("relay_events", records=batch, columns=COLUMNS)
+                if late:
+                    await driver.executemany(
+                        "INSERT INTO rollup_late_hours (hour) VALUES ($1) ON CONFLICT DO NOTHING",
+                        [(hour,) for hour in sorted(late)],
+                    )
+
+    async def flush(self) -> int:
+        """COPY everything buffered in one round trip."""
+        async with self._lock:
+            if not self._buffer:
+                return 0
+            batch, self._buffer = self._buffer, []
+            try:
+                await self._copy(batch)
+            except Exception:
+                # Keep order: the failed batch goes back in front of newer events
+                self._buffer[:0] = batch
+                overflow = len(self._buffer) - self.max_buffer
+                if overflow > 0:
+                    del self._buffer[:overflow]
+                    self.dropped += overflow
+                raise
+            self.written += len(batch)
+            return len(batch)
+
+    async def run(self) -> None:
+        """Background loop: flush on interval or when a batch is full."""
+        print(f"📜 Relay event writer started (every {self.flush_interval}s / {self.max_batch} events)...")
+        try:
+            await ensure_partitions()
+        except Exception as e:
+            print(f"⚠️  Relay event partitions not ensured: {e}")
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Relay event flush error: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+    def summary(self) -> Dict[str, int]:
+        return {"buffered": len(self._buffer), "written": self.written, "dropped": self.dropped}
+
+
+relay_events = RelayEventWriter(
+    flush_interval=settings.RELAY_EVENT_FLUSH_INTERVAL,
+    max_batch=settings.RELAY_EVENT_BATCH,
+    max_buffer=settings.RELAY_EVENT_BUFFER,
+)
@@ -0,0 +1,64 @@
+"""
+device_relays mirrors every relay with a boolean "state" in devices.start_state.
+
+Writers change start_state and upsert the matching device_relays rows in the
+same statement (or transaction), always locking the device row first, so the
+two never disagree and concurrent writers can't deadlock. start_state stays
+the JSON view the API returns; fleet-level queries use device_relays' indexes.
+"""
+
+from typing import Dict, Iterable
+
+from sqlalchemy import Boolean, String, case, column, func, literal, select
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.models import Device, DeviceRelay
+
+
+def relay_rows(source):
+    """SELECT device_id, relay_key, state for each relay in `source`'s (id, start_state) rows."""
+    state = source.c.start_state
+    relays = func.jsonb_each(
+        case((func.jsonb_typeof(state) == "object", state), else_=literal({}, JSONB))
+    ).table_valued(column("key", String), column("value", JSONB), joins_implicitly=True)
+    return select(
+        source.c.id,
+        relays.c.key,
+        relays.c.value["state"].astext.cast(Boolean),
+    ).where(func.jsonb_typeof(relays.c.value["state"]) == "boolean")
+
+
+def upsert_relays(rows):
+    """
+    INSERT ... ON CONFLICT for `relay_rows`; only relays whose state changed get
+    a new version. RETURNING yields exactly those transitions (new relays included).
+    """
+    statement = insert(DeviceRelay).from_select(["device_id", "relay_key", "state"], rows)
+    return statement.on_conflict_do_update(
+        index_elements=[DeviceRelay.device_id, DeviceRelay.relay_key],
+        set_={
+            "state": statement.excluded.state,
+            "updated_at": func.now(),
+            "version": DeviceRelay.version + 1,
+        },
+        where=DeviceRelay.state.is_distinct_from(statement.excluded.state),
+    ).returning(DeviceRelay.device_id, DeviceRelay.relay_key, DeviceRelay.state)
+
+
+async def sync_relays(db: AsyncSession, device_ids: Iterable[str]) -> Dict[str, Dict[str, bool]]:
+    """
+    Bring device_relays in line with start_state for rows this transaction
+    already changed (and locked). Flushes pending ORM changes first.
+    Returns the relays that actually switched: {device_id: {relay_key: state}}.
+    """
+    device_ids = list(device_ids)
+    if not device_ids:
+        return {}
+    await db.flush()
+    devices = select(Device.id, Device.start_state).where(Device.id.in_(device_ids)).subquery()
+    result = await db.execute(upsert_relays(relay_rows(devices)))
+    transitions: Dict[str, Dict[str, bool]] = {}
+    for device_id, relay_key, state in result.all():
+        transitions.setdefault(device_id, {})[relay_key] = state
+    return transitions
@@ -0,0 +1,173 @@
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from fastapi import Request, Response
+
+from core import codec
+from core.config import settings
+
+# Changes every heartbeat; leaving it out of the ETag is what makes it weak
+VOLATILE_FIELDS = ("last_seen",)
+
+
+@dataclass
+class CachedResponse:
+    etag: str
+    body: bytes
+    owner_id: Optional[int]
+    expires: float
+    device_ids: Tuple[str, ...] = ()
+
+
+def weak_etag(payload: Any) -> str:
+    """Weak validator over everything but VOLATILE_FIELDS — same on every worker and across restarts."""
+    def strip(item):
+        return {k: v for k, v in item.items() if k not in VOLATILE_FIELDS} if isinstance(item, dict) else item
+
+    stable = [strip(item) for item in payload] if isinstance(payload, list) else strip(payload)
+    digest = hashlib.blake2b(codec.dumps(stable).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+class ResponseCache:
+    """
+    Serialized GET /devices responses (per owner list, per device), with weak ETags.
+
+    Any state change — relay update, presence online/offline flip, create,
+    delete, rename — invalidates the entries containing that device; entries
+    also expire after `ttl` so changes only visible in another worker's
+    memory show up eventually.
+
+    Fills race with writes: a GET may read the DB, a write commit and
+    invalidate, and the GET then store its pre-write payload. So readers take
+    `generation()` before querying and pass it to put(), which doesn't store
+    the payload if any of its devices (or its owner) was invalidated since.
+    """
+
+    def __init__(self, ttl: float = 10.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._by_device: Dict[str, Set[Hashable]] = {}
+        self._by_owner: Dict[int, Set[Hashable]] = {}
+        # Generation of the latest invalidation per device/owner, oldest first and
+        # bounded; `_forgotten` is the newest generation dropped from it
+        self._generation = 0
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._forgotten = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.stale_fills = 0
+
+    def generation(self) -> int:
+        """Take before reading the DB for a fill; pass to put()."""
+        return self._generation
+
+    def _bump(self, scope: Hashable) -> None:
+        self._generation += 1
+        self._invalidated[scope] = self._generation
+        self._invalidated.move_to_end(scope)
+        while len(self._invalidated) > self.max_entries:
+            _, self._forgotten = self._invalidated.popitem(last=False)
+
+    def _changed_since(self, generation: int, owner_id: Optional[int], device_ids: Iterable[str]) -> bool:
+        if generation < self._forgotten:
+            return True  # can't tell any more; assume it did
+        scopes = [("device", device_id) for device_id in device_ids] + [("owner", owner_id)]
+        return any(self._invalidated.get(scope, 0) > generation for scope in scopes)
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires < time.monotonic():
+            if entry is not None:
+                self._discard(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: Hashable, payload: Any, owner_id: Optional[int],
+            device_ids: Iterable[str], generation: Optional[int] = None) -> CachedResponse:
+        """
+        Build the response entry and cache it, unless `generation` (from
+        generation() before the read) shows the payload may predate a write.
+        """
+        device_ids = tuple(device_ids)
+        entry = CachedResponse(
+            etag=weak_etag(payload),
+            body=codec.dumps(payload).encode(),
+            owner_id=owner_id,
+            expires=time.monotonic() + self.ttl,
+            device_ids=device_ids,
+        )
+        if generation is not None and self._changed_since(generation, owner_id, device_ids):
+            self.stale_fills += 1
+            return entry  # served to this request only
+        self._discard(key)
+        self._entries[key] = entry
+        for device_id in device_ids:
+            self._by_device.setdefault(device_id, set()).add(key)
+        if owner_id is not None:
+            self._by_owner.setdefault(owner_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+        return entry
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for index, scope in [(self._by_device, d) for d in entry.device_ids] + [(self._by_owner, entry.owner_id)]:
+            keys = index.get(scope)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[scope]
+
+    def invalidate_device(self, device_id: str) -> None:
+        self._bump(("device", device_id))
+        for key in list(self._by_device.get(device_id, ())):
+            self._discard(key)
+
+    def invalidate_owner(self, owner_id: int) -> None:
+        """The owner's device list changed (device added/removed)."""
+        self._bump(("owner", owner_id))
+        for key in list(self._by_owner.get(owner_id, ())):
+            self._discard(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._by_device.clear()
+        self._by_owner.clear()
+        # Every fill in flight predates this
+        self._invalidated.clear()
+        self._generation += 1
+        self._forgotten = self._generation
+
+    def respond(self, request: Request, entry: CachedResponse) -> Response:
+        """200 with the cached body, or 304 if the client's If-None-Match still matches."""
+        headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+        if_none_match = request.headers.get("if-none-match", "")
+        candidates = {tag.strip() for tag in if_none_match.split(",")}
+        # Weak comparison: W/"x" and "x" match
+        if "*" in candidates or entry.etag in candidates or entry.etag[2:] in candidates:
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "stale_fills": self.stale_fills,
+        }
+
+
+response_cache = ResponseCache(ttl=settings.RESPONSE_CACHE_TTL)
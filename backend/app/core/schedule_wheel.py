@@ -0,0 +1,198 @@
+import asyncio
+import bisect
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+MINUTES_PER_DAY = 24 * 60
+_MINUTES = {f"{m // 60:02d}:{m % 60:02d}": m for m in range(MINUTES_PER_DAY)}
+
+
+class ScheduledAction(NamedTuple):
+    id: int
+    device_id: str
+    relay_key: str
+    action: bool
+    time: str  # HH:MM, local time like the rest of the scheduler
+
+
+def minute_of_day(value: str) -> int:
+    """'07:30' -> 450. Raises ValueError for anything but a valid HH:MM."""
+    try:
+        return _MINUTES[value]
+    except (KeyError, TypeError):
+        raise ValueError(f"time must be HH:MM, got {value!r}") from None
+
+
+class ScheduleWheel:
+    """
+    Active schedules in memory, on a 1440-slot timing wheel (one slot per
+    minute of the day), so finding what is due never touches the database.
+
+    `_occupied` keeps the non-empty minutes sorted, so the next due time is a
+    bisect away. `run()` sleeps exactly until then and is woken early when a
+    schedule is added or removed. Due slots are fired from a cursor (the last
+    minute handled) up to now, so a tick that runs late still fires every
+    schedule it passed, once. Changes first collect whatever is already due,
+    so a schedule added for a minute that has just gone by waits for tomorrow.
+    """
+
+    def __init__(self, clock: Callable[[], datetime] = datetime.now):
+        self.clock = clock
+        self._slots: Dict[int, Dict[int, ScheduledAction]] = {}
+        self._minute_of: Dict[int, int] = {}
+        self._occupied: List[int] = []
+        self._changed = asyncio.Event()
+        self._cursor: Optional[datetime] = None
+        self._pending: List[ScheduledAction] = []
+        # Ids changed through add/remove while a reconcile query is in flight
+        self._touched: Optional[Set[int]] = None
+        self._malformed: Set[int] = set()  # already warned about
+        self.fired = 0
+
+    def __len__(self) -> int:
+        return len(self._minute_of)
+
+    def __contains__(self, schedule_id: int) -> bool:
+        return schedule_id in self._minute_of
+
+    def _catch_up(self) -> None:
+        if self._cursor is not None:
+            self._pending.extend(self.due(self.clock()))
+
+    def add(self, schedule: ScheduledAction) -> None:
+        """Insert or replace a schedule. Raises ValueError for a malformed time."""
+        minute = minute_of_day(schedule.time)
+        self._catch_up()
+        self._insert(schedule, minute)
+        if self._touched is not None:
+            self._touched.add(schedule.id)
+
+    def _insert(self, schedule: ScheduledAction, minute: int) -> None:
+        self._discard(schedule.id)
+        slot = self._slots.get(minute)
+        if slot is None:
+            slot = self._slots[minute] = {}
+            bisect.insort(self._occupied, minute)
+        slot[schedule.id] = schedule
+        self._minute_of[schedule.id] = minute
+        self._changed.set()
+
+    def remove(self, schedule_id: int) -> bool:
+        if self._touched is not None:
+            self._touched.add(schedule_id)
+        return self._discard(schedule_id)
+
+    def _discard(self, schedule_id: int) -> bool:
+        minute = self._minute_of.pop(schedule_id, None)
+        if minute is None:
+            return False
+        slot = self._slots[minute]
+        del slot[schedule_id]
+        if not slot:
+            del self._slots[minute]
+            del self._occupied[bisect.bisect_left(self._occupied, minute)]
+        self._changed.set()
+        return True
+
+    def begin_reconcile(self) -> None:
+        """Call before reading the DB: changes made from here on win over that read in load()."""
+        self._touched = set()
+
+    def load(self, schedules: Iterable[ScheduledAction]) -> int:
+        """
+        Replace the contents with `schedules` (the active rows from the DB).
+        Returns how many schedules were added, removed or changed, i.e. how far
+        memory had drifted from the table. Malformed times are skipped, and so
+        are schedules added or removed since begin_reconcile().
+        """
+        touched, self._touched = self._touched or set(), None
+        wanted: Dict[int, Tuple[ScheduledAction, int]] = {}
+        for schedule in schedules:
+            if schedule.id in touched:
+                continue
+            try:
+                wanted[schedule.id] = (schedule, minute_of_day(schedule.time))
+            except ValueError as e:
+                if schedule.id not in self._malformed:
+                    self._malformed.add(schedule.id)
+                    print(f"⚠️  Schedule {schedule.id} skipped: {e}")
+
+        self._catch_up()
+        drift = 0
+        for schedule_id in [s for s in self._minute_of if s not in wanted and s not in touched]:
+            self._discard(schedule_id)
+            drift += 1
+        for schedule_id, (schedule, minute) in wanted.items():
+            current = self._minute_of.get(schedule_id)
+            if current is None or self._slots[current][schedule_id] != schedule:
+                self._insert(schedule, minute)
+                drift += 1
+        return drift
+
+    def start(self, now: datetime) -> None:
+        """Begin firing from the current minute on (like the old poll did at startup)."""
+        self._cursor = now.replace(second=0, microsecond=0) - timedelta(minutes=1)
+
+    def next_due(self) -> Optional[datetime]:
+        """The first occupied minute after the cursor, or None when nothing is scheduled."""
+        if not self._occupied or self._cursor is None:
+            return None
+        cursor = self._cursor
+        current = cursor.hour * 60 + cursor.minute
+        index = bisect.bisect_right(self._occupied, current)
+        if index < len(self._occupied):
+            ahead = self._occupied[index] - current
+        else:
+            ahead = MINUTES_PER_DAY - current + self._occupied[0]
+        return cursor + timedelta(minutes=ahead)
+
+    def due(self, now: datetime) -> List[ScheduledAction]:
+        """Schedules in every slot between the cursor and `now` (at most a day back); advances the cursor."""
+        if self._cursor is None:
+            self.start(now)
+        this_minute = now.replace(second=0, microsecond=0)
+        # After a suspend longer than a day, each slot still fires only once
+        self._cursor = max(self._cursor, this_minute - timedelta(days=1) + timedelta(minutes=1))
+        actions: List[ScheduledAction] = []
+        while True:
+            at = self.next_due()
+            if at is None or at > now:
+                break
+            actions.extend(self._slots[at.hour * 60 + at.minute].values())
+            self._cursor = at
+        self._cursor = max(self._cursor, this_minute)
+        self.fired += len(actions)
+        return actions
+
+    async def run(self, execute: Callable[[List[ScheduledAction]], Awaitable[None]]) -> None:
+        """Background loop: sleep until the next due minute (or a change), then execute what is due."""
+        if self._cursor is None:
+            self.start(self.clock())
+        while True:
+            actions, self._pending = self._pending + self.due(self.clock()), []
+            if actions:
+                try:
+                    await execute(actions)
+                except Exception as e:
+                    print(f"❌ Schedule Error: {e}")
+            if self._pending:
+                continue  # collected by a change made while executing
+            self._changed.clear()
+            at = self.next_due()
+            timeout = None if at is None else max((at - self.clock()).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def summary(self) -> Dict[str, object]:
+        at = self.next_due()
+        return {
+            "schedules": len(self),
+            "minutes": len(self._occupied),
+            "next_due": at.isoformat() if at else None,
+            "fired": self.fired,
+        }
+
+
+schedule_wheel = ScheduleWheel()
@@ -1,50 +1,74 @@
 import asyncio
 import httpx
 import os
-from datetime import datetime, timedelta
-from sqlalchemy import select
+from datetime import datetime
+from sqlalchemy import select, update
 from db.session import SessionLocal
 from db.models import Schedule, Device
-from api.api_v1.endpoints.devices import _update_relay_state
+from core.config import settings
+from core.presence import OFFLINE_AFTER, presence
+from core.schedule_wheel import ScheduledAction, schedule_wheel
+from core.response_cache import response_cache
+from core.relay_events import PRESENCE_KEY, relay_events
+from core.websocket import manager
+from api.api_v1.endpoints.devices import _write_state
+
+async def reconcile_schedules() -> int:
+    """Reload the active schedules into the wheel; returns how many had drifted."""
+    schedule_wheel.begin_reconcile()
+    async with SessionLocal() as db:
+        result = await db.execute(
+            select(Schedule.id, Schedule.device_id, Schedule.relay_key, Schedule.action, Schedule.time)
+            .filter(Schedule.is_active == True)
+        )
+        return schedule_wheel.load(ScheduledAction(*row) for row in result.all())
+
+
+async def _run_schedules(schedules):
+    async with SessionLocal() as db:
+        for schedule in schedules:
+            print(f"⚡ Executing Schedule: {schedule.time} -> Device {schedule.device_id}")
+            try:
+                # Execute the action — system action, no user auth needed.
+                # Atomic, so a user toggling the same device meanwhile isn't overwritten
+                state = await _write_state(
+                    db, schedule.device_id, relays={schedule.relay_key: schedule.action},
+                    source="schedule",
+                )
+                if state is not None:
+                    await manager.publish_update(
+                        schedule.device_id, {schedule.relay_key: {"state": schedule.action}}
+                    )
+            except Exception as e:
+                print(f"❌ Schedule Error: {e}")
+
 
 async def check_schedules():
     """
-    Runs every minute to check for pending schedules.
+    Fires schedules from the in-memory wheel, waking exactly at the next due
+    minute. The wheel is loaded once here and kept current by the schedule
+    endpoints; a periodic reconcile against the DB catches anything they
+    missed (e.g. changes made through another worker).
     """
     print("⏰ Scheduler started...")
     while True:
-        now = datetime.now()
-        current_time = now.strftime("%H:%M")
-        
-        # New DB session for this check
-        async with SessionLocal() as db:
-            # Find active schedules matching current time
-            result = await db.execute(select(Schedule).filter(
-                Schedule.is_active == True,
-                Schedule.time == current_time
-            ))
-            schedules = result.scalars().all()
-            
-            for schedule in schedules:
-                print(f"⚡ Executing Schedule: {schedule.time} -> Device {schedule.device_id}")
-                try:
-                    # Execute the action
-                    # Note: We pass None for user because scheduler is a system action
-                    await _update_relay_state(
-                        db, 
-                        schedule.device_id, 
-                        schedule.relay_key, 
-                        schedule.action
-                        # current_user=None by default — system action, no user auth needed
-                    )
-                except Exception as e:
-                    print(f"❌ Schedule Error: {e}")
-                    
-        # Sleep until next minute
-        # Calculate seconds until next minute start to be precise
-        now = datetime.now()
-        sleep_seconds = 60 - now.second
-        await asyncio.sleep(sleep_seconds)
+        try:
+            count = await reconcile_schedules()
+            print(f"⏰ Loaded {count} schedule(s) into the wheel")
+            break
+        except Exception as e:
+            print(f"❌ Schedule load error: {e}")
+            await asyncio.sleep(10)
+    asyncio.create_task(schedule_wheel.run(_run_schedules))
+
+    while True:
+        await asyncio.sleep(settings.SCHEDULE_RECONCILE_INTERVAL)
+        try:
+            drift = await reconcile_schedules()
+            if drift:
+                print(f"⏰ Reconciled {drift} schedule(s) with the DB")
+        except Exception as e:
+            print(f"❌ Schedule reconcile error: {e}")
 
 
 async def check_device_online_status():
@@ -52,26 +76,37 @@ async def check_device_online_status():
     Runs every 60 seconds.
     Marks any device as offline if it hasn't sent a heartbeat in the last 5 minutes.
     This prevents devices from staying 'online' forever after they disconnect.
+    Devices in the in-memory presence table are expired by presence.run_expiry
+    (started with the realtime services); this only sweeps the DB for devices
+    the presence table has never seen (e.g. right after a restart).
     """
     print("📡 Device online-status watcher started...")
-    OFFLINE_THRESHOLD = timedelta(minutes=5)
     while True:
         try:
+            cutoff = datetime.utcnow() - OFFLINE_AFTER
             async with SessionLocal() as db:
-                cutoff = datetime.utcnow() - OFFLINE_THRESHOLD
                 result = await db.execute(
-                    select(Device).filter(
+                    select(Device.id, Device.last_seen).filter(
                         Device.online == True,
                         Device.last_seen < cutoff
                     )
                 )
-                stale_devices = result.scalars().all()
-                for device in stale_devices:
-                    device.online = False
-                    db.add(device)
-                    print(f"📴 Device {device.id} marked offline (last seen: {device.last_seen})")
-                if stale_devices:
+                stale_ids = []
+                for device_id, last_seen in result.all():
+                    if presence.get(device_id) is not None:
+                        continue  # presence table is authoritative for this device
+                    stale_ids.append(device_id)
+                    print(f"📴 Device {device_id} marked offline (last seen: {last_seen})")
+                if stale_ids:
+                    await db.execute(
+                        update(Device)
+                        .where(Device.id.in_(stale_ids))
+                        .values(online=False, last_seen=Device.last_seen)  # keep last_seen (skip onupdate)
+                    )
                     await db.commit()
+                    for device_id in stale_ids:
+                        response_cache.invalidate_device(device_id)
+                        relay_events.record(device_id, {PRESENCE_KEY: False}, "presence")
         except Exception as e:
             print(f"❌ Online-status watcher error: {e}")
 
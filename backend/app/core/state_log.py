@@ -0,0 +1,75 @@
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from core.config import settings
+
+Delta = Tuple[int, Dict[str, Any]]
+
+
+class StateLog:
+    """
+    Per-device sequence numbers plus a ring buffer of recent state deltas.
+
+    Every state change broadcast to viewers gets a `seq` that only ever grows
+    for that device. A reconnecting client passes the last seq it saw and gets
+    just the deltas it missed — or None, meaning "too far behind, send a
+    snapshot".
+
+    Sequence numbers are stamped like a hybrid logical clock: max(last + 1,
+    microseconds since the epoch). They keep increasing across restarts, so a
+    `since` from before a restart is older than this process's floor and
+    falls back to a snapshot.
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self._last: Dict[str, int] = {}
+        # Every delta with seq > floor is still in the buffer
+        self._floor: Dict[str, int] = {}
+        self._deltas: Dict[str, Deque[Delta]] = {}
+
+    def _stamp(self, device_id: str) -> int:
+        return max(self._last.get(device_id, 0) + 1, time.time_ns() // 1000)
+
+    def head(self, device_id: str) -> int:
+        """Current seq for a device (starting its log if needed) — use it to stamp snapshots."""
+        if device_id not in self._last:
+            base = self._stamp(device_id)
+            self._last[device_id] = self._floor[device_id] = base
+            self._deltas[device_id] = deque(maxlen=self.size)
+        return self._last[device_id]
+
+    def record(self, device_id: str, delta: Dict[str, Any]) -> int:
+        """Stamp and store a locally originated delta; returns its seq."""
+        self.head(device_id)
+        seq = self._stamp(device_id)
+        self._append(device_id, seq, delta)
+        return seq
+
+    def observe(self, device_id: str, seq: int, delta: Dict[str, Any]) -> None:
+        """Store a delta stamped by another worker (arrived via the backplane)."""
+        if seq > self.head(device_id):
+            self._append(device_id, seq, delta)
+
+    def _append(self, device_id: str, seq: int, delta: Dict[str, Any]) -> None:
+        buffer = self._deltas[device_id]
+        if len(buffer) == buffer.maxlen:
+            self._floor[device_id] = buffer[0][0]  # about to be evicted
+        buffer.append((seq, delta))
+        self._last[device_id] = seq
+
+    def since(self, device_id: str, seq: int) -> Optional[List[Delta]]:
+        """Deltas after `seq`, or None if they are no longer (or never were) buffered."""
+        last = self._last.get(device_id)
+        if last is None or seq > last or seq < self._floor[device_id]:
+            return None
+        return [(s, delta) for s, delta in self._deltas[device_id] if s > seq]
+
+    def forget(self, device_id: str) -> None:
+        self._last.pop(device_id, None)
+        self._floor.pop(device_id, None)
+        self._deltas.pop(device_id, None)
+
+
+state_log = StateLog(size=settings.STATE_LOG_SIZE)
@@ -0,0 +1,109 @@
+import asyncio
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select
+
+from core.config import settings
+from core.relays import sync_relays
+from core.relay_events import relay_events
+from db.session import SessionLocal
+from db.models import Device
+
+
+class StateStore:
+    """
+    Write-behind buffer for relay state reported by devices.
+
+    `state_update` messages merge their relay deltas in memory; a background
+    task persists every pending device in one transaction, either every
+    `flush_interval` seconds or as soon as `max_pending` devices are waiting.
+    The WebSocket receive loop therefore never waits on the database.
+    """
+
+    def __init__(self, flush_interval: float = 0.5, max_pending: int = 100):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def merge(self, device_id: str, delta: Dict[str, Any]) -> None:
+        """Queue a relay delta, e.g. {"relay1": {"state": true}}."""
+        if not delta:
+            return
+        self._pending.setdefault(device_id, {}).update(delta)
+        if len(self._pending) >= self.max_pending:
+            self._wakeup.set()
+
+    def pending(self, device_id: str) -> Optional[Dict[str, Any]]:
+        return self._pending.get(device_id)
+
+    def apply(self, device: Device) -> Device:
+        """Overlay not-yet-persisted deltas onto a Device row (read-through)."""
+        delta = self._pending.get(device.id)
+        if delta:
+            device.start_state = {**(device.start_state or {}), **delta}
+        return device
+
+    def pop(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Remove and return the buffered delta, for writers about to commit the row
+        themselves (so a later flush can't replay an older report over their
+        change). They must requeue() it if their write fails.
+        """
+        return self._pending.pop(device_id, None)
+
+    def requeue(self, device_id: str, delta: Optional[Dict[str, Any]]) -> None:
+        """Put back a delta whose write failed, letting anything that arrived meanwhile win."""
+        if delta:
+            self._pending[device_id] = {**delta, **self._pending.get(device_id, {})}
+
+    async def flush(self) -> int:
+        """Persist all pending deltas in a single transaction."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            try:
+                async with SessionLocal() as db:
+                    # Lock in id order, like the bulk relay command, so the two can't deadlock
+                    result = await db.execute(
+                        select(Device)
+                        .where(Device.id.in_(list(batch)))
+                        .order_by(Device.id)
+                        .with_for_update()
+                    )
+                    for device in result.scalars().all():
+                        state = dict(device.start_state or {})
+                        state.update(batch[device.id])
+                        device.start_state = state
+                    transitions = await sync_relays(db, batch)
+                    await db.commit()
+            except Exception:
+                for device_id, delta in batch.items():
+                    self.requeue(device_id, delta)
+                raise
+            for device_id, switched in transitions.items():
+                relay_events.record(device_id, switched, "device")
+            return len(batch)
+
+    async def run(self) -> None:
+        """Background loop: flush on interval or when the size threshold is hit."""
+        print(f"💾 State write-behind started (every {self.flush_interval}s / {self.max_pending} devices)...")
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ State flush error: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+
+state_store = StateStore(
+    flush_interval=settings.STATE_FLUSH_INTERVAL,
+    max_pending=settings.STATE_FLUSH_MAX_PENDING,
+)
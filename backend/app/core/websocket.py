@@ -1,65 +1,349 @@
-from typing import Dict, List
-from fastapi import WebSocket
-import httpx
+import asyncio
+import time
+from typing import Dict, Iterable, Optional, Set
+from fastapi import WebSocket, status
 from core.config import settings
+from core import codec
+from core.backplane import Backplane, InProcessBackplane, get_backplane
+from core.state_log import state_log
+from core.latency import command_tracker
+from core.presence import presence
+from core.response_cache import response_cache
+from services.notifications import notifier
+
+
+class Connection:
+    """
+    One registered socket with its own bounded outbound queue and writer task.
+    `is_device` tells the ESP32 socket apart from dashboard (viewer) sockets;
+    `binary` marks sockets that negotiated the MessagePack subprotocol.
+    Multiplexed user sockets have `subscriptions` (the device ids they watch)
+    instead of a single device_id. `last_inbound` is when the client last sent
+    anything; the reaper closes sockets that stay silent for too long.
+    `queued_bytes` is the size of the frames waiting in `queue`.
+    """
+
+    __slots__ = ("websocket", "device_id", "is_device", "binary", "queue", "writer", "subscriptions",
+                 "last_inbound", "queued_bytes")
+
+    def __init__(self, websocket: WebSocket, device_id: Optional[str], queue_size: int,
+                 is_device: bool = False, binary: bool = False):
+        self.websocket = websocket
+        self.device_id = device_id
+        self.is_device = is_device
+        self.binary = binary
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.subscriptions: Optional[Set[str]] = None
+        self.last_inbound = time.monotonic()
+        self.queued_bytes = 0
+
+    def touch(self):
+        """Record an inbound frame (call from the receive loop)."""
+        self.last_inbound = time.monotonic()
+
+    @property
+    def label(self) -> str:
+        return self.device_id or f"user socket ({len(self.subscriptions or ())} devices)"
+
+
+# Sent to quiet dashboards; any reply (clients answer {"type": "pong"}) proves they're alive
+PING = {"type": "ping"}
+
 
 class ConnectionManager:
-    def __init__(self):
-        # Map device_id -> List of WebSockets (could be the device itself + multiple frontend clients)
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    def __init__(self, queue_size: int = 64, send_timeout: float = 5.0,
+                 backplane: Optional[Backplane] = None, ping_after: float = 30.0,
+                 idle_timeout: float = 90.0):
+        # Map device_id -> {WebSocket: Connection} (could be the device itself + multiple frontend clients)
+        self.active_connections: Dict[str, Dict[WebSocket, Connection]] = {}
+        # Multiplexed user sockets, and the index device_id -> {WebSocket: Connection} of their subscriptions
+        self.user_connections: Dict[WebSocket, Connection] = {}
+        self.subscribers: Dict[str, Dict[WebSocket, Connection]] = {}
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.evicted_slow = 0
+        self.evicted_dead = 0
+        self.ping_after = ping_after
+        self.idle_timeout = idle_timeout
+        self.reaped_devices = 0
+        self.reaped_viewers = 0
+        self.reclaimed_bytes = 0  # queued outbound frames dropped with reaped sockets
+        self._background: Set[asyncio.Task] = set()
+        # Carries broadcasts to sockets held by other workers/instances
+        self.backplane = backplane or InProcessBackplane()
+
+    async def start(self):
+        await self.backplane.start(self._deliver_remote)
 
-    async def connect(self, websocket: WebSocket, device_id: str):
-        await websocket.accept()
+    async def stop(self):
+        await self.backplane.stop()
+
+    async def connect(self, websocket: WebSocket, device_id: str, is_device: bool = False,
+                      subprotocol: Optional[str] = None) -> Connection:
+        await websocket.accept(subprotocol=subprotocol)
         if device_id not in self.active_connections:
-            self.active_connections[device_id] = []
+            self.active_connections[device_id] = {}
             # First connection for this device ID = Device Online (likely)
-            await self.send_notification(f"Device {device_id} is Online 🟢")
-            
-        self.active_connections[device_id].append(websocket)
+            notifier.device_status(device_id, online=True)
+
+        binary = subprotocol == codec.MSGPACK_SUBPROTOCOL
+        connection = Connection(websocket, device_id, self.queue_size, is_device, binary)
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.active_connections[device_id][websocket] = connection
+        return connection
 
     def disconnect(self, websocket: WebSocket, device_id: str):
-        if device_id in self.active_connections:
-            if websocket in self.active_connections[device_id]:
-                self.active_connections[device_id].remove(websocket)
-            
-            if not self.active_connections[device_id]:
-                del self.active_connections[device_id]
-                # Last connection gone = Device Offline (likely)
-                # Note: This is a synchronous method, so we can't await. 
-                # Ideally, we should use background tasks or make disconnect async.
-                # However, FastAPI's disconnect is often called in exception handlers.
-                # Hack: Use httpx.post (sync) or schedule async task. 
-                # Since we are in an async loop context (usually), we can't easily block.
-                # Let's try to just print for now or use a fire-and-forget approach if possible, 
-                # OR better: change disconnect signature if usage allows, but it's called from catch block.
-                # Actually, we can use a non-blocking way or just ignore for now to avoid freezing.
-                # Let's use a sync call with short timeout for simplicity in this prototype.
-                try:
-                    httpx.post(f"https://ntfy.sh/{settings.NTFY_TOPIC}", 
-                        data=f"Device {device_id} is Offline 🔴",
-                        headers={"Title": "HomeControl Alert", "Priority": "high"},
-                        timeout=2.0
-                    )
-                except:
-                    pass
-
-    async def send_notification(self, message: str):
+        # Idempotent: called from the endpoint's cleanup and from eviction
+        connections = self.active_connections.get(device_id)
+        if connections is None:
+            return
+        connection = connections.pop(websocket, None)
+        if connection is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+        if not connections:
+            del self.active_connections[device_id]
+            # Last connection gone = Device Offline (likely)
+            notifier.device_status(device_id, online=False)
+
+    # ─── Multiplexed per-user sockets ───────────────────────────────────────
+
+    async def connect_user(self, websocket: WebSocket, subprotocol: Optional[str] = None) -> Connection:
+        """Register a socket that receives updates for every device it subscribes to."""
+        await websocket.accept(subprotocol=subprotocol)
+        binary = subprotocol == codec.MSGPACK_SUBPROTOCOL
+        connection = Connection(websocket, None, self.queue_size, binary=binary)
+        connection.subscriptions = set()
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.user_connections[websocket] = connection
+        return connection
+
+    def subscribe(self, websocket: WebSocket, device_ids: Iterable[str]):
+        """Add devices to a user socket (ownership must already be checked)."""
+        connection = self.user_connections.get(websocket)
+        if connection is None:
+            return
+        for device_id in device_ids:
+            connection.subscriptions.add(device_id)
+            self.subscribers.setdefault(device_id, {})[websocket] = connection
+
+    def unsubscribe(self, websocket: WebSocket, device_ids: Iterable[str]):
+        connection = self.user_connections.get(websocket)
+        if connection is None:
+            return
+        for device_id in device_ids:
+            connection.subscriptions.discard(device_id)
+            subscribers = self.subscribers.get(device_id)
+            if subscribers is not None:
+                subscribers.pop(websocket, None)
+                if not subscribers:
+                    del self.subscribers[device_id]
+
+    def disconnect_user(self, websocket: WebSocket):
+        # Idempotent, like disconnect()
+        connection = self.user_connections.get(websocket)
+        if connection is None:
+            return
+        self.unsubscribe(websocket, list(connection.subscriptions))
+        del self.user_connections[websocket]
+        if connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def _drop(self, connection: Connection):
+        if connection.subscriptions is not None:
+            self.disconnect_user(connection.websocket)
+        else:
+            self.disconnect(connection.websocket, connection.device_id)
+
+    async def _writer(self, connection: Connection):
+        """Drain one connection's queue; a send that fails or stalls evicts the consumer."""
         try:
-            async with httpx.AsyncClient() as client:
-                await client.post(f"https://ntfy.sh/{settings.NTFY_TOPIC}", 
-                    data=message,
-                    headers={"Title": "HomeControl Alert"}
-                )
+            while True:
+                frame = await connection.queue.get()
+                connection.queued_bytes -= len(frame)
+                async with asyncio.timeout(self.send_timeout):
+                    if connection.binary:
+                        await connection.websocket.send_bytes(frame)
+                    else:
+                        await connection.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"Failed to send notification: {e}")
+            self.evicted_dead += 1
+            print(f"🔌 Evicting dead WS consumer on {connection.label}: {e!r}")
+            self._drop(connection)
+            await self._close(connection.websocket, status.WS_1011_INTERNAL_ERROR)
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await asyncio.wait_for(websocket.close(code=code), timeout=self.send_timeout)
+        except Exception:
+            pass
+
+    def _evict_slow(self, connection: Connection):
+        self.evicted_slow += 1
+        print(f"🐢 Evicting slow WS consumer on {connection.label} (queue full)")
+        self._drop(connection)
+        task = asyncio.create_task(self._close(connection.websocket, status.WS_1013_TRY_AGAIN_LATER))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    # ─── Idle / half-open socket reaper ─────────────────────────────────────
+
+    def _connections(self):
+        for connections in list(self.active_connections.values()):
+            yield from list(connections.values())
+        yield from list(self.user_connections.values())
+
+    def reap_idle(self) -> int:
+        """
+        Close sockets silent for longer than `idle_timeout`; ping dashboards that
+        have been quiet for `ping_after` (devices heartbeat on their own, and
+        ASGI apps can't see protocol-level pongs). Returns how many were reaped.
+        """
+        now = time.monotonic()
+        reaped = 0
+        for connection in self._connections():
+            silent = now - connection.last_inbound
+            if silent >= self.idle_timeout:
+                self._reap(connection, silent)
+                reaped += 1
+            elif silent >= self.ping_after and not connection.is_device:
+                frame = codec.pack(PING) if connection.binary else codec.dumps(PING)
+                self._enqueue(connection, frame)
+        return reaped
+
+    def _reap(self, connection: Connection, silent: float):
+        reclaimed = connection.queued_bytes
+        self.reclaimed_bytes += reclaimed
+        if connection.is_device:
+            self.reaped_devices += 1
+        else:
+            self.reaped_viewers += 1
+        print(f"💀 Reaping WS on {connection.label}: silent for {silent:.0f}s ({reclaimed} queued bytes dropped)")
+        self._drop(connection)
+        # Half-open: no one will read the close frame, so don't wait on it
+        task = asyncio.create_task(self._close(connection.websocket, status.WS_1001_GOING_AWAY))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        if connection.is_device and not self.has_device(connection.device_id):
+            presence.mark_offline(connection.device_id)
+
+    async def run_reaper(self, interval: float = 10.0):
+        print(f"💀 WS reaper started (idle timeout {self.idle_timeout}s)...")
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reap_idle()
+            except Exception as e:
+                print(f"⚠️  WS reaper error: {e}")
+
+    def _enqueue(self, connection: Connection, frame):
+        try:
+            connection.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self._evict_slow(connection)
+        else:
+            connection.queued_bytes += len(frame)
+
+    def _fanout(self, device_id: str, message: dict, devices: bool, viewers: bool,
+                exclude: Optional[WebSocket] = None):
+        # Encode once per wire format, then enqueue the same frame for every recipient;
+        # each writer task delivers independently, so a slow viewer can't hold up the device.
+        connections = self.active_connections.get(device_id)
+        if connections:
+            frames = {}
+            for connection in list(connections.values()):
+                if not (devices if connection.is_device else viewers):
+                    continue
+                if connection.websocket is exclude:
+                    continue
+                frame = frames.get(connection.binary)
+                if frame is None:
+                    frame = codec.pack(message) if connection.binary else codec.dumps(message)
+                    frames[connection.binary] = frame
+                self._enqueue(connection, frame)
+
+        # User sockets are viewers too; their copy is tagged with the device id
+        subscribers = self.subscribers.get(device_id) if viewers else None
+        if subscribers:
+            tagged = {**message, "device_id": device_id}
+            frames = {}
+            for connection in list(subscribers.values()):
+                if connection.websocket is exclude:
+                    continue
+                frame = frames.get(connection.binary)
+                if frame is None:
+                    frame = codec.pack(tagged) if connection.binary else codec.dumps(tagged)
+                    frames[connection.binary] = frame
+                self._enqueue(connection, frame)
+
+    def _deliver_remote(self, device_id: str, message: dict, devices: bool, viewers: bool):
+        # Keep this worker's state log in step with updates stamped elsewhere
+        msg_type = message.get("type")
+        if msg_type == "update" and "seq" in message:
+            state_log.observe(device_id, message["seq"], message.get("data", {}))
+            response_cache.invalidate_device(device_id)
+        # Sent from a process without the device's socket (e.g. the REST app beside
+        # the realtime gateway): the worker holding the socket tracks the ack instead
+        if devices and msg_type in ("update", "command") and "id" not in message \
+                and self.has_device(device_id):
+            message = {**message, "id": command_tracker.start(device_id, message.get("data", {}))}
+        self._fanout(device_id, message, devices, viewers)
+
+    def has_device(self, device_id: str) -> bool:
+        """Is the device itself connected to this worker?"""
+        connections = self.active_connections.get(device_id)
+        return bool(connections) and any(c.is_device for c in connections.values())
+
+    async def publish_update(self, device_id: str, data: dict, devices: bool = True,
+                             exclude: Optional[WebSocket] = None) -> int:
+        """
+        Broadcast a relay state change as a sequence-numbered "update".
+        Goes to viewers (minus `exclude`) and, unless devices=False, to the device —
+        in which case it is tracked as a command awaiting the device's ack.
+        """
+        seq = state_log.record(device_id, data)
+        response_cache.invalidate_device(device_id)
+        message = {"type": "update", "seq": seq, "data": data}
+        if devices and self.has_device(device_id):
+            message["id"] = command_tracker.start(device_id, data)
+        self._fanout(device_id, message, devices=devices, viewers=True, exclude=exclude)
+        self.backplane.publish(device_id, message, devices=devices, viewers=True)
+        return seq
+
+    def send_to(self, websocket: WebSocket, device_id: Optional[str], message: dict):
+        """Queue a message for a single socket (e.g. a resume replay)."""
+        connection = self.active_connections.get(device_id, {}).get(websocket)
+        if connection is None:
+            connection = self.user_connections.get(websocket)
+            if connection is None:
+                return
+            if device_id is not None:
+                message = {**message, "device_id": device_id}
+        frame = codec.pack(message) if connection.binary else codec.dumps(message)
+        self._enqueue(connection, frame)
 
     async def broadcast(self, device_id: str, message: dict):
-        if device_id in self.active_connections:
-            # Send message to all connected clients for this device
-            for connection in self.active_connections[device_id][:]: 
-                try:
-                    await connection.send_json(message)
-                except Exception:
-                    pass
-
-manager = ConnectionManager()
+        """Send to the device and all of its viewers (server-side state changes)."""
+        self._fanout(device_id, message, devices=True, viewers=True)
+        self.backplane.publish(device_id, message, devices=True, viewers=True)
+
+    async def send_to_device(self, device_id: str, message: dict):
+        """Send only to the device's own socket (e.g. a command from a dashboard)."""
+        self._fanout(device_id, message, devices=True, viewers=False)
+        self.backplane.publish(device_id, message, devices=True, viewers=False)
+
+    async def send_to_viewers(self, device_id: str, message: dict, exclude: Optional[WebSocket] = None):
+        """Send only to dashboards watching the device, optionally skipping the sender."""
+        self._fanout(device_id, message, devices=False, viewers=True, exclude=exclude)
+        self.backplane.publish(device_id, message, devices=False, viewers=True)
+
+manager = ConnectionManager(
+    queue_size=settings.WS_SEND_QUEUE_SIZE,
+    send_timeout=settings.WS_SEND_TIMEOUT,
+    backplane=get_backplane(),
+    ping_after=settings.WS_PING_AFTER,
+    idle_timeout=settings.WS_IDLE_TIMEOUT,
+)
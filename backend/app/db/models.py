@@ -1,6 +1,7 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, JSON, LargeBinary
+from sqlalchemy import Boolean, Column, Date, Float, ForeignKey, Index, Integer, String, Text, DateTime, LargeBinary
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from db.session import Base
 import datetime
 
@@ -29,11 +30,103 @@ class Device(Base):
     last_seen = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     ip_address = Column(String, nullable=True)
     
-    # Store relay state as JSON: {"relay1": {"state": true}, ...}
-    start_state = Column(JSON, default={})
+    # Store relay state as JSONB: {"relay1": {"state": true}, ...}
+    start_state = Column(JSONB, default={})
     
     owner = relationship("User", back_populates="devices")
 
+    # (filter, id) pairs for keyset-paginated admin listings
+    __table_args__ = (
+        Index("ix_devices_owner_id_id", "owner_id", "id"),
+        Index("ix_devices_online_id", "online", "id"),
+        Index("ix_devices_type_id", "type", "id"),
+        # Containment queries, e.g. start_state @> '{"relay1": {"name": "Lamp"}}'
+        Index("ix_devices_start_state", "start_state", postgresql_using="gin",
+              postgresql_ops={"start_state": "jsonb_path_ops"}),
+    )
+
+
+class DeviceRelay(Base):
+    """
+    One row per relay — the queryable record of relay state.
+    Written in the same statement/transaction as Device.start_state, which
+    stays as the JSON view returned by the API (see core/relays.py).
+    """
+    __tablename__ = "device_relays"
+
+    device_id = Column(String, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    relay_key = Column(String, primary_key=True)
+    state = Column(Boolean, nullable=False, server_default="false")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    version = Column(Integer, server_default="1", nullable=False)  # +1 on every change
+
+    __table_args__ = (
+        # "Which devices have relay3 on" / counts of relays on: only the rows that are on
+        Index("ix_device_relays_on", "relay_key", "device_id", postgresql_where=text("state")),
+    )
+
+
+class RelayEvent(Base):
+    """
+    Append-only history: one row per relay transition. Range-partitioned by
+    month on `ts`; old partitions are dropped whole (see core/relay_events.py).
+    No primary key on purpose — rows are only ever appended and scanned by time.
+    """
+    __tablename__ = "relay_events"
+
+    ts = Column(DateTime(timezone=True), nullable=False)
+    device_id = Column(String, nullable=False)
+    relay_key = Column(String, nullable=False)  # or PRESENCE_KEY for online/offline
+    state = Column(Boolean, nullable=False)
+    source = Column(String, nullable=False)  # "api", "device", "schedule", "voice", "presence"
+
+    __table_args__ = (
+        Index("ix_relay_events_device_ts", "device_id", "ts"),
+        Index("ix_relay_events_ts", "ts", postgresql_using="brin"),
+        {"postgresql_partition_by": "RANGE (ts)"},
+    )
+    __mapper_args__ = {"primary_key": [ts, device_id, relay_key]}
+
+
+class RelayUsageHourly(Base):
+    """Per relay and hour: transitions and seconds on. A row exists for every relay on at the hour's end."""
+    __tablename__ = "relay_usage_hourly"
+
+    device_id = Column(String, primary_key=True)
+    relay_key = Column(String, primary_key=True)
+    hour = Column(DateTime(timezone=True), primary_key=True)
+    toggles = Column(Integer, nullable=False, default=0)
+    on_seconds = Column(Float, nullable=False, default=0)
+    end_state = Column(Boolean, nullable=False)
+
+    __table_args__ = (Index("ix_relay_usage_hourly_hour", "hour"),)
+
+
+class RelayUsageDaily(Base):
+    """Per relay and UTC day, summed from relay_usage_hourly."""
+    __tablename__ = "relay_usage_daily"
+
+    device_id = Column(String, primary_key=True)
+    relay_key = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    toggles = Column(Integer, nullable=False, default=0)
+    on_seconds = Column(Float, nullable=False, default=0)
+
+
+class RollupWatermark(Base):
+    """How far a rollup has got: every window before `upto` is complete."""
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String, primary_key=True)
+    upto = Column(DateTime(timezone=True), nullable=False)
+
+
+class RollupLateHour(Base):
+    """Hours that got relay_events after they may already have been rolled up (re-rolled, then deleted)."""
+    __tablename__ = "rollup_late_hours"
+
+    hour = Column(DateTime(timezone=True), primary_key=True)
+
 
 class Firmware(Base):
     __tablename__ = "firmware"
@@ -1,9 +1,30 @@
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 from core.config import settings
 
-engine = create_async_engine(settings.ASYNC_DATABASE_URL, echo=True)
+engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    echo=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+)
+
+
+class QueryCounter:
+    """Counts SQL statements executed by this process (reported by GET /stats/runtime)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+
+query_counter = QueryCounter()
+event.listen(engine.sync_engine, "before_cursor_execute", query_counter)
+
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 SessionLocal = AsyncSessionLocal  # Alias for scheduler compatibility
 
@@ -61,6 +61,27 @@ async def on_startup():
         # Drop stale sensor columns removed in temperature-sensor cleanup
         "ALTER TABLE devices DROP COLUMN IF EXISTS temperature;",
         "ALTER TABLE devices DROP COLUMN IF EXISTS humidity;",
+        # Keyset pagination filters on /devices/admin/all and the exports
+        "CREATE INDEX IF NOT EXISTS ix_devices_owner_id_id ON devices (owner_id, id);",
+        "CREATE INDEX IF NOT EXISTS ix_devices_online_id ON devices (online, id);",
+        "CREATE INDEX IF NOT EXISTS ix_devices_type_id ON devices (type, id);",
+        # Relay state as JSONB, patched in place by jsonb_set (only converts once)
+        """DO $$ BEGIN
+            IF (SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'devices' AND column_name = 'start_state') = 'json' THEN
+                ALTER TABLE devices ALTER COLUMN start_state TYPE JSONB USING start_state::jsonb;
+            END IF;
+        END $$;""",
+        # Containment queries on the JSON view (relay attributes beyond state)
+        "CREATE INDEX IF NOT EXISTS ix_devices_start_state ON devices USING GIN (start_state jsonb_path_ops);",
+        # Backfill device_relays from start_state (only while the table is still empty)
+        """INSERT INTO device_relays (device_id, relay_key, state)
+        SELECT d.id, r.key, (r.value->>'state')::boolean
+        FROM devices d,
+             jsonb_each(CASE WHEN jsonb_typeof(d.start_state) = 'object' THEN d.start_state ELSE '{}' END) r
+        WHERE jsonb_typeof(r.value->'state') = 'boolean'
+          AND NOT EXISTS (SELECT 1 FROM device_relays)
+        ON CONFLICT DO NOTHING;""",
     ]
     try:
         async with engine.begin() as conn:
@@ -76,8 +97,18 @@ async def on_startup():
     asyncio.create_task(check_schedules())
     asyncio.create_task(check_device_online_status())
     asyncio.create_task(keep_alive_ping())
+    from services.usage_rollups import run_usage_rollups
+    asyncio.create_task(run_usage_rollups())
+    from core.lifecycle import start_realtime_services
+    await start_realtime_services()
     print("✅ Background schedulers started.")
 
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    from core.lifecycle import stop_realtime_services
+    await stop_realtime_services()
+
 # ─── Health Endpoints ─────────────────────────────────────────────────────────
 
 @app.get("/")
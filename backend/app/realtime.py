@@ -0,0 +1,82 @@
+"""
+Standalone realtime gateway: only the WebSocket routes and the connection
+manager, no REST endpoints, CORS middleware or OpenAPI schema.
+
+Run it beside the REST app (main.py) so CPU-heavy requests — Argon2 logins,
+firmware uploads — can't add jitter to relay commands, and so the realtime
+path can be scaled and profiled on its own:
+
+    python realtime.py                     # uvloop + httptools, port REALTIME_PORT
+    uvicorn realtime:app --loop uvloop --port 8001 --no-access-log
+
+Both processes must share WS_BACKPLANE=postgres: REST writes (relay toggles,
+schedules, voice hooks) are published on the backplane and delivered to the
+sockets held here. nginx routes /api/v1/ws/ to this process
+(see backend/nginx/nginx.conf).
+"""
+from fastapi import FastAPI
+
+from core.config import settings
+from api.api_v1.endpoints import websockets, stats
+
+app = FastAPI(
+    title=f"{settings.PROJECT_NAME} Realtime",
+    openapi_url=None,
+    docs_url=None,
+    redoc_url=None,
+)
+
+app.include_router(websockets.router, prefix=settings.API_V1_STR)
+# Memory / socket / DB counters of this process, for load tests (admin only)
+app.add_api_route(f"{settings.API_V1_STR}/stats/runtime", stats.read_runtime_stats, methods=["GET"])
+
+
+@app.on_event("startup")
+async def on_startup():
+    print("⚡ Starting realtime gateway...")
+    if settings.WS_BACKPLANE != "postgres":
+        print("⚠️  WS_BACKPLANE is not 'postgres' — updates made through the REST app won't reach these sockets")
+    from core.lifecycle import start_realtime_services
+    await start_realtime_services()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    from core.lifecycle import stop_realtime_services
+    await stop_realtime_services()
+
+
+@app.get("/health")
+async def health_check():
+    from core.websocket import manager
+    return {
+        "status": "ok",
+        "devices": len(manager.active_connections),
+        "sockets": sum(len(c) for c in manager.active_connections.values()) + len(manager.user_connections),
+    }
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+
+    uvicorn.run(
+        "realtime:app",
+        host="0.0.0.0",
+        port=settings.REALTIME_PORT,
+        loop=loop,
+        http="httptools",
+        ws="websockets",
+        # Mostly idle sockets: no per-request access log, generous backlog
+        access_log=False,
+        backlog=4096,
+        # The app sends its own heartbeats/acks; protocol pings catch half-open TCP
+        ws_ping_interval=30.0,
+        ws_ping_timeout=30.0,
+        proxy_headers=True,
+    )
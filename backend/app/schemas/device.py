@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any, Union
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List, Union
 from datetime import datetime
 
 # Shared properties
@@ -20,6 +20,21 @@ class DeviceStateUpdate(BaseModel):
     # Or strict structure if preferred. Using dict for now to match current Firebase structure.
     state: Dict[str, Any]
 
+class RelayOperation(BaseModel):
+    device_id: str
+    relay_key: str   # e.g. "relay1"
+    state: bool
+
+class BulkRelayCommand(BaseModel):
+    operations: List[RelayOperation] = Field(..., min_length=1, max_length=500)
+
+class RelayOperationResult(RelayOperation):
+    status: str      # "ok" | "not_found" | "forbidden"
+
+class BulkRelayResult(BaseModel):
+    results: List[RelayOperationResult]
+    applied: int
+
 class DeviceInDBBase(DeviceBase):
     id: str
     owner_id: int
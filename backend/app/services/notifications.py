@@ -0,0 +1,95 @@
+"""
+Push alerts via ntfy.sh — https://ntfy.sh/<NTFY_TOPIC>
+Alerts are queued and sent from one background task with a pooled HTTP client,
+so nothing on the WebSocket path ever waits on ntfy.
+"""
+import asyncio
+from typing import Dict, Optional
+
+import httpx
+from core.config import settings
+
+
+class NotificationDispatcher:
+    """
+    Queue + single worker for ntfy alerts.
+
+    Online/offline changes are coalesced per device: the first change opens a
+    `coalesce_window`, later changes only update the latest state, and when the
+    window closes one alert is sent — or none, if the device flapped back to the
+    state we last reported. A reconnect storm therefore produces one alert.
+    """
+
+    def __init__(self, base_url: str, topic: str, coalesce_window: float = 15.0,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.url = f"{base_url.rstrip('/')}/{topic}"
+        self.coalesce_window = coalesce_window
+        self._client = client
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=1000)
+        self._latest: Dict[str, bool] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._last_sent: Dict[str, bool] = {}
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    def send(self, message: str, priority: Optional[str] = None) -> None:
+        """Queue an alert; never blocks. Drops (and logs) if the queue is full."""
+        headers = {"Title": "HomeControl Alert"}
+        if priority:
+            headers["Priority"] = priority
+        try:
+            self._queue.put_nowait((message, headers))
+        except asyncio.QueueFull:
+            self.failed += 1
+            print(f"⚠️  Notification queue full, dropped: {message}")
+
+    def device_status(self, device_id: str, online: bool) -> None:
+        """Report a device going online/offline; coalesced within the window."""
+        if device_id in self._timers:
+            self.coalesced += 1
+        else:
+            loop = asyncio.get_running_loop()
+            self._timers[device_id] = loop.call_later(self.coalesce_window, self._settle, device_id)
+        self._latest[device_id] = online
+
+    def _settle(self, device_id: str) -> None:
+        self._timers.pop(device_id, None)
+        online = self._latest.pop(device_id, None)
+        if online is None or self._last_sent.get(device_id) == online:
+            return  # flapped back to the state we already reported
+        self._last_sent[device_id] = online
+        if online:
+            self.send(f"Device {device_id} is Online 🟢")
+        else:
+            self.send(f"Device {device_id} is Offline 🔴", priority="high")
+
+    async def run(self) -> None:
+        """Background worker: deliver queued alerts over one pooled client."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=5.0)
+        print(f"🔔 Notification dispatcher started → {self.url}")
+        while True:
+            message, headers = await self._queue.get()
+            try:
+                await self._client.post(self.url, content=message.encode(), headers=headers)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Failed to send notification: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        if self._client is not None:
+            await self._client.aclose()
+
+
+notifier = NotificationDispatcher(
+    base_url=settings.NTFY_URL,
+    topic=settings.NTFY_TOPIC,
+    coalesce_window=settings.NTFY_COALESCE_WINDOW,
+)
@@ -0,0 +1,301 @@
+"""
+Hourly and daily relay usage, rolled up incrementally from relay_events.
+
+Each pass takes the closed hours after the `relay_usage_hourly` watermark, one
+at a time: it reads only that hour's events plus the relays that were on when
+the hour started (the previous hour's rows with end_state), writes one hourly
+row per relay that was on or switched, then re-sums that day's hourly rows for
+those relays into relay_usage_daily. The hour in progress is rolled up
+provisionally on every pass, so today's figures trail events by at most
+ROLLUP_INTERVAL. An advisory lock keeps workers from rolling up the same hour twice.
+
+Events can still arrive for an hour the watermark has passed (the writer's
+buffer outlasting an outage). The writer marks such hours in
+rollup_late_hours; the next pass re-rolls from the earliest of them up to the
+watermark, so the carried-forward state of the hours after it is fixed too,
+and rebuilds the daily rows of every day it touched.
+"""
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from core.config import settings
+from core.relay_events import drop_expired_partitions, ensure_partitions
+from core.response_cache import ResponseCache
+from db.models import RelayEvent, RelayUsageHourly, RollupLateHour, RollupWatermark
+from db.session import SessionLocal
+
+WATERMARK = "relay_usage_hourly"
+ROLLUP_LOCK = 0x72656C6179  # pg advisory lock key ("relay")
+
+# Serialized /stats/usage responses; every rollup pass may change them
+usage_cache = ResponseCache(ttl=settings.ROLLUP_INTERVAL, max_entries=1000)
+
+HOURLY_SQL = text("""
+WITH ev AS (
+    SELECT device_id, relay_key, ts, state,
+           lag(state) OVER w AS before,
+           coalesce(lead(ts) OVER w, CAST(:h1 AS timestamptz)) AS until
+    FROM relay_events
+    WHERE ts >= CAST(:h0 AS timestamptz) AND ts < CAST(:h1 AS timestamptz)
+    WINDOW w AS (PARTITION BY device_id, relay_key ORDER BY ts)
+),
+hour_events AS (
+    SELECT device_id, relay_key,
+           min(ts) AS first_ts,
+           (array_agg(state ORDER BY ts))[1] AS first_state,
+           (array_agg(state ORDER BY ts DESC))[1] AS last_state,
+           count(*) FILTER (WHERE before IS NOT NULL AND before <> state) AS toggles,
+           coalesce(sum(extract(epoch FROM until - ts)) FILTER (WHERE state), 0) AS on_after
+    FROM ev
+    GROUP BY device_id, relay_key
+),
+on_at_start AS (
+    SELECT h.device_id, h.relay_key FROM relay_usage_hourly h
+    WHERE h.hour = CAST(:hp AS timestamptz) AND h.end_state AND NOT CAST(:bootstrap AS boolean)
+    UNION
+    -- First hour ever rolled up: trust the current relay state for relays untouched since
+    SELECT r.device_id, r.relay_key FROM device_relays r
+    WHERE CAST(:bootstrap AS boolean) AND r.state AND r.updated_at < CAST(:h0 AS timestamptz)
+),
+merged AS (
+    SELECT coalesce(e.device_id, s.device_id) AS device_id,
+           coalesce(e.relay_key, s.relay_key) AS relay_key,
+           s.device_id IS NOT NULL AS on_start,
+           e.first_ts, e.first_state, e.last_state, e.toggles, e.on_after
+    FROM hour_events e
+    FULL JOIN on_at_start s ON s.device_id = e.device_id AND s.relay_key = e.relay_key
+)
+INSERT INTO relay_usage_hourly (device_id, relay_key, hour, toggles, on_seconds, end_state)
+SELECT m.device_id, m.relay_key, CAST(:h0 AS timestamptz),
+       coalesce(m.toggles, 0) + CASE WHEN m.first_state IS DISTINCT FROM m.on_start
+                                      AND m.first_state IS NOT NULL THEN 1 ELSE 0 END,
+       CASE WHEN m.on_start
+            THEN extract(epoch FROM coalesce(m.first_ts, CAST(:h1 AS timestamptz)) - CAST(:h0 AS timestamptz))
+            ELSE 0 END + coalesce(m.on_after, 0),
+       coalesce(m.last_state, m.on_start)
+FROM merged m
+WHERE EXISTS (SELECT 1 FROM devices d WHERE d.id = m.device_id)
+ON CONFLICT (device_id, relay_key, hour) DO UPDATE
+SET toggles = excluded.toggles, on_seconds = excluded.on_seconds, end_state = excluded.end_state
+""")
+
+DAILY_SQL = text("""
+INSERT INTO relay_usage_daily (device_id, relay_key, day, toggles, on_seconds)
+SELECT h.device_id, h.relay_key, CAST(:day AS date), sum(h.toggles), sum(h.on_seconds)
+FROM relay_usage_hourly h
+WHERE h.hour >= CAST(:d0 AS timestamptz) AND h.hour < CAST(:d1 AS timestamptz)
+  AND (h.device_id, h.relay_key) IN (
+      SELECT device_id, relay_key FROM relay_usage_hourly WHERE hour = CAST(:h0 AS timestamptz)
+  )
+GROUP BY h.device_id, h.relay_key
+ON CONFLICT (device_id, relay_key, day) DO UPDATE
+SET toggles = excluded.toggles, on_seconds = excluded.on_seconds
+""")
+
+# Rebuild one whole day from its hourly rows (re-rolls can drop relays from a day)
+DAY_SQL = text("""
+INSERT INTO relay_usage_daily (device_id, relay_key, day, toggles, on_seconds)
+SELECT h.device_id, h.relay_key, CAST(:day AS date), sum(h.toggles), sum(h.on_seconds)
+FROM relay_usage_hourly h
+WHERE h.hour >= CAST(:d0 AS timestamptz) AND h.hour < CAST(:d1 AS timestamptz)
+GROUP BY h.device_id, h.relay_key
+""")
+
+
+def _hour(ts: datetime) -> datetime:
+    return ts.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def daily_series(days: int, rows: Iterable[tuple]) -> Dict[Tuple[str, str], Dict[str, List]]:
+    """
+    Dense per-day arrays from relay_usage_daily rows aggregated per relay as
+    (device_id, relay_key, day_offsets, toggles, on_seconds):
+    {(device_id, relay_key): {"toggles": [...], "on_seconds": [...]}}, one slot
+    per day of the window, zero where nothing was rolled up.
+    """
+    series: Dict[Tuple[str, str], Dict[str, List]] = {}
+    for device_id, relay_key, offsets, toggles, on_seconds in rows:
+        entry = {"toggles": [0] * days, "on_seconds": [0] * days}
+        for index, day_toggles, day_seconds in zip(offsets, toggles, on_seconds):
+            if 0 <= index < days:
+                entry["toggles"][index] = day_toggles
+                entry["on_seconds"][index] = round(day_seconds)
+        series[(device_id, relay_key)] = entry
+    return series
+
+
+async def _start_hour(db) -> Optional[Tuple[datetime, bool]]:
+    """
+    Under the rollup lock: the first hour not rolled up yet and whether it is the
+    very first (bootstrap). None if another worker holds the lock or there are no events.
+    """
+    if not await db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": ROLLUP_LOCK}):
+        return None
+    h0 = await db.scalar(select(RollupWatermark.upto).where(RollupWatermark.name == WATERMARK))
+    if h0 is not None:
+        return h0, False
+    first = await db.scalar(select(func.min(RelayEvent.ts)))
+    return (_hour(first), True) if first is not None else None
+
+
+async def _roll_up(db, h0: datetime, h1: datetime, bootstrap: bool) -> None:
+    d0 = h0.replace(hour=0)
+    await db.execute(HOURLY_SQL, {
+        "h0": h0, "h1": h1, "hp": h0 - timedelta(hours=1), "bootstrap": bootstrap,
+    })
+    await db.execute(DAILY_SQL, {"h0": h0, "d0": d0, "d1": d0 + timedelta(days=1), "day": d0.date()})
+
+
+async def _reroll(db, h_from: datetime, h_to: datetime, bootstrap: bool = False) -> None:
+    """Roll up [h_from, h_to) again from scratch, then rebuild the daily rows of those days."""
+    hour = h_from
+    while hour < h_to:
+        await db.execute(RelayUsageHourly.__table__.delete().where(RelayUsageHourly.hour == hour))
+        await db.execute(HOURLY_SQL, {
+            "h0": hour, "h1": hour + timedelta(hours=1), "hp": hour - timedelta(hours=1),
+            "bootstrap": bootstrap and hour == h_from,
+        })
+        hour += timedelta(hours=1)
+    day = h_from.replace(hour=0)
+    while day < h_to:
+        await db.execute(text("DELETE FROM relay_usage_daily WHERE day = :day"), {"day": day.date()})
+        await db.execute(DAY_SQL, {"d0": day, "d1": day + timedelta(days=1), "day": day.date()})
+        day += timedelta(days=1)
+
+
+async def roll_up_late_hours(now: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Re-roll hours behind the watermark that received late events, in one
+    transaction. Returns the earliest hour re-rolled, or None if there was
+    nothing to do (or another worker holds the lock).
+
+    Only days whose hourly rows are all still kept can be rebuilt; late events
+    older than that stay in relay_events but not in the rollups.
+    """
+    now = now or datetime.now(timezone.utc)
+    async with SessionLocal() as db:
+        if not await db.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": ROLLUP_LOCK}):
+            return None
+        watermark = await db.scalar(select(RollupWatermark.upto).where(RollupWatermark.name == WATERMARK))
+        if watermark is None:
+            return None
+        late = RollupLateHour.__table__
+        hours = (await db.execute(
+            late.delete().where(late.c.hour < watermark).returning(late.c.hour)
+        )).scalars().all()
+        if not hours:
+            return None
+
+        start, bootstrap = min(hours), False
+        oldest = await db.scalar(select(func.min(RelayUsageHourly.hour)))
+        if oldest is not None and start <= oldest:
+            # Nothing rolled up before it to carry state from, like the very first pass
+            start, bootstrap = oldest, True
+        kept = (now - timedelta(days=settings.RELAY_HOURLY_RETENTION_DAYS)).replace(
+            hour=0, minute=0, second=0, microsecond=0,
+        ) + timedelta(days=1)
+        if start < kept:
+            print(f"⚠️  Late relay events before {kept.isoformat()} are past hourly retention")
+            start, bootstrap = kept, False
+        if start < watermark:
+            await _reroll(db, start, watermark, bootstrap)
+        await db.commit()
+        return start if start < watermark else None
+
+
+async def roll_up_next_hour(now: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Roll up the oldest closed hour past the watermark in one transaction.
+    Returns that hour, or None if there is nothing to do (or another worker is on it).
+    """
+    now = now or datetime.now(timezone.utc)
+    async with SessionLocal() as db:
+        start = await _start_hour(db)
+        if start is None:
+            return None
+        h0, bootstrap = start
+        h1 = h0 + timedelta(hours=1)
+        if h1 + timedelta(seconds=settings.ROLLUP_GRACE) > now:
+            return None
+
+        await _roll_up(db, h0, h1, bootstrap)
+        watermark = insert(RollupWatermark).values(name=WATERMARK, upto=h1)
+        await db.execute(watermark.on_conflict_do_update(
+            index_elements=[RollupWatermark.name], set_={"upto": h1},
+        ))
+        await db.commit()
+        return h0
+
+
+async def roll_up_current(now: Optional[datetime] = None) -> bool:
+    """
+    Provisionally roll up the hour in progress, up to `now`, so today's numbers
+    move as events arrive. The watermark stays put: once the hour closes,
+    roll_up_next_hour rewrites the same rows with the final figures.
+    Only runs when every earlier hour is done.
+    """
+    now = now or datetime.now(timezone.utc)
+    async with SessionLocal() as db:
+        start = await _start_hour(db)
+        if start is None or start[0] != _hour(now):
+            return False
+        await _roll_up(db, start[0], now, start[1])
+        await db.commit()
+        return True
+
+
+async def roll_up_pending(now: Optional[datetime] = None) -> int:
+    """
+    Re-roll hours with late events, catch up on every closed hour, then refresh
+    the current one; returns closed hours rolled up.
+    """
+    late = await roll_up_late_hours(now)
+    if late is not None:
+        print(f"📊 Re-rolled relay usage from {late.isoformat()} for late events")
+    hours = 0
+    while await roll_up_next_hour(now) is not None:
+        hours += 1
+    await roll_up_current(now)
+    usage_cache.clear()
+    return hours
+
+
+async def apply_retention(now: Optional[datetime] = None) -> None:
+    """Drop raw event partitions and hourly rows past retention (never anything not yet rolled up)."""
+    now = now or datetime.now(timezone.utc)
+    async with SessionLocal() as db:
+        watermark = await db.scalar(select(RollupWatermark.upto).where(RollupWatermark.name == WATERMARK))
+        hourly_cutoff = now - timedelta(days=settings.RELAY_HOURLY_RETENTION_DAYS)
+        # The next hour's rollup reads the last hour before the watermark
+        if watermark is not None:
+            hourly_cutoff = min(hourly_cutoff, watermark - timedelta(hours=1))
+        await db.execute(RelayUsageHourly.__table__.delete().where(RelayUsageHourly.hour < hourly_cutoff))
+        await db.commit()
+    if watermark is None:
+        return
+    cutoff = min(now - timedelta(days=settings.RELAY_EVENT_RETENTION_DAYS), watermark)
+    for name in await drop_expired_partitions(cutoff):
+        print(f"🧹 Dropped relay event partition {name}")
+
+
+async def run_usage_rollups() -> None:
+    """Background loop: roll up closed hours; once an hour, roll partitions forward and expire old data."""
+    print("📊 Usage rollups started...")
+    last_maintenance = None
+    while True:
+        try:
+            hours = await roll_up_pending()
+            if hours:
+                print(f"📊 Rolled up {hours} hour(s) of relay usage")
+            this_hour = _hour(datetime.now(timezone.utc))
+            if last_maintenance != this_hour:
+                await ensure_partitions()
+                await apply_retention()
+                last_maintenance = this_hour
+        except Exception as e:
+            print(f"❌ Usage rollup error: {e}")
+        await asyncio.sleep(settings.ROLLUP_INTERVAL)
@@ -0,0 +1,94 @@
+"""
+Microbenchmark: CPU cost of one broadcast vs. number of recipients.
+
+Compares encoding the message once per recipient (send_json, i.e. one json.dumps
+each) with encoding it once and reusing the frame, and reports the end-to-end
+cost of ConnectionManager.broadcast including queueing and writer tasks.
+
+Run: python tests/bench_broadcast.py
+"""
+import sys
+import os
+import asyncio
+import json
+import time
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core import codec
+from core.websocket import ConnectionManager
+
+RECIPIENTS = [1, 10, 100, 1000]
+ROUNDS = 200
+
+# Representative "update" message (full 4-relay state, as sent by update_device_state)
+MESSAGE = {
+    "type": "update",
+    "data": {f"relay{i}": {"state": i % 2 == 0, "name": f"Switch {i}"} for i in range(1, 5)},
+}
+
+
+class SinkWebSocket:
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        pass
+
+    async def send_json(self, data):
+        # What Starlette does inside send_json
+        json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+async def encode_per_recipient(sockets):
+    for ws in sockets:
+        await ws.send_json(MESSAGE)
+
+
+async def encode_once(sockets):
+    frame = codec.dumps(MESSAGE)
+    for ws in sockets:
+        await ws.send_text(frame)
+
+
+def _per_round_us(start: float) -> float:
+    return (time.process_time() - start) / ROUNDS * 1e6
+
+
+async def run():
+    print(f"encoder: {'orjson' if codec.orjson else 'json (stdlib)'}")
+    print("CPU µs per broadcast (serialization isolated, then full ConnectionManager path)")
+    print(f"{'recipients':>10} | {'json per recipient':>18} | {'encode once':>11} | {'manager.broadcast':>17}")
+    for n in RECIPIENTS:
+        sockets = [SinkWebSocket() for _ in range(n)]
+
+        start = time.process_time()
+        for _ in range(ROUNDS):
+            await encode_per_recipient(sockets)
+        per_recipient = _per_round_us(start)
+
+        start = time.process_time()
+        for _ in range(ROUNDS):
+            await encode_once(sockets)
+        once = _per_round_us(start)
+
+        manager = ConnectionManager()
+        for ws in sockets:
+            await manager.connect(ws, "BENCH")
+        connections = list(manager.active_connections["BENCH"].values())
+        start = time.process_time()
+        for _ in range(ROUNDS):
+            await manager.broadcast("BENCH", MESSAGE)
+            # Let every writer task deliver its frame before the next round
+            while any(connection.queue.qsize() for connection in connections):
+                await asyncio.sleep(0)
+        full = _per_round_us(start)
+        for connection in connections:
+            connection.writer.cancel()
+
+        print(f"{n:>10} | {per_recipient:>18.1f} | {once:>11.1f} | {full:>17.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
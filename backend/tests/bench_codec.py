@@ -0,0 +1,45 @@
+"""
+Wire size and parse time: JSON vs. the compact MessagePack subprotocol.
+
+Run: python tests/bench_codec.py
+"""
+import sys
+import os
+import json
+import timeit
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core import codec
+
+ROUNDS = 100000
+
+MESSAGES = {
+    # What firmware/websocketSync.h sends after a physical switch toggle
+    "state_update": {
+        "type": "state_update",
+        "data": {f"relay{i}": {"state": i % 2 == 1} for i in range(1, 5)},
+    },
+    # A dashboard toggling one relay
+    "command": {"type": "command", "data": {"relay2": {"state": True}}},
+    "heartbeat": {"type": "heartbeat"},
+}
+
+
+def _us(fn) -> float:
+    return timeit.timeit(fn, number=ROUNDS) / ROUNDS * 1e6
+
+
+if __name__ == "__main__":
+    print(f"orjson: {'yes' if codec.orjson else 'no'} | msgpack: {'yes' if codec.msgpack else 'no'}")
+    print(f"{'message':>12} | {'JSON bytes':>10} | {'msgpack bytes':>13} | "
+          f"{'json.loads µs':>13} | {'codec.loads µs':>14} | {'codec.unpack µs':>15}")
+    for name, message in MESSAGES.items():
+        text = json.dumps(message, separators=(",", ":"))
+        frame = codec.pack(message)
+        assert codec.unpack(frame) == message
+
+        print(f"{name:>12} | {len(text.encode()):>10} | {len(frame):>13} | "
+              f"{_us(lambda: json.loads(text)):>13.2f} | {_us(lambda: codec.loads(text)):>14.2f} | "
+              f"{_us(lambda: codec.unpack(frame)):>15.2f}")
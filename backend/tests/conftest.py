@@ -0,0 +1,60 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self._rows
+
+    def first(self):
+        return self._rows[0] if self._rows else None
+
+
+class FakeSession:
+    """
+    Stands in for an AsyncSession (also as `async with SessionLocal()`): every
+    execute() returns `rows` and is recorded in `statements`. `fail_on`
+    ("execute" or "commit") makes that call raise ConnectionError.
+    """
+
+    def __init__(self, rows=(), fail_on=None):
+        self.rows = list(rows)
+        self.fail_on = fail_on
+        self.statements = []
+        self.committed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        if self.fail_on == "execute":
+            raise ConnectionError("connection lost")
+        self.statements.append(statement)
+        return FakeResult(self.rows)
+
+    async def commit(self):
+        await asyncio.sleep(0)  # a real round trip: other coroutines can run meanwhile
+        if self.fail_on == "commit":
+            raise ConnectionError("connection lost")
+        self.committed = True
+
+
+@pytest.fixture
+def fake_session():
+    """The FakeSession class, to build sessions returning given rows."""
+    return FakeSession
@@ -0,0 +1,103 @@
+"""
+Load test: many long-lived WebSockets must not exhaust the DB connection pool.
+
+Start the API with a deliberately small pool, e.g.
+    cd backend/app
+    DB_POOL_SIZE=10 DB_MAX_OVERFLOW=0 uvicorn main:app --port 8000
+(RATE_LIMIT_WS_FRAMES, default 20/second, is a per-socket budget, so the one
+heartbeat each socket sends stays well under it even though every socket
+shares one token; raise it if you add chattier traffic)
+then run (raise the fd limit first: `ulimit -n 4096`):
+    python tests/load_ws_pool.py --sockets 1000
+
+The test opens N dashboard sockets plus the device socket, sends heartbeats on
+all of them, toggles a relay over REST and checks that every socket receives
+the update and that REST requests still complete while all sockets are open.
+"""
+import argparse
+import asyncio
+import json
+import random
+import string
+import time
+
+import httpx
+import websockets
+
+
+def get_random_string(length=10):
+    letters = string.ascii_lowercase
+    return ''.join(random.choice(letters) for i in range(length))
+
+
+async def setup(client, base_url):
+    email = f"{get_random_string()}@example.com"
+    password = "password123"
+    device_id = f"LOAD-{get_random_string(5).upper()}"
+
+    await client.post(f"{base_url}/users/", json={"email": email, "password": password})
+    r = await client.post(f"{base_url}/login/access-token", data={"username": email, "password": password})
+    r.raise_for_status()
+    token = r.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    r = await client.post(f"{base_url}/devices/", headers=headers,
+                          json={"id": device_id, "name": "Load Test", "type": "esp32"})
+    r.raise_for_status()
+    return token, headers, device_id, r.json()["api_key"]
+
+
+async def open_socket(uri):
+    return await websockets.connect(uri, open_timeout=30, ping_interval=None)
+
+
+async def main(base_url, ws_url, count):
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        token, headers, device_id, api_key = await setup(client, base_url)
+        print(f"📱 Device {device_id} registered")
+
+        start = time.perf_counter()
+        device_ws = await open_socket(f"{ws_url}/{device_id}?api_key={api_key}")
+        viewers = []
+        for batch_start in range(0, count, 100):
+            batch = [open_socket(f"{ws_url}/{device_id}?token={token}")
+                     for _ in range(min(100, count - batch_start))]
+            viewers.extend(await asyncio.gather(*batch))
+        print(f"🔌 {len(viewers)} viewer sockets + 1 device socket open in {time.perf_counter() - start:.1f}s")
+
+        # Every socket sends a heartbeat — none of this may need a pooled connection
+        await asyncio.gather(*(ws.send(json.dumps({"type": "heartbeat"})) for ws in viewers + [device_ws]))
+
+        # REST must still get a pool connection while all sockets are open
+        start = time.perf_counter()
+        r = await client.post(f"{base_url}/devices/{device_id}/relays/relay1/on", headers=headers)
+        r.raise_for_status()
+        r = await client.get(f"{base_url}/devices/{device_id}", headers=headers)
+        r.raise_for_status()
+        print(f"🌐 REST toggle + read with {count} sockets open: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        async def expect_update(ws):
+            while True:
+                message = json.loads(await asyncio.wait_for(ws.recv(), timeout=15))
+                if message.get("type") == "update":
+                    return message["data"].get("relay1", {}).get("state") is True
+
+        results = await asyncio.gather(*(expect_update(ws) for ws in viewers + [device_ws]),
+                                       return_exceptions=True)
+        received = sum(1 for r in results if r is True)
+
+        await asyncio.gather(*(ws.close() for ws in viewers + [device_ws]))
+
+        if received == count + 1:
+            print(f"✅ TEST PASSED: all {received} sockets received the update")
+        else:
+            print(f"❌ TEST FAILED: only {received}/{count + 1} sockets received the update")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000/api/v1")
+    parser.add_argument("--ws-url", default="ws://localhost:8000/api/v1/ws")
+    parser.add_argument("--sockets", type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.base_url, args.ws_url, args.sockets))
@@ -0,0 +1,339 @@
+"""
+Virtual ESP32 fleet simulator / WebSocket load test.
+
+Registers N simulated devices (spread over several users) and M dashboards
+through the regular /users, /devices and /ws APIs. Each virtual device speaks
+the same protocol as firmware/websocketSync.h: initial state_update on
+connect, heartbeat every --heartbeat seconds, applies command/update frames
+and confirms commands carrying an id with `state_update` + `"ack"`.
+Dashboards use the multiplexed /ws/user socket and send relay commands at
+--rate commands/second in total.
+
+Reports connection setup time, command delivery (dashboard -> device) and
+round-trip (dashboard -> device -> dashboard) latency percentiles, and — with
+admin credentials — server memory per connection and DB statements per command
+from GET /stats/runtime.
+
+Fully local against docker-compose Postgres:
+    cd backend && docker-compose up -d db
+    # every simulated user logs in from this host: lift the per-IP login limit;
+    # each dashboard socket sends --rate / --dashboards commands per second, and a
+    # socket over RATE_LIMIT_WS_FRAMES (20/second per socket) is closed with 1008
+    cd app && RATE_LIMIT_LOGIN=100000/minute RATE_LIMIT_LOGIN_IP=100000/minute \
+        RATE_LIMIT_WS_FRAMES=1000/second uvicorn main:app --port 8000
+    curl "localhost:8000/api/v1/setup/create-admin?secret=homecontrol_setup_2024"
+    ulimit -n 8192
+    python tests/simulate_fleet.py --devices 500 --dashboards 50 --rate 50 --duration 60
+"""
+import argparse
+import asyncio
+import os
+import random
+import string
+import sys
+import time
+import uuid
+
+import httpx
+import websockets
+
+# Add the app directory to sys.path so the fleet uses the server's own codec
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core import codec
+
+RELAYS = 4
+
+
+def get_random_string(length=10):
+    letters = string.ascii_lowercase
+    return ''.join(random.choice(letters) for i in range(length))
+
+
+def percentiles(samples):
+    if not samples:
+        return "n/a"
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+    return f"p50={pick(50):.1f}ms p95={pick(95):.1f}ms p99={pick(99):.1f}ms max={ordered[-1]:.1f}ms (n={len(ordered)})"
+
+
+class Stats:
+    def __init__(self):
+        self.device_connect_ms = []
+        self.dashboard_connect_ms = []
+        self.delivery_ms = []
+        self.rtt_ms = []
+        self.commands_sent = 0
+        self.connect_errors = 0
+        self.disconnects = 0
+        # command id -> monotonic send time (shared clock: fleet and dashboards live in this process)
+        self.sent_at = {}
+
+
+class Link:
+    """One WebSocket, JSON or MessagePack, same framing as the server."""
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.ws = None
+
+    async def open(self, url):
+        subprotocols = [codec.MSGPACK_SUBPROTOCOL] if self.binary else None
+        self.ws = await websockets.connect(url, subprotocols=subprotocols, open_timeout=30, max_queue=None)
+
+    async def send(self, message):
+        await self.ws.send(codec.pack(message) if self.binary else codec.dumps(message))
+
+    async def recv(self):
+        data = await self.ws.recv()
+        return codec.unpack(data) if isinstance(data, bytes) else codec.loads(data)
+
+
+class VirtualDevice:
+    def __init__(self, device_id, api_key, binary):
+        self.device_id = device_id
+        self.api_key = api_key
+        self.relays = [False] * RELAYS
+        self.link = Link(binary)
+
+    def state(self):
+        return {f"relay{i + 1}": {"state": s} for i, s in enumerate(self.relays)}
+
+    async def connect(self, ws_url, stats):
+        start = time.perf_counter()
+        try:
+            await self.link.open(f"{ws_url}/{self.device_id}?api_key={self.api_key}")
+        except Exception:
+            stats.connect_errors += 1
+            return False
+        stats.device_connect_ms.append((time.perf_counter() - start) * 1000)
+        return True
+
+    async def serve(self, stats, heartbeat, stop):
+        await self.link.send({"type": "state_update", "data": self.state()})
+        beat = asyncio.create_task(self._heartbeat(heartbeat))
+        try:
+            while not stop.is_set():
+                message = await self.link.recv()
+                if message.get("type") not in ("command", "update"):
+                    continue
+                for key, value in (message.get("data") or {}).items():
+                    index = int(key[5:]) - 1 if key[5:].isdigit() else -1
+                    if 0 <= index < RELAYS and isinstance(value, dict):
+                        self.relays[index] = bool(value.get("state"))
+                command_id = message.get("id")
+                if command_id:
+                    sent = stats.sent_at.get(command_id)
+                    if sent is not None:
+                        stats.delivery_ms.append((time.monotonic() - sent) * 1000)
+                    await self.link.send({"type": "state_update", "data": self.state(), "ack": command_id})
+        except websockets.ConnectionClosed:
+            if not stop.is_set():
+                stats.disconnects += 1
+        finally:
+            beat.cancel()
+
+    async def _heartbeat(self, interval):
+        # Spread heartbeats out like a real fleet that booted at different times
+        await asyncio.sleep(random.uniform(0, interval))
+        while True:
+            await self.link.send({"type": "heartbeat"})
+            await asyncio.sleep(interval)
+
+
+class Dashboard:
+    def __init__(self, token, device_ids, binary):
+        self.token = token
+        self.device_ids = device_ids
+        self.link = Link(binary)
+        # command id -> (device_id, relay key, wanted state)
+        self.pending = {}
+        self.known = {device_id: [False] * RELAYS for device_id in device_ids}
+
+    async def connect(self, ws_url, stats):
+        start = time.perf_counter()
+        try:
+            await self.link.open(f"{ws_url}/user?token={self.token}")
+            await self.link.send({"type": "subscribe", "device_ids": self.device_ids})
+        except Exception:
+            stats.connect_errors += 1
+            return False
+        stats.dashboard_connect_ms.append((time.perf_counter() - start) * 1000)
+        return True
+
+    async def serve(self, stats, stop):
+        try:
+            while not stop.is_set():
+                message = await self.link.recv()
+                if message.get("type") == "ping":
+                    await self.link.send({"type": "pong"})
+                    continue
+                if message.get("type") != "update":
+                    continue
+                device_id, data = message.get("device_id"), message.get("data") or {}
+                for cid, (pending_device, key, wanted) in list(self.pending.items()):
+                    if pending_device == device_id and (data.get(key) or {}).get("state") == wanted:
+                        del self.pending[cid]
+                        stats.rtt_ms.append((time.monotonic() - stats.sent_at.pop(cid)) * 1000)
+        except websockets.ConnectionClosed:
+            if not stop.is_set():
+                stats.disconnects += 1
+
+    async def command(self, stats):
+        device_id = random.choice(self.device_ids)
+        index = random.randrange(RELAYS)
+        wanted = not self.known[device_id][index]
+        self.known[device_id][index] = wanted
+        cid = uuid.uuid4().hex[:12]
+        key = f"relay{index + 1}"
+        self.pending[cid] = (device_id, key, wanted)
+        stats.sent_at[cid] = time.monotonic()
+        stats.commands_sent += 1
+        await self.link.send({"type": "command", "id": cid, "device_id": device_id, "data": {key: {"state": wanted}}})
+
+
+async def register(client, base_url, devices, devices_per_user, concurrency, binary):
+    """Create users and their devices; returns (virtual devices, [(token, device_ids)])."""
+    limit = asyncio.Semaphore(concurrency)
+    run_id = get_random_string(4).upper()
+
+    async def one_user(u, count):
+        async with limit:
+            email = f"fleet-{run_id.lower()}-{u}@example.com"
+            await client.post(f"{base_url}/users/", json={"email": email, "password": "password123"})
+            r = await client.post(f"{base_url}/login/access-token", data={"username": email, "password": "password123"})
+            r.raise_for_status()
+            token = r.json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            fleet = []
+            for d in range(count):
+                device_id = f"SIM-{run_id}-{u}-{d}"
+                r = await client.post(f"{base_url}/devices/", headers=headers, json={"id": device_id, "name": "Virtual ESP32"})
+                r.raise_for_status()
+                fleet.append(VirtualDevice(device_id, r.json()["api_key"], binary))
+            return token, fleet
+
+    users = -(-devices // devices_per_user)
+    counts = [min(devices_per_user, devices - u * devices_per_user) for u in range(users)]
+    results = await asyncio.gather(*(one_user(u, n) for u, n in enumerate(counts)))
+    fleet = [device for _, owned in results for device in owned]
+    owners = [(token, [device.device_id for device in owned]) for token, owned in results]
+    return fleet, owners
+
+
+async def runtime(client, base_url, admin_headers):
+    if admin_headers is None:
+        return None
+    r = await client.get(f"{base_url}/stats/runtime", headers=admin_headers)
+    return r.json() if r.status_code == 200 else None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000/api/v1")
+    parser.add_argument("--ws-url", default="ws://localhost:8000/api/v1/ws")
+    parser.add_argument("--stats-url", default=None, help="API base for /stats (e.g. the realtime gateway); defaults to --base-url")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--dashboards", type=int, default=10)
+    parser.add_argument("--devices-per-user", type=int, default=5)
+    parser.add_argument("--rate", type=float, default=10.0, help="commands per second, whole fleet")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of steady-state load")
+    parser.add_argument("--heartbeat", type=float, default=25.0, help="device heartbeat interval (firmware: 25s)")
+    parser.add_argument("--msgpack", action="store_true", help="use the binary subprotocol")
+    parser.add_argument("--concurrency", type=int, default=50, help="parallel registrations/connects")
+    parser.add_argument("--admin-email", default="admin@homecontrol.com")
+    parser.add_argument("--admin-password", default="Admin123@")
+    args = parser.parse_args()
+
+    stats = Stats()
+    stop = asyncio.Event()
+    stats_url = args.stats_url or args.base_url
+
+    async with httpx.AsyncClient(timeout=60) as client:
+        r = await client.post(f"{args.base_url}/login/access-token",
+                              data={"username": args.admin_email, "password": args.admin_password})
+        admin_headers = {"Authorization": f"Bearer {r.json()['access_token']}"} if r.status_code == 200 else None
+        if admin_headers is None:
+            print("⚠️  Admin login failed — server memory / DB query numbers will be skipped")
+
+        print(f"📝 Registering {args.devices} devices...")
+        t0 = time.perf_counter()
+        fleet, owners = await register(client, args.base_url, args.devices, args.devices_per_user,
+                                       args.concurrency, args.msgpack)
+        print(f"   done in {time.perf_counter() - t0:.1f}s")
+
+        # Dashboards go round-robin over the users
+        dashboards = [
+            Dashboard(*owners[i % len(owners)], args.msgpack) for i in range(min(args.dashboards, len(owners)))
+        ]
+
+        before = await runtime(client, stats_url, admin_headers)
+        print(f"🔌 Connecting {len(fleet)} devices and {len(dashboards)} dashboards...")
+        limit = asyncio.Semaphore(args.concurrency)
+
+        async def device(d):
+            async with limit:  # only the handshake is rate-limited
+                if not await d.connect(args.ws_url, stats):
+                    return
+            await d.serve(stats, args.heartbeat, stop)
+
+        async def dashboard(b):
+            async with limit:
+                if not await b.connect(args.ws_url, stats):
+                    return
+            await b.serve(stats, stop)
+
+        tasks = [asyncio.create_task(device(d)) for d in fleet]
+        tasks += [asyncio.create_task(dashboard(b)) for b in dashboards]
+        while len(stats.device_connect_ms) + len(stats.dashboard_connect_ms) + stats.connect_errors < len(tasks):
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(1)  # let the dashboards' subscribe land
+        connected = await runtime(client, stats_url, admin_headers)
+
+        print(f"⚡ Sending {args.rate} commands/s for {args.duration}s...")
+        interval = 1 / args.rate
+        deadline = time.monotonic() + args.duration
+        while time.monotonic() < deadline:
+            dashboard = random.choice(dashboards)
+            if dashboard.link.ws is not None:
+                try:
+                    await dashboard.command(stats)
+                except websockets.ConnectionClosed:
+                    pass
+            await asyncio.sleep(interval)
+        await asyncio.sleep(2)  # drain in-flight acks
+        after = await runtime(client, stats_url, admin_headers)
+        server_latency = None
+        if admin_headers is not None:
+            r = await client.get(f"{stats_url}/stats/latency", headers=admin_headers)
+            server_latency = r.json().get("fleet") if r.status_code == 200 else None
+
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    sockets = len(stats.device_connect_ms) + len(stats.dashboard_connect_ms)
+    print("\n📊 Results")
+    print(f"   sockets connected     : {sockets} ({stats.connect_errors} failed, {stats.disconnects} dropped)")
+    print(f"   device connect        : {percentiles(stats.device_connect_ms)}")
+    print(f"   dashboard connect     : {percentiles(stats.dashboard_connect_ms)}")
+    print(f"   commands sent         : {stats.commands_sent}")
+    print(f"   delivery (dash->dev)  : {percentiles(stats.delivery_ms)}")
+    print(f"   round trip            : {percentiles(stats.rtt_ms)}")
+    print(f"   unconfirmed commands  : {len(stats.sent_at)}")
+    if before and connected and sockets:
+        per_socket = (connected["rss_bytes"] - before["rss_bytes"]) / sockets
+        print(f"   server RSS            : {connected['rss_bytes'] / 2**20:.1f} MiB, ~{per_socket / 1024:.1f} KiB per connection")
+    if connected and after:
+        queries = after["db"]["queries"] - connected["db"]["queries"]
+        per_command = queries / stats.commands_sent if stats.commands_sent else 0
+        print(f"   DB statements (load)  : {queries} ({per_command:.2f} per command), pool: {after['db']['pool']}")
+    if server_latency:
+        print(f"   server-side ack p50/p95/p99: {server_latency['p50_ms']}/{server_latency['p95_ms']}/{server_latency['p99_ms']} ms,"
+              f" timeouts={server_latency['timeouts']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from api.api_v1.endpoints import devices as endpoint
+from core.rate_limit import RateLimiter
+from core.state_store import state_store
+from db.models import Device, User
+from schemas.device import BulkRelayCommand
+
+
+@pytest.fixture
+def bulk(monkeypatch, fake_session):
+    published, synced = [], []
+
+    async def sync_relays(db, device_ids):
+        synced.append(sorted(device_ids))
+        return {}
+
+    async def publish_update(device_id, data, **kwargs):
+        published.append((device_id, data))
+
+    monkeypatch.setattr(endpoint, "sync_relays", sync_relays)
+    monkeypatch.setattr(endpoint.manager, "publish_update", publish_update)
+    monkeypatch.setattr(endpoint, "bulk_relay_limiter", RateLimiter("relay_bulk", "4/hour"))
+
+    def run(user, rows, operations, fail_commit=False):
+        db = fake_session(rows, fail_on="commit" if fail_commit else None)
+        command = BulkRelayCommand(operations=[
+            {"device_id": d, "relay_key": r, "state": s} for d, r, s in operations
+        ])
+        return db, asyncio.run(endpoint.bulk_relay_command(command, db, user))
+
+    yield run, published, synced
+    for device_id in ("BK-1", "BK-2", "BK-3"):
+        state_store.pop(device_id)
+
+
+def _device(device_id, owner_id, state=None):
+    return Device(id=device_id, owner_id=owner_id, start_state=state or {})
+
+
+def test_partial_results_and_ownership(bulk):
+    run, published, synced = bulk
+    mine, theirs = _device("BK-1", 1, {"relay2": {"state": True, "name": "Fan"}}), _device("BK-2", 2)
+    db, response = run(User(id=1, is_superuser=False), [mine, theirs], [
+        ("BK-1", "relay1", True), ("BK-2", "relay1", True), ("BK-3", "relay1", True), ("BK-1", "relay2", False),
+    ])
+
+    assert [r.status for r in response["results"]] == ["ok", "forbidden", "not_found", "ok"]
+    assert response["applied"] == 2 and db.committed
+    assert mine.start_state == {"relay1": {"state": True}, "relay2": {"state": False, "name": "Fan"}}
+    assert theirs.start_state == {}
+    assert synced == [["BK-1"]]
+    assert published == [("BK-1", {"relay1": {"state": True}, "relay2": {"state": False}})]
+
+
+def test_superuser_may_switch_any_device(bulk):
+    run, _, _ = bulk
+    device = _device("BK-2", 2)
+    _, response = run(User(id=9, is_superuser=True), [device], [("BK-2", "relay3", True)])
+    assert response["applied"] == 1 and device.start_state == {"relay3": {"state": True}}
+
+
+def test_failed_commit_puts_buffered_device_reports_back(bulk):
+    run, published, _ = bulk
+    state_store.merge("BK-1", {"relay4": {"state": True}})
+    device = _device("BK-1", 1)
+
+    with pytest.raises(ConnectionError):
+        run(User(id=1, is_superuser=False), [device], [("BK-1", "relay1", True)], fail_commit=True)
+
+    # The device's own report survives for the next flush; nothing was announced
+    assert state_store.pending("BK-1") == {"relay4": {"state": True}}
+    assert published == []
+
+
+def test_buffered_reports_are_folded_in_once_committed(bulk):
+    run, _, _ = bulk
+    state_store.merge("BK-1", {"relay4": {"state": True}})
+    device = _device("BK-1", 1)
+    run(User(id=1, is_superuser=False), [device], [("BK-1", "relay1", False)])
+    assert device.start_state == {"relay4": {"state": True}, "relay1": {"state": False}}
+    assert state_store.pending("BK-1") is None
+
+
+def test_bulk_budget_is_charged_per_operation(bulk):
+    run, _, _ = bulk
+    user = User(id=1, is_superuser=False)
+    run(user, [_device("BK-1", 1)], [("BK-1", "relay1", True), ("BK-1", "relay2", True)])
+    with pytest.raises(HTTPException) as exc:
+        run(user, [], [("BK-1", "relay1", False), ("BK-1", "relay2", False), ("BK-1", "relay3", False)])
+    assert exc.value.status_code == 429 and "Retry-After" in exc.value.headers
+    run(user, [_device("BK-1", 1)], [("BK-1", "relay1", False), ("BK-1", "relay2", False)])  # the two left
+
+
+def test_devices_are_locked_in_id_order(bulk):
+    run, _, _ = bulk
+    db, _ = run(User(id=1, is_superuser=False), [], [("BK-3", "relay1", True), ("BK-1", "relay1", True)])
+    assert "ORDER BY devices.id" in str(db.statements[0]) and "FOR UPDATE" in str(db.statements[0])
@@ -0,0 +1,30 @@
+import sys
+import os
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core import codec
+
+
+def test_msgpack_round_trip_is_lossless():
+    messages = [
+        {"type": "heartbeat"},
+        {"type": "command", "data": {"relay1": {"state": True}}},
+        {"type": "update", "data": {"relay3": {"state": False, "name": "Kitchen"}, "relay4": {"state": True}}},
+        {"type": "custom", "data": {"relay01": {"state": True}}, "extra": 7},
+    ]
+    for message in messages:
+        assert codec.unpack(codec.pack(message)) == message
+
+
+def test_firmware_frames_decode():
+    # Byte-for-byte what firmware/websocketSync.h sends with ENABLE_MSGPACK_PROTOCOL
+    assert codec.unpack(bytes([0x92, 0x00, 0x90])) == {"type": "heartbeat"}
+    assert codec.pack({"type": "command", "data": {"relay2": {"state": True}}}) == bytes([0x92, 0x02, 0x92, 0x02, 0xC3])
+
+
+def test_negotiation_defaults_to_json():
+    assert codec.negotiate([]) is None
+    assert codec.negotiate(["chat"]) is None
+    assert codec.negotiate(["chat", codec.MSGPACK_SUBPROTOCOL]) == codec.MSGPACK_SUBPROTOCOL
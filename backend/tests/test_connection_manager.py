@@ -0,0 +1,204 @@
+import sys
+import os
+import asyncio
+import json
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core import websocket as ws_module
+from core.websocket import ConnectionManager
+
+
+class FakeWebSocket:
+    """Minimal stand-in for a Starlette WebSocket."""
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        if self.fail:
+            raise ConnectionResetError("peer gone")
+        await asyncio.sleep(self.delay)
+        self.sent.append(json.loads(data))
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+def _quiet(manager, monkeypatch):
+    monkeypatch.setattr(ws_module.notifier, "device_status", lambda *a, **kw: None)
+
+
+def test_slow_viewer_does_not_delay_device(monkeypatch):
+    async def scenario():
+        manager = ConnectionManager(queue_size=2, send_timeout=5.0)
+        _quiet(manager, monkeypatch)
+        device, slow = FakeWebSocket(), FakeWebSocket(delay=10)
+        await manager.connect(device, "SH-001")
+        await manager.connect(slow, "SH-001")
+
+        for i in range(4):
+            await manager.broadcast("SH-001", {"type": "command", "n": i})
+            await asyncio.sleep(0.01)
+
+        assert [m["n"] for m in device.sent] == [0, 1, 2, 3]
+        assert slow not in manager.active_connections["SH-001"]
+        assert manager.evicted_slow == 1
+
+        manager.disconnect(device, "SH-001")
+        assert "SH-001" not in manager.active_connections
+
+    asyncio.run(scenario())
+
+
+def test_dead_socket_is_evicted(monkeypatch):
+    async def scenario():
+        manager = ConnectionManager()
+        _quiet(manager, monkeypatch)
+        alive, dead = FakeWebSocket(), FakeWebSocket(fail=True)
+        await manager.connect(alive, "SH-002")
+        await manager.connect(dead, "SH-002")
+
+        await manager.broadcast("SH-002", {"type": "update"})
+        await asyncio.sleep(0.05)
+
+        assert alive.sent == [{"type": "update"}]
+        assert list(manager.active_connections["SH-002"]) == [alive]
+        assert manager.evicted_dead == 1
+        assert dead.closed_with is not None
+
+        manager.disconnect(alive, "SH-002")
+
+    asyncio.run(scenario())
+
+
+def test_commands_reach_device_and_updates_reach_viewers(monkeypatch):
+    async def scenario():
+        manager = ConnectionManager()
+        _quiet(manager, monkeypatch)
+        device, sender, other = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect(device, "SH-003", is_device=True)
+        await manager.connect(sender, "SH-003")
+        await manager.connect(other, "SH-003")
+
+        command = {"type": "command", "data": {"relay1": {"state": True}}}
+        await manager.send_to_device("SH-003", command)
+        await manager.send_to_viewers("SH-003", {"type": "update", "data": command["data"]}, exclude=sender)
+        await asyncio.sleep(0.05)
+
+        assert device.sent == [command]
+        assert sender.sent == []
+        assert other.sent == [{"type": "update", "data": {"relay1": {"state": True}}}]
+
+        for ws in (device, sender, other):
+            manager.disconnect(ws, "SH-003")
+
+    asyncio.run(scenario())
+
+
+def test_user_socket_multiplexes_subscribed_devices(monkeypatch):
+    async def scenario():
+        manager = ConnectionManager()
+        _quiet(manager, monkeypatch)
+        device, user = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(device, "SH-004", is_device=True)
+        await manager.connect_user(user)
+        manager.subscribe(user, ["SH-004", "SH-005"])
+
+        await manager.publish_update("SH-004", {"relay1": {"state": True}}, devices=False)
+        await manager.publish_update("SH-005", {"relay2": {"state": True}}, devices=False)
+        await manager.send_to_device("SH-004", {"type": "command", "data": {}})
+        manager.unsubscribe(user, ["SH-005"])
+        await manager.publish_update("SH-005", {"relay2": {"state": False}}, devices=False)
+        await asyncio.sleep(0.05)
+
+        assert [(m["device_id"], m["data"]) for m in user.sent] == [
+            ("SH-004", {"relay1": {"state": True}}),
+            ("SH-005", {"relay2": {"state": True}}),
+        ]
+        assert "SH-005" not in manager.subscribers
+
+        manager.disconnect_user(user)
+        assert manager.subscribers == {} and manager.user_connections == {}
+        manager.disconnect(device, "SH-004")
+
+    asyncio.run(scenario())
+
+
+def test_silent_sockets_are_pinged_then_reaped(monkeypatch):
+    async def scenario():
+        manager = ConnectionManager(ping_after=0.05, idle_timeout=0.2)
+        _quiet(manager, monkeypatch)
+        offline = []
+        monkeypatch.setattr(ws_module.presence, "mark_offline", offline.append)
+        device, viewer, chatty = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        device_conn = await manager.connect(device, "SH-006", is_device=True)
+        await manager.connect(viewer, "SH-006")
+        chatty_conn = await manager.connect_user(chatty)
+
+        await asyncio.sleep(0.1)
+        assert manager.reap_idle() == 0
+        await asyncio.sleep(0.01)
+        assert viewer.sent == [{"type": "ping"}] and device.sent == []
+
+        device_conn.touch()
+        await asyncio.sleep(0.15)
+        chatty_conn.touch()  # answered the ping
+        assert manager.reap_idle() == 1
+        assert viewer not in manager.active_connections["SH-006"]
+        assert manager.reaped_viewers == 1 and offline == []
+
+        await asyncio.sleep(0.2)
+        chatty_conn.touch()
+        assert manager.reap_idle() == 1
+        assert "SH-006" not in manager.active_connections
+        assert offline == ["SH-006"] and manager.reaped_devices == 1
+        await asyncio.sleep(0.01)
+        assert device.closed_with == 1001
+
+        manager.disconnect_user(chatty)
+
+    asyncio.run(scenario())
+
+
+def test_reaping_counts_the_frames_still_queued(monkeypatch):
+    async def scenario():
+        manager = ConnectionManager(queue_size=8, idle_timeout=0.05)
+        _quiet(manager, monkeypatch)
+        stuck = FakeWebSocket(delay=10)
+        connection = await manager.connect(stuck, "SH-007")
+        frames = [json.dumps({"n": n}) for n in range(4)]
+        for frame in frames:
+            manager._enqueue(connection, frame)
+        await asyncio.sleep(0.01)  # the writer has taken the first frame and is stuck sending it
+
+        assert connection.queued_bytes == sum(len(frame) for frame in frames[1:])
+        await asyncio.sleep(0.05)
+        assert manager.reap_idle() == 1
+        assert manager.reclaimed_bytes == sum(len(frame) for frame in frames[1:])
+
+    asyncio.run(scenario())
+
+
+def test_postgres_backplane_ignores_own_notifications():
+    from core import codec
+    from core.backplane import PostgresBackplane
+
+    backplane = PostgresBackplane("postgresql://unused")
+    delivered = []
+    backplane._deliver = lambda *args: delivered.append(args)
+
+    message = {"type": "update", "data": {"relay1": {"state": False}}}
+    own = codec.dumps({"o": backplane.origin, "d": "SH-004", "m": message, "dv": True, "vw": True})
+    remote = codec.dumps({"o": "another-worker", "d": "SH-004", "m": message, "dv": False, "vw": True})
+    backplane._on_notify(None, 0, PostgresBackplane.CHANNEL, own)
+    backplane._on_notify(None, 0, PostgresBackplane.CHANNEL, remote)
+
+    assert delivered == [("SH-004", message, False, True)]
@@ -0,0 +1,70 @@
+import sys
+import os
+import asyncio
+from types import SimpleNamespace
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core.device_cache import DeviceCache
+
+
+def _cache_with_rows(monkeypatch, rows, **kwargs):
+    """DeviceCache whose DB loader serves `rows` and counts round trips."""
+    cache = DeviceCache(**kwargs)
+    loads = []
+
+    async def fake_load(condition, db):
+        loads.append(condition)
+        column, value = condition.left.key, condition.right.value
+        return next((row for row in rows if getattr(row, column) == value), None)
+
+    monkeypatch.setattr(cache, "_load", fake_load)
+    return cache, loads
+
+
+def test_lookups_hit_the_db_once(monkeypatch):
+    row = SimpleNamespace(id="SH-001", owner_id=7, api_key="key-1")
+    cache, loads = _cache_with_rows(monkeypatch, [row])
+
+    async def scenario():
+        first = await cache.by_api_key("key-1")
+        again = await cache.by_api_key("key-1")
+        by_id = await cache.by_id("SH-001")  # primed by the api_key lookup
+        return first, again, by_id
+
+    first, again, by_id = asyncio.run(scenario())
+    assert first == again == by_id and first.owner_id == 7
+    assert len(loads) == 1 and cache.hits == 2
+
+
+def test_invalidate_drops_both_mappings(monkeypatch):
+    row = SimpleNamespace(id="SH-002", owner_id=1, api_key="old")
+    cache, loads = _cache_with_rows(monkeypatch, [row])
+
+    async def scenario():
+        await cache.by_id("SH-002")
+        row.api_key = "new"  # e.g. force-register re-keys the device
+        cache.invalidate(device_id="SH-002", api_key="old")
+        return await cache.by_api_key("old"), await cache.by_api_key("new")
+
+    stale, fresh = asyncio.run(scenario())
+    assert stale is None and fresh.api_key == "new"
+    assert len(loads) == 3
+
+
+def test_entries_expire_and_size_is_bounded(monkeypatch):
+    rows = [SimpleNamespace(id=f"SH-{i}", owner_id=1, api_key=f"k{i}") for i in range(3)]
+    cache, loads = _cache_with_rows(monkeypatch, rows, ttl=60, max_size=2)
+
+    async def scenario():
+        for row in rows:
+            await cache.by_id(row.id)
+        assert len(cache) == 2
+        await cache.by_id("SH-0")  # evicted (least recently used) -> reloaded
+        cache.ttl = -1
+        cache.put(rows[1])
+        await cache.by_id("SH-1")  # already expired -> reloaded
+
+    asyncio.run(scenario())
+    assert len(loads) == 5
@@ -0,0 +1,41 @@
+import sys
+import os
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core.latency import CommandTracker
+
+
+def test_explicit_and_implicit_acks_record_latency():
+    tracker = CommandTracker(timeout=10)
+    cid = tracker.start("SH-001", {"relay1": {"state": True}})
+    tracker.start("SH-001", {"relay2": {"state": True}})
+
+    assert tracker.ack("SH-001", {"relay1": {"state": False}}, cid) == 1
+    # No id: resolved once the reported state matches the command
+    assert tracker.ack("SH-001", {"relay2": {"state": False}}) == 0
+    assert tracker.ack("SH-001", {"relay1": {"state": False}, "relay2": {"state": True}}) == 1
+
+    summary = tracker.summary("SH-001")
+    assert summary["count"] == 2 and summary["pending"] == 0
+    assert summary["p50_ms"] is not None
+    assert sum(summary["histogram"].values()) == 2
+
+
+def test_unacknowledged_commands_time_out():
+    tracker = CommandTracker(timeout=0)
+    tracker.start("SH-002", {"relay1": {"state": True}})
+
+    assert tracker.expire() == 1
+    assert tracker.summary("SH-002")["timeouts"] == 1
+    assert tracker.summary()["timeouts"] == 1
+    assert tracker.ack("SH-002", {"relay1": {"state": True}}) == 0
+
+
+def test_slowest_devices_ranked_by_p95():
+    tracker = CommandTracker()
+    tracker._series_for("fast").add(5)
+    tracker._series_for("slow").add(800)
+
+    assert [entry["device_id"] for entry in tracker.slowest()] == ["slow", "fast"]
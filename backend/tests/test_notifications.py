@@ -0,0 +1,61 @@
+import sys
+import os
+import asyncio
+
+import httpx
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from services.notifications import NotificationDispatcher
+
+
+def _dispatcher(received):
+    # Local stand-in for ntfy.sh: records every POST it receives
+    def handler(request: httpx.Request) -> httpx.Response:
+        received.append((request.url.path, request.content.decode(), request.headers.get("Priority")))
+        return httpx.Response(200)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return NotificationDispatcher("http://ntfy.local", "test_topic", coalesce_window=0.05, client=client)
+
+
+def test_reconnect_storm_sends_one_alert():
+    async def scenario():
+        received = []
+        dispatcher = _dispatcher(received)
+        worker = asyncio.create_task(dispatcher.run())
+
+        for _ in range(100):
+            dispatcher.device_status("SH-001", online=False)
+            dispatcher.device_status("SH-001", online=True)
+        dispatcher.device_status("SH-001", online=False)
+        await asyncio.sleep(0.2)
+
+        worker.cancel()
+        await dispatcher.close()
+        return received, dispatcher
+
+    received, dispatcher = asyncio.run(scenario())
+    assert received == [("/test_topic", "Device SH-001 is Offline 🔴", "high")]
+    assert dispatcher.coalesced == 200
+
+
+def test_flap_back_to_reported_state_is_silent():
+    async def scenario():
+        received = []
+        dispatcher = _dispatcher(received)
+        worker = asyncio.create_task(dispatcher.run())
+
+        dispatcher.device_status("SH-002", online=True)
+        await asyncio.sleep(0.1)
+        dispatcher.device_status("SH-002", online=False)
+        dispatcher.device_status("SH-002", online=True)
+        await asyncio.sleep(0.1)
+
+        worker.cancel()
+        await dispatcher.close()
+        return received
+
+    received = asyncio.run(scenario())
+    assert received == [("/test_topic", "Device SH-002 is Online 🟢", None)]
@@ -0,0 +1,50 @@
+import sys
+import os
+
+import pytest
+from fastapi import HTTPException, Response
+from sqlalchemy import select
+from starlette.requests import Request
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core.pagination import decode_cursor, encode_cursor, finish_page, keyset_page
+from db.models import Device, User
+
+
+def _request():
+    return Request({
+        "type": "http", "method": "GET", "path": "/api/v1/users/", "headers": [],
+        "query_string": b"limit=2&skip=4", "server": ("testserver", 80), "scheme": "http",
+    })
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    assert decode_cursor(encode_cursor("SH-001")) == "SH-001"
+    assert decode_cursor(encode_cursor(42)) == 42
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor("not a cursor!")
+    assert exc.value.status_code == 400
+
+
+def test_keyset_page_filters_after_cursor_and_checks_type():
+    sql = str(keyset_page(select(Device), Device.id, encode_cursor("SH-010"), 50))
+    assert "devices.id > " in sql and "ORDER BY devices.id" in sql and "LIMIT" in sql
+    with pytest.raises(HTTPException):
+        keyset_page(select(User), User.id, encode_cursor("SH-010"), 50)
+
+
+def test_finish_page_trims_lookahead_and_links_next():
+    response = Response()
+    rows = finish_page([1, 2, 3], 2, lambda row: row, _request(), response)
+
+    assert rows == [1, 2]
+    assert decode_cursor(response.headers["X-Next-Cursor"]) == 2
+    link = response.headers["Link"]
+    assert "skip=" not in link and f"cursor={response.headers['X-Next-Cursor']}" in link
+    assert link.endswith('rel="next"')
+
+    last = Response()
+    assert finish_page([1], 2, lambda row: row, _request(), last) == [1]
+    assert "X-Next-Cursor" not in last.headers
@@ -0,0 +1,136 @@
+import sys
+import os
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core import lifecycle
+from core import presence as presence_module
+from core.presence import OFFLINE_AFTER, PresenceTable
+
+
+def test_touch_marks_dirty_and_online():
+    table = PresenceTable()
+    table.touch("SH-001", ip_address="192.168.1.10")
+    table.touch("SH-001")  # repeated heartbeats coalesce into one dirty row
+
+    entry = table.get("SH-001")
+    assert entry.online
+    assert entry.ip_address == "192.168.1.10"
+    assert table._dirty == {"SH-001"}
+
+
+def test_expire_only_marks_stale_devices():
+    table = PresenceTable()
+    table.touch("SH-001")
+    table.touch("SH-002")
+    table.get("SH-001").last_seen = datetime.utcnow() - timedelta(minutes=10)
+
+    expired = table.expire(datetime.utcnow() - timedelta(minutes=5))
+
+    assert expired == ["SH-001"]
+    assert not table.get("SH-001").online
+    assert table.is_fresh("SH-002", datetime.utcnow() - timedelta(minutes=5))
+
+
+def test_expiry_loop_marks_silent_devices_offline():
+    table = PresenceTable()
+    table.touch("SH-003")
+    table.get("SH-003").last_seen = datetime.utcnow() - OFFLINE_AFTER - timedelta(seconds=1)
+
+    async def scenario():
+        task = asyncio.create_task(table.run_expiry(interval=0.01))
+        await asyncio.sleep(0.02)
+        task.cancel()
+
+    asyncio.run(scenario())
+    assert not table.get("SH-003").online
+
+
+def test_realtime_services_run_presence_expiry(monkeypatch):
+    # realtime.py only calls start_realtime_services, so expiry must start there
+    started = []
+
+    def loop(name):
+        async def run(*args, **kwargs):
+            started.append(name)
+        return run
+
+    monkeypatch.setattr(lifecycle.presence, "run", loop("flush"))
+    monkeypatch.setattr(lifecycle.presence, "run_expiry", loop("expiry"))
+    for service in (lifecycle.state_store, lifecycle.relay_events, lifecycle.notifier, lifecycle.command_tracker):
+        monkeypatch.setattr(service, "run", loop("other"))
+    monkeypatch.setattr(lifecycle.manager, "run_reaper", loop("reaper"))
+    monkeypatch.setattr(lifecycle.manager, "start", loop("backplane"))
+
+    async def scenario():
+        await lifecycle.start_realtime_services()
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert "expiry" in started
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL (Postgres)")
+def test_flush_never_overwrites_a_newer_heartbeat_from_another_process(monkeypatch):
+    from sqlalchemy import select
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from db.models import Device, User
+
+    events = []
+    monkeypatch.setattr(presence_module.relay_events, "record",
+                        lambda device_id, transitions, source: events.append(transitions))
+
+    async def scenario():
+        engine = create_async_engine(os.environ["TEST_DATABASE_URL"])
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        monkeypatch.setattr(presence_module, "SessionLocal", sessions)
+        device_id = f"PR-{uuid.uuid4().hex[:8]}"
+        async with sessions() as db:
+            owner = await db.scalar(select(User.id).limit(1))
+            db.add(Device(id=device_id, owner_id=owner, api_key=device_id,
+                          last_seen=datetime.utcnow() - timedelta(hours=1)))
+            await db.commit()
+
+        async def stored():
+            async with sessions() as db:
+                return (await db.execute(
+                    select(Device.online, Device.last_seen).where(Device.id == device_id)
+                )).one()
+
+        rest, gateway = PresenceTable(), PresenceTable()
+        try:
+            rest.touch(device_id)
+            await asyncio.sleep(0.01)
+            gateway.touch(device_id)                # the device moved to the gateway
+            assert await gateway.flush() == 1
+            events.clear()
+
+            rest.mark_offline(device_id)            # the REST app stops hearing from it
+            assert await rest.flush() == 0
+            online, last_seen = await stored()
+            assert online and last_seen.replace(tzinfo=None) == gateway.get(device_id).last_seen
+            assert rest.get(device_id) is None and events == []
+
+            gateway.expire(datetime.utcnow())
+            assert await gateway.flush() == 1
+            assert not (await stored()).online
+            assert events == [{"_online": False}]
+        finally:
+            async with sessions() as db:
+                await db.delete(await db.get(Device, device_id))
+                await db.commit()
+            await engine.dispose()
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    test_touch_marks_dirty_and_online()
+    test_expire_only_marks_stale_devices()
+    print("✅ Presence table checks passed!")
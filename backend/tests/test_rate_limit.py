@@ -0,0 +1,111 @@
+import sys
+import os
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core import rate_limit
+from core.rate_limit import MemoryBuckets, RateLimiter, client_ip, parse_rate
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_parse_rate():
+    assert parse_rate("10/minute") == (10 / 60, 10)
+    assert parse_rate("20/second") == (20, 20)
+
+
+def test_burst_then_limited_until_refill(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock.monotonic)
+    limiter = RateLimiter("login", "3/minute")
+
+    async def scenario():
+        assert [await limiter.check("ip:1.2.3.4") for _ in range(3)] == [0, 0, 0]
+        wait = await limiter.check("ip:1.2.3.4")
+        assert wait == pytest.approx(20)                    # one token per 20s
+        assert await limiter.check("ip:5.6.7.8") == 0       # other keys have their own bucket
+        clock.now += 20
+        assert await limiter.check("ip:1.2.3.4") == 0
+
+    asyncio.run(scenario())
+    assert limiter.summary() == {"allowed": 5, "limited": 1}
+
+
+def test_cost_takes_several_tokens_at_once(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock.monotonic)
+    limiter = RateLimiter("relay_bulk", "10/minute")
+
+    async def scenario():
+        assert await limiter.check("user:1", cost=7) == 0
+        assert await limiter.check("user:1", cost=4) == pytest.approx(6)   # 1 short, 6s per token
+        assert await limiter.check("user:1", cost=3) == 0
+
+    asyncio.run(scenario())
+
+
+def test_enforce_raises_429_with_retry_after():
+    limiter = RateLimiter("relay", "1/hour")
+
+    async def scenario():
+        await limiter.enforce("user:1")
+        with pytest.raises(HTTPException) as exc:
+            await limiter.enforce("user:1")
+        return exc.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) > 3500
+
+
+def test_memory_store_is_bounded():
+    store = MemoryBuckets(max_keys=2)
+
+    async def scenario():
+        for key in ("a", "b", "c"):
+            await store.take(key, 1, 1)
+
+    asyncio.run(scenario())
+    assert list(store._buckets) == ["b", "c"]
+
+
+def _request(peer, forwarded=None):
+    from starlette.requests import Request
+
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "client": (peer, 40000), "headers": headers})
+
+
+def test_client_ip_reads_forwarded_for_only_from_trusted_proxies():
+    proxies = "10.0.0.0/8,127.0.0.1"
+    assert client_ip(_request("10.0.0.2", "203.0.113.7"), proxies) == "203.0.113.7"
+    # The client's own (spoofed) entry comes first; the proxy appends the real peer
+    assert client_ip(_request("10.0.0.2", "1.1.1.1, 198.51.100.4, 10.0.0.9"), proxies) == "198.51.100.4"
+    assert client_ip(_request("198.51.100.4", "1.1.1.1"), proxies) == "198.51.100.4"
+    assert client_ip(_request("10.0.0.2"), proxies) == "10.0.0.2"
+    assert client_ip(_request("192.0.2.1", "203.0.113.7"), "*") == "203.0.113.7"
+
+
+def test_forwarded_clients_behind_one_proxy_get_separate_buckets():
+    limiter = RateLimiter("login", "2/minute")
+    attacker = client_ip(_request("10.0.0.2", "203.0.113.7"), "10.0.0.0/8")
+    user = client_ip(_request("10.0.0.2", "198.51.100.4"), "10.0.0.0/8")
+
+    async def scenario():
+        for _ in range(5):
+            await limiter.check(f"ip:{attacker}")
+        return await limiter.check(f"ip:{user}")
+
+    assert asyncio.run(scenario()) == 0
+    assert limiter.summary() == {"allowed": 3, "limited": 3}
@@ -0,0 +1,53 @@
+import sys
+import os
+import asyncio
+from datetime import date
+
+import pytest
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core.relay_events import RelayEventWriter, _month, partition_name
+from services.usage_rollups import daily_series
+
+
+def test_monthly_partitions_roll_over_the_year():
+    assert _month(date(2026, 12, 17), 1) == date(2027, 1, 1)
+    assert _month(date(2026, 1, 5), -1) == date(2025, 12, 1)
+    assert partition_name(date(2026, 3, 1)) == "relay_events_2026_03"
+
+
+def test_flush_copies_one_batch_and_keeps_it_on_failure(monkeypatch):
+    writer = RelayEventWriter(max_batch=2, max_buffer=3)
+    copied = []
+
+    async def failing(batch):
+        raise ConnectionError("db down")
+
+    async def scenario():
+        writer.record("SH-001", {"relay1": True, "relay2": False}, "api")
+        assert writer._wakeup.is_set()                       # a full batch wakes the writer
+
+        monkeypatch.setattr(writer, "_copy", failing)
+        with pytest.raises(ConnectionError):
+            await writer.flush()
+        writer.record("SH-002", {"relay1": True, "relay3": True}, "device")   # one over max_buffer
+
+        monkeypatch.setattr(writer, "_copy", lambda batch: asyncio.sleep(0, copied.extend(batch)))
+        return await writer.flush()
+
+    assert asyncio.run(scenario()) == 3
+    assert [(e[1], e[2]) for e in copied] == [("SH-001", "relay2"), ("SH-002", "relay1"), ("SH-002", "relay3")]
+    assert writer.summary() == {"buffered": 0, "written": 3, "dropped": 1}
+
+
+def test_daily_series_is_dense_and_aligned_to_the_window():
+    rows = [
+        ("SH-1", "relay1", [1, 3], [3, 1], [1800.4, 60.0]),
+        ("SH-2", "relay2", [-2], [9], [100.0]),  # before the window
+    ]
+    assert daily_series(4, rows) == {
+        ("SH-1", "relay1"): {"toggles": [0, 3, 0, 1], "on_seconds": [0, 1800, 0, 60]},
+        ("SH-2", "relay2"): {"toggles": [0, 0, 0, 0], "on_seconds": [0, 0, 0, 0]},
+    }
@@ -0,0 +1,138 @@
+import os
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select, update
+from sqlalchemy.dialects import postgresql
+
+from api.api_v1.endpoints import devices as endpoint
+from api.api_v1.endpoints.devices import _relay_auth, _state_expr, _update_relay_state, _write_state
+from core.rate_limit import RateLimiter
+from core.relays import relay_rows, upsert_relays
+from core.state_store import state_store
+from db.models import Device, User
+
+
+def _sql(statement):
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+def test_relay_patch_is_one_update_with_auth_in_where():
+    owner = User(id=7, is_superuser=False)
+    statement = (
+        update(Device)
+        .where(Device.id == "SH-001", _relay_auth(owner, "key-1"))
+        .values(start_state=_state_expr({"relay2": {"state": False}}, {"relay1": True}))
+        .returning(Device.start_state)
+    )
+    sql = _sql(statement)
+
+    assert sql.count("jsonb_set(") == 1 and "||" in sql
+    assert "devices.api_key = " in sql and "devices.owner_id = " in sql
+    assert "RETURNING devices.start_state" in sql
+
+
+def test_relay_auth_clauses():
+    assert _sql(_relay_auth(None, None)) == "false"
+    assert _sql(_relay_auth(User(id=1, is_superuser=True), None)) == "true"
+
+
+def test_relay_rows_upserted_in_the_same_statement():
+    changed = (
+        update(Device)
+        .where(Device.id == "SH-001")
+        .values(start_state=_state_expr(None, {"relay3": True}))
+        .returning(Device.id, Device.start_state)
+        .cte("changed")
+    )
+    sql = _sql(select(changed.c.start_state).add_cte(upsert_relays(relay_rows(changed)).cte("relays")))
+
+    assert sql.startswith("WITH changed AS") and "INSERT INTO device_relays" in sql
+    assert "jsonb_each(" in sql and "FROM changed" in sql
+    assert "ON CONFLICT (device_id, relay_key) DO UPDATE" in sql
+    assert "version = (device_relays.version +" in sql
+    assert "WHERE device_relays.state IS DISTINCT FROM excluded.state" in sql
+
+
+@pytest.fixture
+def pending():
+    state_store.merge("RS-1", {"relay2": {"state": True}})
+    yield
+    state_store.pop("RS-1")
+
+
+@pytest.mark.parametrize("fail_on", ["execute", "commit"])
+def test_failed_write_requeues_the_buffered_device_report(pending, fail_on, fake_session):
+    db = fake_session([({"relay1": {"state": True}}, {"relay1": True})], fail_on=fail_on)
+    with pytest.raises(ConnectionError):
+        asyncio.run(_write_state(db, "RS-1", relays={"relay1": True}))
+    assert state_store.pending("RS-1") == {"relay2": {"state": True}}
+
+
+def test_write_denied_by_the_where_clause_returns_none_and_requeues(pending, fake_session):
+    db = fake_session()  # no row matched
+    stranger = User(id=99, is_superuser=False)
+    state = asyncio.run(_write_state(db, "RS-1", _relay_auth(stranger, None), relays={"relay1": True}))
+    assert state is None and not db.committed
+    assert "devices.owner_id = " in _sql(db.statements[0])
+    assert state_store.pending("RS-1") == {"relay2": {"state": True}}
+
+
+def test_relay_toggle_on_a_device_someone_else_owns(monkeypatch, fake_session):
+    class Identity:
+        id, owner_id, api_key = "RS-1", 1, "device-key"
+
+    async def by_id(device_id, db=None):
+        return Identity if device_id == "RS-1" else None
+
+    monkeypatch.setattr(endpoint.device_cache, "by_id", by_id)
+    monkeypatch.setattr(endpoint, "relay_limiter", RateLimiter("relay", "100/minute"))
+    db = fake_session()
+
+    def toggle(device_id, user=None, api_key=None):
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(_update_relay_state(db, device_id, "relay1", True, user, api_key))
+        return exc.value.status_code
+
+    assert toggle("RS-1", User(id=2, is_superuser=False)) == 401
+    assert toggle("RS-1", api_key="wrong-key") == 401
+    assert toggle("RS-404", User(id=1, is_superuser=False)) == 404
+    assert db.statements == []  # rejected from the cached identity, no UPDATE issued
+    # Cache said yes but the row no longer matches (e.g. re-assigned): 0 rows -> 401
+    assert toggle("RS-1", User(id=1, is_superuser=False)) == 401
+    assert len(db.statements) == 1
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL (Postgres)")
+def test_concurrent_relay_writes_keep_each_others_changes():
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async def scenario():
+        engine = create_async_engine(os.environ["TEST_DATABASE_URL"])
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        device_id = f"RS-{uuid.uuid4().hex[:8]}"
+        async with sessions() as db:
+            owner = await db.scalar(select(User.id).limit(1))
+            db.add(Device(id=device_id, owner_id=owner, api_key=device_id, start_state={}))
+            await db.commit()
+
+        async def toggle(relay_key, state):
+            async with sessions() as db:
+                await _write_state(db, device_id, relays={relay_key: state})
+
+        try:
+            for round in range(10):
+                state = round % 2 == 0
+                await asyncio.gather(*(toggle(f"relay{i}", state) for i in range(1, 5)))
+                async with sessions() as db:
+                    stored = await db.scalar(select(Device.start_state).where(Device.id == device_id))
+                assert stored == {f"relay{i}": {"state": state} for i in range(1, 5)}
+        finally:
+            async with sessions() as db:
+                await db.delete(await db.get(Device, device_id))
+                await db.commit()
+            await engine.dispose()
+
+    asyncio.run(scenario())
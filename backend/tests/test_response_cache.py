@@ -0,0 +1,71 @@
+import sys
+import os
+
+from starlette.requests import Request
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core.response_cache import ResponseCache, weak_etag
+
+
+def _request(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_etag_ignores_last_seen_only():
+    device = {"id": "SH-001", "online": True, "last_seen": "2024-01-01T00:00:00", "start_state": {}}
+    seen_later = {**device, "last_seen": "2024-01-01T00:00:25"}
+    switched = {**device, "start_state": {"relay1": {"state": True}}}
+
+    assert weak_etag([device]) == weak_etag([seen_later])
+    assert weak_etag([device]) != weak_etag([switched])
+    assert weak_etag(device).startswith('W/"')
+
+
+def test_conditional_get_and_invalidation():
+    cache = ResponseCache(ttl=60)
+    entry = cache.put(("list", 1, 0, 100), [{"id": "SH-001", "online": True}], 1, ["SH-001"])
+    cache.put(("device", "SH-002"), {"id": "SH-002"}, 1, ["SH-002"])
+
+    assert cache.get(("list", 1, 0, 100)) is entry
+    assert cache.respond(_request(entry.etag), entry).status_code == 304
+    assert cache.respond(_request(entry.etag[2:]), entry).status_code == 304  # strong form also matches
+    fresh = cache.respond(_request('W/"other"'), entry)
+    assert fresh.status_code == 200 and fresh.headers["etag"] == entry.etag
+
+    cache.invalidate_device("SH-001")
+    assert cache.get(("list", 1, 0, 100)) is None
+    assert cache.get(("device", "SH-002")) is not None
+
+    cache.invalidate_owner(1)
+    assert cache.get(("device", "SH-002")) is None
+    assert cache.summary()["not_modified"] == 2
+
+
+def test_fill_that_raced_a_write_is_not_stored():
+    cache = ResponseCache(ttl=60)
+    generation = cache.generation()           # GET starts reading the DB
+    cache.invalidate_device("SH-001")         # a relay write commits meanwhile
+    entry = cache.put(("device", "SH-001"), {"id": "SH-001"}, 1, ["SH-001"], generation)
+    assert entry.etag and cache.get(("device", "SH-001")) is None
+    cache.put(("device", "SH-002"), {"id": "SH-002"}, 1, ["SH-002"], generation)
+    assert cache.get(("device", "SH-002")) is not None
+
+    generation = cache.generation()
+    cache.invalidate_owner(1)                 # a device was added to the list
+    cache.put(("list", 1, 0, 100), [], 1, [], generation)
+    assert cache.get(("list", 1, 0, 100)) is None
+    assert cache.summary()["stale_fills"] == 2
+
+
+def test_index_sets_shrink_with_evictions():
+    cache = ResponseCache(ttl=60, max_entries=3)
+    for skip in range(50):
+        cache.put(("list", 1, skip, 10), [{"id": "SH-001"}], 1, ["SH-001", f"SH-{skip:03d}x"])
+    assert len(cache._entries) == 3
+    assert len(cache._by_owner[1]) == 3 and len(cache._by_device["SH-001"]) == 3
+    assert len(cache._by_device) == 4
+    cache.invalidate_owner(1)
+    assert not cache._entries and not cache._by_owner and not cache._by_device
@@ -0,0 +1,102 @@
+import sys
+import os
+import asyncio
+from datetime import datetime
+
+import pytest
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core.schedule_wheel import ScheduledAction, ScheduleWheel, minute_of_day
+
+
+def _schedule(id, time, action=True):
+    return ScheduledAction(id, f"SH-{id}", "relay1", action, time)
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_minute_of_day_accepts_only_hh_mm():
+    assert minute_of_day("00:00") == 0
+    assert minute_of_day("23:59") == 1439
+    for bad in ("7:30", "24:00", "12:60", "12-30", "ab:cd", ""):
+        with pytest.raises(ValueError):
+            minute_of_day(bad)
+
+
+def test_next_due_wraps_past_midnight():
+    clock = Clock(datetime(2026, 10, 17, 22, 15, 20))
+    wheel = ScheduleWheel(clock)
+    wheel.load([_schedule(1, "07:00"), _schedule(2, "22:30")])
+    wheel.start(clock.now)
+    assert wheel.next_due() == datetime(2026, 10, 17, 22, 30)
+    assert wheel.due(datetime(2026, 10, 17, 22, 30, 0, 5000)) == [_schedule(2, "22:30")]
+    assert wheel.next_due() == datetime(2026, 10, 18, 7, 0)
+
+
+def test_late_tick_fires_every_passed_slot_once():
+    clock = Clock(datetime(2026, 10, 17, 6, 59, 59))
+    wheel = ScheduleWheel(clock)
+    wheel.load([_schedule(1, "07:00"), _schedule(2, "07:01"), _schedule(3, "07:05")])
+    wheel.start(clock.now)
+    # Event loop stalled for over two minutes
+    assert {s.id for s in wheel.due(datetime(2026, 10, 17, 7, 2, 10))} == {1, 2}
+    assert wheel.due(datetime(2026, 10, 17, 7, 2, 30)) == []
+    assert [s.id for s in wheel.due(datetime(2026, 10, 17, 7, 5))] == [3]
+
+
+def test_schedule_added_for_a_passed_minute_waits_for_tomorrow():
+    clock = Clock(datetime(2026, 10, 17, 6, 0))
+    wheel = ScheduleWheel(clock)
+    wheel.load([_schedule(1, "09:00")])
+    wheel.start(clock.now)
+    clock.now = datetime(2026, 10, 17, 8, 30)
+    wheel.add(_schedule(2, "08:00"))
+    assert wheel.due(clock.now) == []
+    assert wheel.next_due() == datetime(2026, 10, 17, 9, 0)
+    wheel.remove(1)
+    assert wheel.next_due() == datetime(2026, 10, 18, 8, 0)
+
+
+def test_reconcile_reports_drift_and_keeps_changes_made_meanwhile():
+    wheel = ScheduleWheel(Clock(datetime(2026, 10, 17, 12, 0)))
+    assert wheel.load([_schedule(1, "07:00"), _schedule(2, "08:00")]) == 2
+    wheel.begin_reconcile()
+    wheel.add(_schedule(3, "09:00"))  # committed after the reconcile query read the table
+    drift = wheel.load([_schedule(1, "07:00"), _schedule(2, "08:00", action=False)])
+    assert drift == 1
+    assert 3 in wheel and len(wheel) == 3
+    assert wheel.load([_schedule(2, "08:00", action=False)]) == 2
+    assert len(wheel) == 1
+
+
+def test_run_wakes_at_the_due_time_and_on_changes():
+    async def scenario():
+        clock = Clock(datetime(2026, 10, 17, 7, 0, 59, 900000))
+        wheel = ScheduleWheel(clock)
+        wheel.load([_schedule(1, "07:01")])
+        fired = []
+
+        async def execute(actions):
+            fired.extend(s.id for s in actions)
+
+        task = asyncio.create_task(wheel.run(execute))
+        await asyncio.sleep(0)
+        assert fired == []
+        clock.now = datetime(2026, 10, 17, 7, 1)
+        await asyncio.sleep(0.15)  # the 0.1s timeout elapses
+        assert fired == [1]
+        wheel.add(_schedule(2, "07:02"))
+        clock.now = datetime(2026, 10, 17, 7, 2)
+        await asyncio.sleep(0.01)
+        task.cancel()
+        assert fired == [1, 2]
+
+    asyncio.run(scenario())
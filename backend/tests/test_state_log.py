@@ -0,0 +1,32 @@
+import sys
+import os
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core.state_log import StateLog
+
+
+def test_sequence_is_monotonic_and_resume_returns_missed_deltas():
+    log = StateLog(size=8)
+    first = log.record("SH-001", {"relay1": {"state": True}})
+    second = log.record("SH-001", {"relay2": {"state": True}})
+    third = log.record("SH-001", {"relay1": {"state": False}})
+
+    assert first < second < third
+    assert log.since("SH-001", first) == [
+        (second, {"relay2": {"state": True}}),
+        (third, {"relay1": {"state": False}}),
+    ]
+    assert log.since("SH-001", third) == []
+
+
+def test_falling_behind_or_unknown_seq_needs_snapshot():
+    log = StateLog(size=2)
+    start = log.head("SH-002")
+    seqs = [log.record("SH-002", {"relay1": {"state": i % 2 == 0}}) for i in range(3)]
+
+    assert log.since("SH-002", start) is None         # oldest missed delta evicted
+    assert log.since("SH-002", seqs[0]) is not None   # still fully buffered
+    assert log.since("SH-002", seqs[-1] + 1) is None  # from the future / another epoch
+    assert log.since("SH-003", 0) is None             # never seen
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from core import state_store as module
+from core.state_store import StateStore
+from db.models import Device
+
+
+@pytest.fixture
+def events(monkeypatch):
+    recorded = []
+
+    async def sync_relays(db, device_ids):
+        return {device_id: {"relay1": True} for device_id in device_ids}
+
+    monkeypatch.setattr(module, "sync_relays", sync_relays)
+    monkeypatch.setattr(module.relay_events, "record", lambda *args: recorded.append(args))
+    return recorded
+
+
+def test_merge_keeps_the_latest_report_per_relay():
+    store = StateStore()
+    store.merge("SH-1", {"relay1": {"state": True}, "relay2": {"state": True}})
+    store.merge("SH-1", {"relay1": {"state": False}})
+    store.merge("SH-1", {})
+    assert store.pending("SH-1") == {"relay1": {"state": False}, "relay2": {"state": True}}
+
+    device = Device(id="SH-1", start_state={"relay1": {"state": True, "name": "Lamp"}, "relay3": {"state": True}})
+    store.apply(device)
+    assert device.start_state == {
+        "relay1": {"state": False}, "relay2": {"state": True}, "relay3": {"state": True},
+    }
+
+
+def test_pop_then_failed_write_requeues_under_newer_reports():
+    store = StateStore()
+    store.merge("SH-1", {"relay1": {"state": True}, "relay2": {"state": True}})
+    delta = store.pop("SH-1")
+    assert store.pending("SH-1") is None
+    # A report arrives while the writer's transaction is in flight, then it rolls back
+    store.merge("SH-1", {"relay2": {"state": False}})
+    store.requeue("SH-1", delta)
+    assert store.pending("SH-1") == {"relay1": {"state": True}, "relay2": {"state": False}}
+    store.requeue("SH-2", None)
+    assert store.pending("SH-2") is None
+
+
+def test_flush_writes_every_pending_device_in_one_transaction(monkeypatch, events, fake_session):
+    device = Device(id="SH-1", start_state={"relay1": {"state": False, "name": "Lamp"}})
+    session = fake_session([device])
+    monkeypatch.setattr(module, "SessionLocal", lambda: session)
+    store = StateStore()
+    store.merge("SH-1", {"relay1": {"state": True}})
+
+    assert asyncio.run(store.flush()) == 1
+    assert device.start_state == {"relay1": {"state": True}}
+    assert store.pending("SH-1") is None
+    assert events == [("SH-1", {"relay1": True}, "device")]
+    # Rows are locked in id order, so a flush and a bulk relay call can't deadlock
+    assert "ORDER BY devices.id" in str(session.statements[0])
+
+
+def test_flush_failure_requeues_the_batch(monkeypatch, events, fake_session):
+    device = Device(id="SH-1", start_state={})
+    monkeypatch.setattr(module, "SessionLocal", lambda: fake_session([device], fail_on="commit"))
+    store = StateStore()
+    store.merge("SH-1", {"relay1": {"state": True}})
+
+    async def scenario():
+        flushing = asyncio.ensure_future(store.flush())
+        await asyncio.sleep(0)
+        store.merge("SH-1", {"relay1": {"state": False}})  # newer report during the failed flush
+        with pytest.raises(ConnectionError):
+            await flushing
+
+    asyncio.run(scenario())
+    assert store.pending("SH-1") == {"relay1": {"state": False}}
+    assert events == []
@@ -0,0 +1,112 @@
+import sys
+import os
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, text
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core.relay_events import late_hours
+from db.models import Device, RelayUsageDaily, RelayUsageHourly, User
+from services.usage_rollups import _reroll, _roll_up
+
+DAY = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+
+def at(hour, minute=0):
+    return DAY + timedelta(hours=hour, minutes=minute)
+
+
+def test_late_hours_are_those_past_the_grace_period():
+    now = at(11) + timedelta(seconds=20)
+    stamps = [at(9, 5), at(9, 55), at(10, 59), at(11, 0)]
+    assert late_hours(stamps, now, grace=30) == {at(9)}
+    assert late_hours(stamps, now, grace=10) == {at(9), at(10)}
+    assert late_hours([], now, grace=30) == set()
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_DATABASE_URL"), reason="needs TEST_DATABASE_URL (Postgres)")
+def test_rollup_math_and_late_event_reroll():
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    async def scenario():
+        engine = create_async_engine(os.environ["TEST_DATABASE_URL"])
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        device_id = f"RU-{uuid.uuid4().hex[:8]}"
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "CREATE TABLE relay_events_2001_01 PARTITION OF relay_events "
+                "FOR VALUES FROM ('2001-01-01 00:00+00') TO ('2001-02-01 00:00+00')"
+            ))
+        async with sessions() as db:
+            owner = await db.scalar(select(User.id).limit(1))
+            db.add(Device(id=device_id, owner_id=owner, api_key=device_id, start_state={}))
+            await db.commit()
+
+        async def add_events(*events):
+            async with engine.begin() as conn:
+                for ts, relay_key, state in events:
+                    await conn.execute(text(
+                        "INSERT INTO relay_events (ts, device_id, relay_key, state, source) "
+                        "VALUES (:ts, :device_id, :relay_key, :state, 'test')"
+                    ), {"ts": ts, "device_id": device_id, "relay_key": relay_key, "state": state})
+
+        async def hourly():
+            async with sessions() as db:
+                rows = await db.execute(select(
+                    RelayUsageHourly.hour, RelayUsageHourly.relay_key, RelayUsageHourly.toggles,
+                    RelayUsageHourly.on_seconds, RelayUsageHourly.end_state,
+                ).where(RelayUsageHourly.device_id == device_id))
+                return {(r.hour.hour, r.relay_key): (r.toggles, round(r.on_seconds), r.end_state) for r in rows}
+
+        async def daily():
+            async with sessions() as db:
+                rows = await db.execute(select(
+                    RelayUsageDaily.relay_key, RelayUsageDaily.toggles, RelayUsageDaily.on_seconds,
+                ).where(RelayUsageDaily.device_id == device_id))
+                return {r.relay_key: (r.toggles, round(r.on_seconds)) for r in rows}
+
+        try:
+            await add_events(
+                (at(9, 30), "relay1", True), (at(10, 15), "relay1", False),
+                (at(10, 30), "relay1", True), (at(10, 45), "relay1", False),
+                (at(9, 50), "relay2", True),
+            )
+            async with sessions() as db:
+                for hour in (9, 10, 11):
+                    await _roll_up(db, at(hour), at(hour + 1), False)
+                await db.commit()
+
+            assert await hourly() == {
+                (9, "relay1"): (1, 1800, True),
+                (10, "relay1"): (3, 1800, False),          # off at the start of the hour counts as a flip
+                (9, "relay2"): (1, 600, True),
+                (10, "relay2"): (0, 3600, True),
+                (11, "relay2"): (0, 3600, True),           # carried forward through an hour without events
+            }
+            assert await daily() == {"relay1": (4, 3600), "relay2": (1, 7800)}
+
+            # relay1 switched on at 10:50, reported after 10:00-12:00 were rolled up
+            await add_events((at(10, 50), "relay1", True))
+            async with sessions() as db:
+                await _reroll(db, at(10), at(12))
+                await db.commit()
+
+            rolled = await hourly()
+            assert rolled[(10, "relay1")] == (4, 2400, True)
+            assert rolled[(11, "relay1")] == (0, 3600, True)
+            assert rolled[(11, "relay2")] == (0, 3600, True)
+            assert await daily() == {"relay1": (5, 7800), "relay2": (1, 7800)}
+        finally:
+            async with engine.begin() as conn:
+                await conn.execute(text("DROP TABLE IF EXISTS relay_events_2001_01"))
+                await conn.execute(text("DELETE FROM relay_usage_hourly WHERE device_id = :d"), {"d": device_id})
+                await conn.execute(text("DELETE FROM relay_usage_daily WHERE device_id = :d"), {"d": device_id})
+                await conn.execute(text("DELETE FROM devices WHERE id = :d"), {"d": device_id})
+            await engine.dispose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,76 @@
+import sys
+import os
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add the app directory to sys.path to ensure imports work
+sys.path.append(os.path.join(os.path.dirname(__file__), "../app"))
+
+from core import codec
+from core.rate_limit import RateLimiter
+from core.security import create_access_token
+from core.state_store import state_store
+from api.api_v1.endpoints import websockets
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def by_api_key(api_key):
+        return SimpleNamespace(id="SH-FRAME") if api_key == "frame-key" else None
+
+    monkeypatch.setattr(websockets.device_cache, "by_api_key", by_api_key)
+    app = FastAPI()
+    app.include_router(websockets.router)
+    with TestClient(app) as client:
+        yield client
+    state_store.pop("SH-FRAME")
+
+
+def _state_update(relay, state):
+    return {"type": "state_update", "data": {relay: {"state": state}}}
+
+
+@pytest.mark.skipif(codec.msgpack is None, reason="msgpack not installed")
+def test_json_socket_survives_a_binary_frame(client):
+    with client.websocket_connect("/ws/SH-FRAME?api_key=frame-key") as ws:
+        ws.send_bytes(codec.pack(_state_update("relay1", True)))
+        ws.send_bytes(b"\xc1 not msgpack")
+        ws.send_text(codec.dumps(_state_update("relay2", True)))
+        ws.send_text("[1, 2]")  # valid JSON, not a message
+        ws.send_text(codec.dumps(_state_update("relay3", False)))
+        # Still served: close cleanly after the last frame is handled
+    assert state_store.pop("SH-FRAME") == {
+        "relay1": {"state": True}, "relay2": {"state": True}, "relay3": {"state": False},
+    }
+
+
+@pytest.mark.skipif(codec.msgpack is None, reason="msgpack not installed")
+def test_msgpack_socket_accepts_a_text_frame(client):
+    with client.websocket_connect(
+        "/ws/SH-FRAME?api_key=frame-key", subprotocols=[codec.MSGPACK_SUBPROTOCOL]
+    ) as ws:
+        ws.send_text(codec.dumps(_state_update("relay1", False)))
+        ws.send_bytes(codec.pack(_state_update("relay2", True)))
+    assert state_store.pop("SH-FRAME") == {"relay1": {"state": False}, "relay2": {"state": True}}
+
+
+def test_each_viewer_socket_has_its_own_frame_budget(client, monkeypatch):
+    limiter = RateLimiter("ws", "3/minute")
+    monkeypatch.setattr(websockets, "ws_frame_limiter", limiter)
+    token = create_access_token(42)
+    pong = codec.dumps({"type": "pong"})
+
+    with client.websocket_connect(f"/ws/SH-FRAME?token={token}") as first, \
+            client.websocket_connect(f"/ws/SH-FRAME?token={token}") as second:
+        for _ in range(3):
+            first.send_text(pong)
+            second.send_text(pong)
+    assert (limiter.allowed, limiter.limited) == (6, 0)
+
+    with client.websocket_connect(f"/ws/SH-FRAME?token={token}") as third:
+        for _ in range(3):
+            third.send_text(pong)
+    assert limiter.limited == 0
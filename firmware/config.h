@@ -59,6 +59,7 @@ const unsigned long WIFI_TIMEOUT = 20000;  // 20 seconds
 #define ENABLE_CORS true  // Enable for mobile app integration
 #define ENABLE_CAPTIVE_PORTAL true  // WiFi setup wizard
 #define ENABLE_MDNS true  // Access via http://smarthome.local
+#define ENABLE_MSGPACK_PROTOCOL false  // Compact binary WebSocket frames (backend needs msgpack installed)
 
 // ============= mDNS Configuration =============
 // Access your device from any browser on any device: http://smarthome.local
@@ -24,11 +24,63 @@ const unsigned long PING_INTERVAL = 25000;      // 25s heartbeat
 const unsigned long RECONNECT_INTERVAL = 10000; // retry every 10s if disconnected
 
 // Forward declarations
-void sendStateUpdate();
+void sendStateUpdate(const char* ackId = nullptr);
+
+#ifndef ENABLE_MSGPACK_PROTOCOL
+#define ENABLE_MSGPACK_PROTOCOL false
+#endif
+
+#if ENABLE_MSGPACK_PROTOCOL
+// Compact binary protocol "homecontrol.msgpack.v1" (see backend core/codec.py):
+// every frame is a MessagePack array [type, [relay_index, state, ...]]
+const char* WS_SUBPROTOCOL = "homecontrol.msgpack.v1";
+const int MSG_HEARTBEAT = 0;
+const int MSG_STATE_UPDATE = 1;
+const int MSG_COMMAND = 2;
+const int MSG_UPDATE = 3;
+
+void onBinaryMessage(WebsocketsMessage& message) {
+    StaticJsonDocument<256> doc;
+    if (deserializeMsgPack(doc, message.c_str(), message.length())) return;
+
+    int type = doc[0] | -1;
+    if (type != MSG_COMMAND && type != MSG_UPDATE) return;
+
+    JsonArray relays = doc[1];
+    bool changed = false;
+    for (size_t i = 0; i + 1 < relays.size(); i += 2) {
+        int idx = relays[i].as<int>() - 1;
+        bool newState = relays[i + 1].as<bool>();
+        if (idx < 0 || idx >= 4 || newState == relayStates[idx]) continue;
+        relayStates[idx] = newState;
+        digitalWrite(relayPins[idx], newState ? RELAY_ON : RELAY_OFF);
+        changed = true;
+    }
+
+    #if ENABLE_STATE_PERSISTENCE
+    if (changed) {
+        for (int i = 0; i < 4; i++) {
+            preferences.putBool(String("relay" + String(i)).c_str(), relayStates[i]);
+        }
+    }
+    #endif
+
+    // Confirm commands carrying a correlation id (extras map: {"id": ...})
+    const char* commandId = doc[2]["id"];
+    if (commandId) sendStateUpdate(commandId);
+}
+#endif
 
 // ==================== Message Handling ====================
 
 void onMessageCallback(WebsocketsMessage message) {
+    #if ENABLE_MSGPACK_PROTOCOL
+    if (message.isBinary()) {
+        onBinaryMessage(message);
+        return;
+    }
+    #endif
+
     String data = message.data();
     
     #if ENABLE_SERIAL_DEBUG
@@ -79,10 +131,12 @@ void onMessageCallback(WebsocketsMessage message) {
                 preferences.putBool(String("relay" + String(i)).c_str(), relayStates[i]);
                 #endif
             }
-            // Acknowledge update back to server? 
-            // Usually not needed for broadcast, but good for confirmation.
-            // sendStateUpdate(); // Optional, prevents loops if careful
         }
+
+        // Confirm commands carrying a correlation id so the server can measure
+        // round-trip latency. No loop: the server never echoes state_update back.
+        const char* commandId = doc["id"];
+        if (commandId) sendStateUpdate(commandId);
     }
 }
 
@@ -122,6 +176,15 @@ void initWebSocket() {
     Serial.println(url);
     #endif
     
+    #if ENABLE_MSGPACK_PROTOCOL
+    // Outgoing frames are always MessagePack in this mode, so only enable it
+    // against a backend with msgpack installed. The server decodes each frame
+    // by its own type (binary or text), whatever it negotiated; if it did not
+    // accept the subprotocol, its replies arrive as JSON text and are handled
+    // by the JSON path in onMessageCallback.
+    client.addHeader("Sec-WebSocket-Protocol", WS_SUBPROTOCOL);
+    #endif
+
     // Note: ArduinoWebsockets client.connect() handles the protocol prefix
     client.connect(url);
 }
@@ -132,11 +195,34 @@ void sendHeartbeat() {
     lastPingTime = millis();
     
     // Simple heartbeat/ping
+    #if ENABLE_MSGPACK_PROTOCOL
+    const char heartbeat[] = {(char)0x92, (char)MSG_HEARTBEAT, (char)0x90};  // [0, []]
+    client.sendBinary(heartbeat, sizeof(heartbeat));
+    #else
     client.send("{\"type\":\"heartbeat\"}");
+    #endif
 }
 
-void sendStateUpdate() {
+void sendStateUpdate(const char* ackId) {
     if (!isConnected) return;
+
+    #if ENABLE_MSGPACK_PROTOCOL
+    StaticJsonDocument<192> frame;
+    frame.add(MSG_STATE_UPDATE);
+    JsonArray relays = frame.createNestedArray();
+    for (int i = 0; i < 4; i++) {
+        relays.add(i + 1);
+        relays.add(relayStates[i] == true);
+    }
+    if (ackId) {
+        JsonObject extras = frame.createNestedObject();
+        extras["ack"] = ackId;
+    }
+    char buffer[64];
+    size_t len = serializeMsgPack(frame, buffer, sizeof(buffer));
+    client.sendBinary(buffer, len);
+    return;
+    #endif
     
     StaticJsonDocument<512> doc;
     doc["type"] = "state_update";
@@ -147,6 +233,7 @@ void sendStateUpdate() {
         JsonObject relay = data.createNestedObject(key);
         relay["state"] = (relayStates[i] == true); // explicitly bool
     }
+    if (ackId) doc["ack"] = ackId;
     
     String jsonString;
     serializeJson(doc, jsonString);